@@ -1,12 +1,27 @@
 import csv
+import heapq
+import io
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import boto3
 import click
 import os
 import json
+import orjson
 import pandas as pd
 import sqlite3
 
+RUN_SIZE = 10 ** 6
+BLOCK_SIZE = 128 * 1024 * 1024
+PART_SIZE = 64 * 1024 * 1024
+PROBE_SIZE = 64 * 1024
+RUN_BUFFER_SIZE = 1024 * 1024
+SHARD_SIZE = 256 * 1024 * 1024
+WORKERS = len(os.sched_getaffinity(0))
+TO_PANDAS_TYPES = {"TEXT": "str", "INTEGER": "Int64", "DECIMAL": "Float64"}
+
 
 def download_file_from_s3(s3_path):
     s3 = boto3.client('s3')
@@ -19,22 +34,189 @@ def download_file_from_s3(s3_path):
 def upload_file_to_s3(file_name, s3_path, process_id):
     s3 = boto3.client('s3')
     bucket = s3_path.replace("s3://", "").split("/")[0]
-    key = "bioindex/" + process_id + "/" + file_name
+    key = "bioindex/" + process_id + "/" + os.path.basename(file_name)
     s3.upload_file(file_name, bucket, key)
 
 
+def split_s3_path(s3_path):
+    return s3_path.replace("s3://", "").split("/", 1)
+
+
+_s3_clients = {}
+
+
+def get_s3_client():
+    # one client per process, pool workers must not reuse a client created before the fork
+    pid = os.getpid()
+    if pid not in _s3_clients:
+        _s3_clients[pid] = boto3.client('s3')
+    return _s3_clients[pid]
+
+
+class S3MultipartWriter:
+    """
+    Binary file-like object that uploads everything written to it as the parts of a multipart upload, holding
+    at most part_size bytes in memory.
+    """
+
+    def __init__(self, bucket, key, part_size=PART_SIZE):
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.client = get_s3_client()
+        self.upload_id = self.client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+        self.parts = []
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                           PartNumber=part_number, Body=bytes(self.buffer))
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.buffer or not self.parts:
+            self._upload_part()
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                              MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def local_shards(directory):
+    def open_shard(name):
+        return open(os.path.join(directory, name), 'wb')
+    return open_shard
+
+
+def s3_shards(bucket, prefix, part_size=PART_SIZE):
+    def open_shard(name):
+        return S3MultipartWriter(bucket, prefix + name, part_size)
+    return open_shard
+
+
+class ShardedWriter:
+    """
+    Writes sorted json lines into shards of roughly shard_size bytes named <base_name>-00000.json, ... opened with
+    open_shard. A new shard is only started when the sort key changes so that all rows for a key live in one
+    shard, and every shard's first and last sort key is recorded in the manifest.
+    """
+
+    def __init__(self, open_shard, base_name, shard_size=SHARD_SIZE):
+        self.open_shard = open_shard
+        self.base_name = base_name
+        self.shard_size = shard_size
+        self.shards = []
+        self.current = None
+        self.last_key = None
+
+    def write(self, key, line):
+        if self.current is None or (self.shards[-1]['size'] >= self.shard_size and key != self.last_key):
+            self._next_shard(key)
+        self.current.write(line + b'\n')
+        shard = self.shards[-1]
+        shard['size'] += len(line) + 1
+        shard['records'] += 1
+        shard['last_key'] = key
+        self.last_key = key
+
+    def _next_shard(self, key):
+        if self.current is not None:
+            self.current.close()
+        name = f'{self.base_name}-{len(self.shards):05d}.json'
+        self.current = self.open_shard(name)
+        self.shards.append({'file': name, 'first_key': key, 'last_key': key, 'records': 0, 'size': 0})
+
+    def manifest(self):
+        return {'shards': self.shards}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.current is None:
+            return
+        if exc_type is not None and hasattr(self.current, 'abort'):
+            self.current.abort()
+        else:
+            self.current.close()
+
+
+def write_manifest(bucket, process_id, manifest):
+    get_s3_client().put_object(Bucket=bucket, Key="bioindex/manifests/" + process_id + ".json",
+                               Body=json.dumps(manifest).encode('utf-8'))
+
+
+def source_size(source):
+    if source.startswith('s3://'):
+        bucket, key = split_s3_path(source)
+        return get_s3_client().head_object(Bucket=bucket, Key=key)['ContentLength']
+    return os.path.getsize(source)
+
+
+def read_range(source, start, end):
+    """
+    Reads bytes [start, end) of a local file or, for s3:// sources, with a ranged GET.
+    """
+    if start >= end:
+        return b''
+    if source.startswith('s3://'):
+        bucket, key = split_s3_path(source)
+        obj = get_s3_client().get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end - 1}')
+        return obj['Body'].read()
+    with open(source, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def next_line_start(source, position, size):
+    while position < size:
+        window = read_range(source, position, min(position + PROBE_SIZE, size))
+        newline = window.find(b'\n')
+        if newline >= 0:
+            return position + newline + 1
+        position += len(window)
+    return size
+
+
+def get_delimiter(file_name):
+    return ',' if file_name.endswith('.csv') else '\t'
+
+
 def get_column_names_pandas(csv_file_path):
-    df = pd.read_csv(csv_file_path, nrows=0, sep=',' if csv_file_path.endswith('.csv') else '\t')
+    header = read_range(csv_file_path, 0, next_line_start(csv_file_path, 0, source_size(csv_file_path)))
+    df = pd.read_csv(io.BytesIO(header), nrows=0, sep=get_delimiter(csv_file_path))
     return df.columns.tolist()
 
 
-def sort_file(file_name, columns_to_sort, schema_info):
-    conn = sqlite3.connect('temp.db')
+def check_sort_columns(file_name, columns_to_sort):
     columns = get_column_names_pandas(file_name)
     if not set(columns_to_sort).issubset(set(columns)):
         raise Exception(f"Columns to sort {columns_to_sort} not found in file {file_name}")
-    to_panda_types = {"TEXT": "str", "INTEGER": "Int64", "DECIMAL": "Float64"}
-    schema_info = {k: to_panda_types[v] for k, v in schema_info.items()}
+    return columns
+
+
+def sort_file(file_name, columns_to_sort, schema_info):
+    conn = sqlite3.connect('temp.db')
+    check_sort_columns(file_name, columns_to_sort)
+    schema_info = {k: TO_PANDAS_TYPES[v] for k, v in schema_info.items()}
     for chunk in pd.read_csv(file_name, dtype=schema_info,
                              sep=',' if file_name.endswith('.csv') else '\t', chunksize=10 ** 6):
         chunk.to_sql('data', conn, if_exists='append', index=False)
@@ -53,6 +235,187 @@ def sort_file(file_name, columns_to_sort, schema_info):
     return sorted_file_name
 
 
+def column_values(series):
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def sort_key(values):
+    # nulls sort first, matching sqlite's ORDER BY
+    return tuple((value is not None, value) for value in values)
+
+
+def block_ranges(source, block_size=BLOCK_SIZE):
+    """
+    Splits the data rows of the source (everything after the header) into byte ranges of roughly block_size
+    bytes, each ending on a newline so that every block holds whole rows.
+    """
+    size = source_size(source)
+    ranges = []
+    start = next_line_start(source, 0, size)
+    while start < size:
+        end = next_line_start(source, min(start + block_size, size), size)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def read_typed_chunks(source, schema_info, chunk_size=RUN_SIZE, byte_range=None, columns=None):
+    dtypes = {k: TO_PANDAS_TYPES[v] for k, v in schema_info.items()}
+    if byte_range is None:
+        return pd.read_csv(source, dtype=dtypes, sep=get_delimiter(source), chunksize=chunk_size)
+    block = io.BytesIO(read_range(source, *byte_range))
+    return pd.read_csv(block, dtype=dtypes, sep=get_delimiter(source), chunksize=chunk_size, header=None,
+                       names=columns)
+
+
+def json_lines(chunk):
+    """
+    Converts every column of the chunk to python values once and builds one json document per row from them,
+    rather than converting each cell on its own.
+    """
+    columns = chunk.columns.tolist()
+    values = [column_values(chunk[column]) for column in columns]
+    return [orjson.dumps(dict(zip(columns, row))) for row in zip(*values)]
+
+
+def open_run(run_path, part_size=PART_SIZE):
+    if run_path.startswith('s3://'):
+        bucket, key = split_s3_path(run_path)
+        return S3MultipartWriter(bucket, key, part_size)
+    return open(run_path, 'wb')
+
+
+def write_sorted_runs(source, columns_to_sort, schema_info, run_dir, to_lines, run_size=RUN_SIZE, byte_range=None,
+                      columns=None, run_prefix='run'):
+    """
+    Sorts the source (or the byte_range block of it) in chunks of run_size rows and spills each sorted chunk to
+    its own run file in run_dir, a local directory or an s3:// prefix. Every line of a run is the json encoded
+    sort key, a tab, then the row as produced by to_lines.
+    """
+    run_paths = []
+    for chunk in read_typed_chunks(source, schema_info, run_size, byte_range, columns):
+        chunk = chunk.sort_values(columns_to_sort, na_position='first', kind='stable')
+        keys = zip(*[column_values(chunk[column]) for column in columns_to_sort])
+        lines = to_lines(chunk)
+        run_path = f'{run_dir}/{run_prefix}_{len(run_paths)}'
+        with open_run(run_path) as run:
+            for key, line in zip(keys, lines):
+                run.write(orjson.dumps(key) + b'\t' + line + b'\n')
+        run_paths.append(run_path)
+    return run_paths
+
+
+def read_run(run_path, buffer_size=RUN_BUFFER_SIZE):
+    """
+    Yields the entries of a run, reading it buffer_size bytes at a time so that merging keeps only that much of
+    each run in memory whether the run is local or in s3.
+    """
+    size = source_size(run_path)
+    position = 0
+    rest = b''
+    while position < size:
+        buffer = read_range(run_path, position, min(position + buffer_size, size))
+        position += len(buffer)
+        entries = (rest + buffer).split(b'\n')
+        rest = entries.pop()
+        for entry in entries:
+            key, line = entry.split(b'\t', 1)
+            key = orjson.loads(key)
+            yield sort_key(key), key, line
+
+
+def merge_sorted_runs(run_paths, buffer_size=RUN_BUFFER_SIZE):
+    """
+    Yields the (sort key, row) of every run entry in sorted order.
+    """
+    runs = [read_run(run_path, buffer_size) for run_path in run_paths]
+    for _, key, line in heapq.merge(*runs, key=lambda entry: entry[0]):
+        yield key, line
+
+
+def delete_runs(run_paths):
+    client = get_s3_client()
+    keys = [split_s3_path(run_path) for run_path in run_paths]
+    for start in range(0, len(keys), 1000):
+        bucket = keys[start][0]
+        client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for _, key in
+                                                                 keys[start:start + 1000]]})
+
+
+def sort_block(source, byte_range, columns, columns_to_sort, schema_info, run_dir, run_size, run_prefix):
+    return write_sorted_runs(source, columns_to_sort, schema_info, run_dir, json_lines, run_size, byte_range,
+                             columns, run_prefix)
+
+
+def convert_block(source, byte_range, columns, columns_to_sort, schema_info, chunk_size):
+    keys = []
+    lines = []
+    for chunk in read_typed_chunks(source, schema_info, chunk_size, byte_range, columns):
+        keys.extend(list(key) for key in zip(*[column_values(chunk[column]) for column in columns_to_sort]))
+        lines.extend(json_lines(chunk))
+    return keys, lines
+
+
+def ordered_results(pool, fn, arg_lists, window):
+    """
+    Yields fn(*args) for every entry of arg_lists in order, keeping at most window calls in flight on the pool.
+    """
+    pending = deque()
+    for args in arg_lists:
+        pending.append(pool.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def worker_pool(workers):
+    # a single worker runs on a thread of this process, a pool of one process would only add the cost of
+    # shipping every block between processes
+    return ThreadPoolExecutor(1) if workers == 1 else ProcessPoolExecutor(workers)
+
+
+def sort_and_convert(source, writer, columns_to_sort, schema_info, run_size=RUN_SIZE, workers=WORKERS,
+                     block_size=BLOCK_SIZE, run_dir=None):
+    """
+    Writes the sorted rows of the source to the ShardedWriter straight out as json lines, the runs already hold
+    converted json rows so there is no intermediate sorted csv to write and parse again. Runs are produced from
+    newline aligned blocks of the source in a pool of worker processes and merged here. The runs go to run_dir
+    when it is an s3:// prefix, and are deleted once merged, otherwise to a local temporary directory, which then
+    needs about as much space as the converted source.
+    """
+    columns = check_sort_columns(source, columns_to_sort)
+    ranges = block_ranges(source, block_size)
+    with tempfile.TemporaryDirectory(dir='.') as local_dir, worker_pool(workers) as pool:
+        run_dir = run_dir or local_dir
+        futures = [pool.submit(sort_block, source, byte_range, columns, columns_to_sort, schema_info, run_dir,
+                               run_size, f'block_{i}') for i, byte_range in enumerate(ranges)]
+        run_paths = []
+        try:
+            for future in futures:
+                run_paths.extend(future.result())
+            for key, line in merge_sorted_runs(run_paths):
+                writer.write(key, line)
+        finally:
+            if run_dir.startswith('s3://') and run_paths:
+                delete_runs(run_paths)
+
+
+def convert_sorted(source, writer, columns_to_sort, schema_info, chunk_size=RUN_SIZE, workers=WORKERS,
+                   block_size=BLOCK_SIZE):
+    """
+    Converts newline aligned blocks of an already sorted source in a pool of worker processes and writes the
+    converted blocks to the ShardedWriter in source order.
+    """
+    columns = check_sort_columns(source, columns_to_sort)
+    ranges = block_ranges(source, block_size)
+    with worker_pool(workers) as pool:
+        args = [(source, byte_range, columns, columns_to_sort, schema_info, chunk_size) for byte_range in ranges]
+        for keys, lines in ordered_results(pool, convert_block, args, workers + 1):
+            for key, line in zip(keys, lines):
+                writer.write(key, line)
+
+
 def convert_to_type(val, col, mapping):
     if val is None or val == '':
         return None
@@ -73,23 +436,76 @@ def csv_to_jsonl(csv_file_path, jsonl_file_path, mapping):
             jsonl_file.write(json.dumps(row_dict) + '\n')
 
 
+def convert(source, writer, columns_to_sort, schema_info, already_sorted, run_size=RUN_SIZE, workers=WORKERS,
+            block_size=BLOCK_SIZE, run_dir=None):
+    if already_sorted:
+        print("Converting to json")
+        convert_sorted(source, writer, columns_to_sort, schema_info, run_size, workers, block_size)
+    else:
+        print("Sorting and converting to json")
+        sort_and_convert(source, writer, columns_to_sort, schema_info, run_size, workers, block_size, run_dir)
+
+
+def convert_streaming(s3_path, columns_to_sort, schema_info, already_sorted, process_id, run_size=RUN_SIZE,
+                      workers=WORKERS, block_size=BLOCK_SIZE, shard_size=SHARD_SIZE, part_size=PART_SIZE):
+    """
+    Reads the source object with ranged GETs and writes the json shards through multipart uploads as they are
+    produced. The sort runs go to s3 as well, under bioindex/runs/<process_id>/ where the indexer doesn't look,
+    so nothing is staged on local disk whatever the size of the source. Merging holds RUN_BUFFER_SIZE bytes of
+    every run in memory, and there is a run for every run_size rows of each block.
+    """
+    bucket, key = split_s3_path(s3_path)
+    run_dir = f"s3://{bucket}/bioindex/runs/{process_id}"
+    with ShardedWriter(s3_shards(bucket, "bioindex/" + process_id + "/", part_size), key.split('/')[-1][:-4],
+                       shard_size) as writer:
+        convert(s3_path, writer, columns_to_sort, schema_info, already_sorted, run_size, workers, block_size,
+                run_dir)
+    write_manifest(bucket, process_id, dict(writer.manifest(), source=s3_path, sort_columns=columns_to_sort))
+
+
 @click.command()
 @click.option('--s3_path', '-s', type=str, required=True)
 @click.option('--columns_to_sort', '-c', type=str, required=True)
 @click.option('--schema', '-a', type=str, required=True)
 @click.option('--already_sorted', '-o', type=bool, required=True)
 @click.option('--process_id', '-p', type=str, required=True)
-def main(s3_path, columns_to_sort, schema, already_sorted, process_id):
+@click.option('--sort_mode', '-m', type=click.Choice(['external', 'sqlite']), default='external')
+@click.option('--run_size', '-r', type=int, default=RUN_SIZE)
+@click.option('--workers', '-w', type=int, default=WORKERS)
+@click.option('--block_size', '-b', type=int, default=BLOCK_SIZE)
+@click.option('--shard_size', '-z', type=int, default=SHARD_SIZE)
+@click.option('--stream/--no-stream', default=False)
+def main(s3_path, columns_to_sort, schema, already_sorted, process_id, sort_mode, run_size, workers, block_size,
+         shard_size, stream):
     sorted_file = None
     schema_info = json.loads(schema)
     columns_to_sort = columns_to_sort.split(',')
 
+    if stream and sort_mode == 'external':
+        convert_streaming(s3_path, columns_to_sort, schema_info, already_sorted, process_id, run_size, workers,
+                          block_size, shard_size)
+        print("finished")
+        return
+
     local_file = download_file_from_s3(s3_path)
+    if sort_mode == 'external':
+        with tempfile.TemporaryDirectory(dir='.') as shard_dir:
+            with ShardedWriter(local_shards(shard_dir), local_file[:-4], shard_size) as writer:
+                convert(local_file, writer, columns_to_sort, schema_info, already_sorted, run_size, workers,
+                        block_size)
+            print("Uploading json to s3")
+            for shard in writer.shards:
+                upload_file_to_s3(os.path.join(shard_dir, shard['file']), s3_path, process_id)
+        bucket, _ = split_s3_path(s3_path)
+        write_manifest(bucket, process_id, dict(writer.manifest(), source=s3_path, sort_columns=columns_to_sort))
+        os.remove(local_file)
+        print("finished")
+        return
+
+    json_file = local_file[:-3] + 'json'
     if not already_sorted:
         print("Sorting file")
         sorted_file = sort_file(local_file, columns_to_sort, schema_info)
-
-    json_file = local_file[:-3] + 'json'
     print("Converting to json")
     csv_to_jsonl(local_file if already_sorted else sorted_file, json_file, schema_info)
 
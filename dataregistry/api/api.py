@@ -1,27 +1,29 @@
+import asyncio
 import io
 import json
 import logging
 import os
 import re
 import subprocess
+import uuid
+import zlib
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from uuid import UUID
 
 import fastapi
 import requests
-import smart_open
 import sqlalchemy
 import xmltodict
 from botocore.exceptions import ClientError
-from fastapi import Depends, Body, Header, Query, UploadFile
-from starlette.background import BackgroundTasks
+from fastapi import Depends, Body, Header, Query, UploadFile, Path
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
-from starlette.responses import StreamingResponse, Response, RedirectResponse
+from starlette.responses import StreamingResponse, Response, RedirectResponse, JSONResponse
 from streaming_form_data import StreamingFormDataParser
-from streaming_form_data.targets import S3Target
 
-from dataregistry.api import query, s3, file_utils, ecs, bioidx, batch
+from dataregistry.api import query, s3, file_utils, ecs, bioidx, batch, validation_pool, logs, job_tracker, \
+    s3_copy
 from dataregistry.api.db import DataRegistryReadWriteDB
 from dataregistry.api.google_oauth import get_google_user
 from dataregistry.api.hermes_file_validation import validate_file
@@ -29,8 +31,11 @@ from dataregistry.api.jwt_utils import get_encoded_jwt_data, get_decoded_jwt_dat
 from dataregistry.api.model import DataSet, Study, SavedDatasetInfo, SavedDataset, UserCredentials, User, SavedStudy, \
     CreateBiondexRequest, CsvBioIndexRequest, BioIndexCreationStatus, SavedCsvBioIndexRequest, HermesFileStatus, \
     HermesUploadStatus, NewUserRequest, StartAggregatorRequest, MetaAnalysisRequest, QCHermesFileRequest, \
-    QCScriptOptions, HermesPhenotype
+    QCScriptOptions, HermesPhenotype, Ancestry, DataFormat, GenomeBuild, \
+    UploadSessionRequest, UploadSessionKind, UploadSession, FileStats
 from dataregistry.api.phenotypes import get_phenotypes
+from dataregistry.api.ttl_cache import TTLCache
+from dataregistry.api.upload_target import MultipartS3Target, MAX_PART_SIZE, object_stats
 from dataregistry.api.validators import HermesValidator
 
 HERMES_VALIDATOR = HermesValidator()
@@ -42,6 +47,13 @@ VIEW_ALL_ROLES = {SUPER_USER, 'analyst', 'reviewer'}
 AUTH_COOKIE_NAME = 'dr_auth_token'
 AGGREGATOR_API_SECRET = os.getenv('AGGREGATOR_API_SECRET')
 AGGREGATOR_BRANCH = os.getenv('AGGREGATOR_BRANCH', 'dh-meta-analysis-testing-qa')
+# session parts are held in memory while they go to s3
+UPLOAD_SESSION_MAX_PART_SIZE = int(os.getenv('UPLOAD_SESSION_MAX_PART_SIZE', str(MAX_PART_SIZE)))
+# an open session that hasn't had a part for this long is aborted along with its multipart upload
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv('UPLOAD_SESSION_TTL_SECONDS', str(24 * 60 * 60)))
+UPLOAD_SESSION_SWEEP_SECONDS = 60 * 60
+# checks every value of the mapped columns of a HERMES upload before it is sent to QC
+HERMES_VALIDATE_UPLOADS = os.getenv('HERMES_VALIDATE_UPLOADS', 'true').lower() == 'true'
 
 router = fastapi.APIRouter()
 
@@ -61,6 +73,10 @@ logger.info("Starting API")
 NIH_API_EMAIL = "dhite@broadinstitute.org"
 NIH_API_TOOL_NAME = "data-registry"
 
+# download links resolve to the same s3 path until the file is deleted or its dataset changes
+file_paths = TTLCache(ttl=600)
+hermes_file_paths = TTLCache(ttl=600)
+
 
 async def get_current_user_quiet(request: Request, authorization: Optional[str] = Header(None)):
     try:
@@ -89,12 +105,25 @@ async def get_current_user(request: Request, authorization: Optional[str] = Head
 
 
 @router.get('/datasets', response_class=fastapi.responses.ORJSONResponse)
-async def api_datasets(user: User = Depends(get_current_user)):
+async def api_datasets(user: User = Depends(get_current_user), limit: Optional[int] = Query(None, gt=0, le=1000),
+                       cursor: Optional[str] = None, ancestry: Optional[Ancestry] = None,
+                       data_type: Optional[DataFormat] = None, genome_build: Optional[GenomeBuild] = None,
+                       study_id: Optional[str] = None, publicly_available: Optional[bool] = None,
+                       fields: Optional[List[str]] = Query(None)):
+    """
+    Without any paging, filter or field parameters this returns every dataset the user can view as a list.
+    Otherwise it returns a page of datasets and the cursor to pass for the next one.
+    """
+    filters = {'ancestry': ancestry, 'data_type': data_type, 'genome_build': genome_build, 'study_id': study_id,
+               'publicly_available': publicly_available}
+    view_all = VIEW_ALL_ROLES.intersection(user.roles)
     try:
-        if VIEW_ALL_ROLES.intersection(user.roles):
-            return query.get_all_datasets(engine)
-        else:
-            return query.get_all_datasets_for_user(engine, user)
+        if limit is None and cursor is None and fields is None and all(v is None for v in filters.values()):
+            if view_all:
+                return query.get_all_datasets(engine)
+            else:
+                return query.get_all_datasets_for_user(engine, user)
+        return query.get_datasets_page(engine, filters, None if view_all else user.id, fields, limit, cursor)
     except ValueError as e:
         raise fastapi.HTTPException(status_code=400, detail=str(e))
 
@@ -115,10 +144,9 @@ async def update_bioindex_tracking(req_id, new_status: BioIndexCreationStatus):
 
 
 @router.post('/enqueue-csv-process', response_class=fastapi.responses.ORJSONResponse)
-async def enqueue_csv_process(request: SavedCsvBioIndexRequest, background_tasks: BackgroundTasks):
-    background_tasks.add_task(ecs.run_ecs_sort_and_convert_job, request.s3_path, request.column,
-                              request.data_types, request.already_sorted, request.name)
-    query.update_bioindex_tracking(engine, request.name, BioIndexCreationStatus.SUBMITTED_FOR_PROCESSING)
+async def enqueue_csv_process(request: SavedCsvBioIndexRequest):
+    await run_in_threadpool(ecs.run_ecs_sort_and_convert_job, request.s3_path, request.column, request.data_types,
+                            request.already_sorted, request.name)
     return {"message": "Successfully enqueued csv processing"}
 
 
@@ -127,7 +155,8 @@ async def create_bioindex(request: CreateBiondexRequest):
     dataset = query.get_dataset(engine, request.dataset_id)
     s3_path = f"{dataset.name}/"
     idx_name = str(request.dataset_id)
-    bioidx.create_new_bioindex(engine, request.dataset_id, s3_path, request.schema_desc)
+    await run_in_threadpool(bioidx.create_new_bioindex, engine, request.dataset_id, s3_path, request.schema_desc,
+                            request.skip_unchanged)
     return {"message": f"Successfully created index {idx_name}"}
 
 
@@ -163,30 +192,79 @@ async def preview_files(file: UploadFile):
     else:
         sample_lines = await file_utils.get_text_sample(file)
 
-    df = await file_utils.parse_file(io.StringIO('\n'.join(sample_lines)), file.filename)
-    dupes = find_dupe_cols(sample_lines[0], ".csv" in file.filename, df.columns)
+    df = await parse_sample(sample_lines, file.filename)
+    return {"columns": [column for column in df.columns]}
+
+
+@router.get("/preview-delimited-file/s3")
+async def preview_s3_file(key: str, sample_kb: int = Query(64, gt=0, le=1024),
+                          user: User = Depends(get_current_user)):
+    """
+    Previews a file already in the data registry bucket, such as a HERMES upload, from a ranged read of its first
+    sample_kb KB instead of the whole file. Types are inferred from the first row of the sample with a value. Only
+    the HERMES uploader, the owner of a dataset with a file at the key and users who can view everything may preview.
+    """
+    check_key_access(key, user)
+    try:
+        sample, complete = await run_in_threadpool(s3.get_file_start, key, s3.BASE_BUCKET, sample_kb * 1024)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            raise fastapi.HTTPException(status_code=404, detail=f"No file at {key}")
+        raise
+    try:
+        sample_lines = file_utils.get_sample_lines(sample, complete)
+    except zlib.error:
+        raise fastapi.HTTPException(status_code=400, detail=f"{key} is not a readable gzip file")
+    df = await parse_sample(sample_lines, key)
+    return {"columns": [column for column in df.columns],
+            "types": {column: file_utils.infer_data_type(values.dropna().iloc[0]) if values.notna().any() else 'TEXT'
+                      for column, values in df.items()}}
+
+
+def check_key_access(key: str, user: User):
+    if VIEW_ALL_ROLES.intersection(user.roles):
+        return
+    uploaders, dataset_owners = query.get_file_key_owners(engine, key, f"s3://{s3.BASE_BUCKET}/{key}")
+    if user.user_name not in uploaders and user.id not in dataset_owners:
+        raise fastapi.HTTPException(status_code=403, detail=f"You don't have permission to read {key}")
+
+
+async def parse_sample(sample_lines: List[str], file_name: str):
+    if not sample_lines:
+        raise fastapi.HTTPException(detail=f"{file_name} has no complete lines to preview", status_code=400)
+    try:
+        df = await file_utils.parse_file(io.StringIO('\n'.join(sample_lines)), file_name)
+    except ValueError as e:
+        raise fastapi.HTTPException(detail=str(e), status_code=400)
+    dupes = find_dupe_cols(sample_lines[0], ".csv" in file_name, df.columns)
     if len(dupes) > 0:
         duped_col_str = ', '.join(set([re.sub(r"\.\d+$", '', dupe) for dupe in dupes]))
         raise fastapi.HTTPException(detail=f"{duped_col_str} specified more than once", status_code=400)
-    return {"columns": [column for column in df.columns]}
+    return df
 
 
 @router.get('/datasets/{dataset_id}', response_class=fastapi.responses.ORJSONResponse)
 async def api_datasets(dataset_id: UUID, user: User = Depends(get_current_user)):
+    owner_id = None if VIEW_ALL_ROLES.intersection(user.roles) else user.id
     try:
-        check_perms(str(dataset_id), user, "You don't have permission to dataset")
-        ds = query.get_dataset(engine, dataset_id)
-        study = query.get_study_for_dataset(engine, ds.study_id)
-        phenotypes = query.get_phenotypes_for_dataset(engine, dataset_id)
-        credible_sets = query.get_credible_sets_for_dataset(engine, [phenotype.id for phenotype in phenotypes])
-        return SavedDatasetInfo(
-            **{'dataset': ds, 'study': study, 'phenotypes': phenotypes, 'credible_sets': credible_sets})
+        return query.get_dataset_info(engine, dataset_id, owner_id)
     except KeyError:
         raise fastapi.HTTPException(status_code=400, detail=f'Invalid index: {dataset_id}')
     except ValueError as e:
+        if owner_id is not None:
+            raise fastapi.HTTPException(status_code=401, detail="You don't have permission to dataset")
         raise fastapi.HTTPException(status_code=404, detail=str(e))
 
 
+@router.get('/dataset-details', response_class=fastapi.responses.ORJSONResponse)
+async def api_dataset_details(ids: List[UUID] = Query(...), user: User = Depends(get_current_user)):
+    """
+    Details for many datasets at once, datasets the user can't view are left out
+    """
+    owner_id = None if VIEW_ALL_ROLES.intersection(user.roles) else user.id
+    return query.get_dataset_infos(engine, ids, owner_id)
+
+
 @router.post("/google-login", response_class=fastapi.responses.ORJSONResponse)
 async def google_login(response: Response, body: dict = Body(...)):
     user_info = get_google_user(body.get('code'))
@@ -232,15 +310,100 @@ async def api_publications(pub_id: str):
             'pages': pages, 'elocation_id': get_elocation_id(article_meta)}
 
 
-@router.post("/upload-csv")
-async def upload_csv(request: Request):
-    filename = request.headers.get('Filename')
+async def receive_upload(request: Request, target: MultipartS3Target) -> Tuple[int, FileStats]:
+    """
+    Streams the file field of a multipart form request into the target, uploading parts in parallel as they fill.
+    Returns the size of the request body and the stats of the file gathered as it streamed, leaving the upload to be
+    committed or aborted.
+    """
     parser = StreamingFormDataParser(request.headers)
-    parser.register("file", GzipS3Target(s3.get_file_path("bioindex/uploads", filename), mode='wb'))
+    parser.register("file", target)
+    await target.open()
     file_size = 0
     async for chunk in request.stream():
         file_size += len(chunk)
         parser.data_received(chunk)
+        await target.drain()
+    return file_size, await target.finish_parts()
+
+
+def get_content_length(request: Request) -> Optional[int]:
+    content_length = request.headers.get('Content-Length')
+    return int(content_length) if content_length else None
+
+
+async def stream_upload(request: Request, directory: str, filename: str) -> Tuple[int, FileStats]:
+    target = MultipartS3Target(directory, filename, get_content_length(request))
+    try:
+        file_size, stats = await receive_upload(request, target)
+        await target.commit()
+    except BaseException:
+        await target.abort()
+        raise
+    return file_size, stats
+
+
+def claim_blob(sha256: str) -> str:
+    return query.claim_blob(engine, sha256, f"s3://{s3.BASE_BUCKET}/{s3.blob_key(sha256)}")
+
+
+def release_blob(sha256: str):
+    query.release_blob(engine, sha256, s3.delete_paths)
+
+
+def store_blob(key: str, size: int, sha256: str) -> str:
+    """
+    Claims the blob for a file already in S3 at key, then moves the file to the blob's path or drops it because the
+    content is already stored. Returns the blob's s3 path, the claim is given back if the file can't be stored.
+    """
+    s3_path = claim_blob(sha256)
+    try:
+        if s3.path_exists(s3_path):
+            logger.info(f"{key} has the same content as {s3_path}, not storing it again")
+            s3.delete_paths([f"s3://{s3.BASE_BUCKET}/{key}"])
+        else:
+            # the blob's claim is held, but its file went with a failed upload
+            s3_copy.move_object(key, s3.split_path(s3_path)[1], size)
+    except Exception:
+        release_blob(sha256)
+        raise
+    return s3_path
+
+
+async def stream_blob_upload(request: Request, filename: str) -> Tuple[int, FileStats, str]:
+    """
+    Stores the uploaded file under its sha256, so every upload with the same content shares one object that no upload
+    can overwrite with something else. The file streams to a key of its own while it is hashed, then its blob is
+    claimed and the file is either dropped because the content is already stored or moved to the blob's path.
+    Returns the size of the request body, the file's stats and the s3 path holding the content. The caller owns the
+    claim and has to save a row with the sha256 or release_blob it.
+    """
+    target = MultipartS3Target(s3.UPLOADS_PREFIX, uuid.uuid4().hex, get_content_length(request))
+    try:
+        file_size, stats = await receive_upload(request, target)
+        s3_path = await run_in_threadpool(claim_blob, stats.sha256)
+    except BaseException:
+        await target.abort()
+        raise
+    try:
+        if await run_in_threadpool(s3.path_exists, s3_path):
+            logger.info(f"{filename} has the same content as {s3_path}, not storing it again")
+            await target.abort()
+        else:
+            await target.commit()
+            # an identical upload finishing at the same time moves the same bytes to the same key
+            await run_in_threadpool(s3_copy.move_object, f"{target.directory}/{target.filename}",
+                                    s3.split_path(s3_path)[1], target.size)
+    except BaseException:
+        await run_in_threadpool(release_blob, stats.sha256)
+        raise
+    return file_size, stats, s3_path
+
+
+@router.post("/upload-csv")
+async def upload_csv(request: Request):
+    filename = request.headers.get('Filename')
+    file_size, _ = await stream_upload(request, "bioindex/uploads", filename)
     return {"file_size": file_size, "s3_path": s3.get_file_path("bioindex/uploads", filename)}
 
 
@@ -282,7 +445,7 @@ def check_hermes_admin_perms(user):
 async def start_aggregator(req: StartAggregatorRequest, authorization: Optional[str] = Header(None),
                            user: Optional[User] = Depends(get_current_user_quiet)):
     if authorization == AGGREGATOR_API_SECRET or (user and VIEW_ALL_ROLES.intersection(user.roles)):
-        job_id = batch.submit_aggregator_job(req.branch, req.method, req.args)
+        job_id = await run_in_threadpool(batch.submit_aggregator_job, req.branch, req.method, req.args)
         return {"job_id": job_id}
     else:
         raise fastapi.HTTPException(status_code=403, detail="You don't have permission to perform this action")
@@ -297,22 +460,33 @@ async def get_metanalyses(user: User = Depends(get_current_user)):
 
 
 @router.get("/hermes-meta-analysis/{ma_id}")
-async def get_metanalysis(ma_id: UUID, user: User = Depends(get_current_user)):
+async def get_metanalysis(ma_id: UUID, user: User = Depends(get_current_user), include_log: bool = False):
     if check_hermes_admin_perms(user):
-        return query.get_meta_analysis(engine, ma_id)
+        return query.get_meta_analysis(engine, ma_id, include_log)
     else:
         raise fastapi.HTTPException(status_code=403, detail="You need to be a reviewer")
 
 
+@router.get("/hermes-meta-analysis/{ma_id}/log")
+async def get_metanalysis_log(ma_id: UUID, request: Request, tail: Optional[int] = Query(None, gt=0),
+                              user: User = Depends(get_current_user)):
+    if not check_hermes_admin_perms(user):
+        raise fastapi.HTTPException(status_code=403, detail="You need to be a reviewer")
+    return log_response(query.get_meta_analysis_log(engine, ma_id), request.headers.get('Range'), tail)
+
+
 @router.delete("/hermes-delete-dataset/{ds_id}", status_code=204)
 async def delete_dataset(ds_id: UUID, user: User = Depends(get_current_user)):
     if not check_hermes_admin_perms(user):
         raise fastapi.HTTPException(status_code=403, detail="You don't have permission to perform this action")
-    query.delete_hermes_dataset(engine, ds_id)
+    deleted = await run_in_threadpool(query.delete_hermes_dataset, engine, ds_id, s3.delete_paths)
+    for file_id, s3_path, file_name in deleted:
+        hermes_file_paths.pop(file_id)
+        s3.signed_urls.pop((s3.BASE_BUCKET, s3_path, file_name))
 
 
 @router.post("/hermes-meta-analysis")
-async def start_metanalysis(req: MetaAnalysisRequest, background: BackgroundTasks,
+async def start_metanalysis(req: MetaAnalysisRequest,
                             user: Optional[User] = Depends(get_current_user)):
     if not check_hermes_admin_perms(user):
         raise fastapi.HTTPException(status_code=403, detail="You don't have permission to perform this action")
@@ -326,40 +500,48 @@ async def start_metanalysis(req: MetaAnalysisRequest, background: BackgroundTask
         query.save_dataset_name(engine, ds_name, ancestry)
         last_ancestry = ancestry
     paths_to_copy = [query.get_path_for_ds(engine, ds) for ds in req.datasets]
-    s3.clear_variants_raw()
-    s3.clear_variants_processed()
-    s3.clear_meta_analysis()
-    s3.clear_variants()
-    for path in paths_to_copy:
-        path_parts = path.split('/')
-        s3.copy_files_for_meta_analysis(f"hermes/{path_parts[1]}/",
-                                        f"hermes/variants_raw/GWAS/{path_parts[1]}/{req.phenotype}")
-    background.add_task(batch.submit_and_await_job, engine,
-                        {
-                            'jobName': 'aggregator-web',
-                            'jobQueue': 'aggregator-web-api-queue',
-                            'jobDefinition': 'aggregator-web-job',
-                            'parameters': {
-                                'bucket': s3.BASE_BUCKET,
-                                'phenotype': req.phenotype,
-                                'ancestry': last_ancestry,
-                                'guid': str(ma_id),
-                                'branch': AGGREGATOR_BRANCH,
-                                'method': req.method,
-                                'args': '--no-insert-runs --yes --clusters=1',
-                            }}, query.update_meta_analysis_log, ma_id.replace('-', ''), is_qc=False)
+    prefixes = [(f"hermes/{path.split('/')[1]}/", f"hermes/variants_raw/GWAS/{path.split('/')[1]}/{req.phenotype}")
+                for path in paths_to_copy]
+    # the staging tracker copies the inputs in and submits the job once no other meta-analysis is using the prefixes
+    await run_in_threadpool(query.insert_meta_analysis_staging, engine, ma_id, prefixes, {
+        'jobName': 'aggregator-web',
+        'jobQueue': 'aggregator-web-api-queue',
+        'jobDefinition': 'aggregator-web-job',
+        'parameters': {
+            'bucket': s3.BASE_BUCKET,
+            'phenotype': req.phenotype,
+            'ancestry': last_ancestry,
+            'guid': str(ma_id),
+            'branch': AGGREGATOR_BRANCH,
+            'method': req.method,
+            'args': '--no-insert-runs --yes --clusters=1',
+        }})
     return {'meta-analysis-id': ma_id}
 
 
+@router.get("/hermes-meta-analysis/{ma_id}/staging")
+async def get_metanalysis_staging(ma_id: str, user: User = Depends(get_current_user)):
+    if not check_hermes_admin_perms(user):
+        raise fastapi.HTTPException(status_code=403, detail="You need to be a reviewer")
+    staging = await run_in_threadpool(query.get_meta_analysis_staging, engine, ma_id)
+    if staging is None:
+        raise fastapi.HTTPException(status_code=404, detail=f"No staging for {ma_id}")
+    return staging.dict(exclude={'meta_analysis_id', 'prefixes', 'job_config'})
+
+
 @router.get("/hermes-phenotypes")
 async def get_hermes_phenotypes() -> dict:
     return {"data": query.get_hermes_phenotypes(engine)}
 
 @router.get("/get-hermes-pre-signed-url")
-async def get_hermes_pre_signed_url(request: Request):
+async def get_hermes_pre_signed_url(request: Request, user: User = Depends(get_current_user)):
     filename = request.headers.get('Filename')
     dataset = request.headers.get('Dataset')
     s3_path = f"hermes/{dataset}/{filename}"
+    # the key is recorded so its uploader can preview it before validate-hermes saves the upload
+    if not VIEW_ALL_ROLES.intersection(user.roles) and \
+            not await run_in_threadpool(query.claim_hermes_upload_key, engine, s3_path, user.user_name):
+        raise fastapi.HTTPException(status_code=403, detail=f"{s3_path} belongs to another user")
     try:
         presigned_url = s3.generate_presigned_url(
             'put_object',
@@ -372,7 +554,7 @@ async def get_hermes_pre_signed_url(request: Request):
 
 
 @router.patch("/hermes-rerun-qc/{file_id}")
-async def rerun_hermes_qc(request: QCScriptOptions, file_id, background_tasks: BackgroundTasks, user: User = Depends(get_current_user)):
+async def rerun_hermes_qc(request: QCScriptOptions, file_id, user: User = Depends(get_current_user)):
     if not VIEW_ALL_ROLES.intersection(user.roles) and not query.get_file_owner(engine, file_id) == user.user_name:
         raise fastapi.HTTPException(status_code=401, detail='you aren\'t authorized')
 
@@ -382,73 +564,137 @@ async def rerun_hermes_qc(request: QCScriptOptions, file_id, background_tasks: B
     script_options = {k: v for k, v in request.dict().items() if v is not None}
 
     query.update_file_qc_options(engine, no_dashes_ids, script_options)
-    s3_path = f"hermes/{file_upload.dataset_name}/{file_upload.file_name}"
-    background_tasks.add_task(batch.submit_and_await_job, engine, {
+    await run_in_threadpool(job_tracker.submit_job, engine, {
         'jobName': 'hermes-qc-job',
         'jobQueue': 'hermes-qc-job-queue',
         'jobDefinition': 'hermes-qc-job',
         'parameters': {
-            's3-path': f"s3://{s3.BASE_BUCKET}/{s3_path}",
+            's3-path': f"s3://{s3.BASE_BUCKET}/{file_upload.s3_path}",
+            'file-name': file_upload.file_name,
             'file-guid': file_id,
             'col-map': json.dumps(file_upload.metadata["column_map"]),
             'script-options': json.dumps(script_options)
-        }}, query.update_file_upload_qc_log, file_id, True)
+        }}, job_tracker.QC_JOB, file_id)
 
 
 @router.get("/hermes-past-metadata")
 async def get_hermes_past_metadata(user: User = Depends(get_current_user)):
     return query.retrieve_meta_data_mapping(engine, user.user_name)
 
-@router.post("/validate-hermes")
-async def validate_hermes_csv(request: QCHermesFileRequest, background_tasks: BackgroundTasks,
-                            user: User = Depends(get_current_user)):
-
-
+def validate_and_save_hermes_file(request: QCHermesFileRequest, user_name: str) -> dict:
     dataset = request.dataset
     filename = request.file_name
     s3_path = f"hermes/{dataset}/{filename}"
 
     metadata = request.metadata
-    validation_errors, file_size = await validate_file(f"s3://{s3.BASE_BUCKET}/{s3_path}", metadata.get('column_map'))
+    validation_errors, file_size = validate_file(f"s3://{s3.BASE_BUCKET}/{s3_path}", metadata.get('column_map'),
+                                                 HERMES_VALIDATE_UPLOADS)
     if validation_errors:
         return {"errors": validation_errors}
 
     script_options = {k: v for k, v in request.qc_script_options.dict().items() if v is not None}
     s3.upload_metadata(metadata, f"hermes/{dataset}")
-    file_guid = query.save_file_upload_info(engine, dataset, metadata, s3_path, filename, file_size, user.user_name,
-                                            script_options)
+    # the upload url's key can be written again, so the file is kept as a blob like the other uploads
+    stats = object_stats(s3_path)
+    _, s3_path = s3.split_path(store_blob(s3_path, file_size, stats.sha256))
+    try:
+        file_guid = query.save_file_upload_info(engine, dataset, metadata, s3_path, filename, file_size, user_name,
+                                                script_options, stats.sha256)
+    except Exception:
+        release_blob(stats.sha256)
+        raise
 
     # Submit the batch job for further processing
-    background_tasks.add_task(batch.submit_and_await_job, engine, {
+    job_tracker.submit_job(engine, {
         'jobName': 'hermes-qc-job',
         'jobQueue': 'hermes-qc-job-queue',
         'jobDefinition': 'hermes-qc-job',
         'parameters': {
             's3-path': f"s3://{s3.BASE_BUCKET}/{s3_path}",
+            'file-name': filename,
             'file-guid': file_guid,
             'col-map': json.dumps(metadata["column_map"]),
             'script-options': json.dumps(script_options)
-        }}, query.update_file_upload_qc_log, file_guid, True)
+        }}, job_tracker.QC_JOB, file_guid)
 
     return {"file_size": file_size, "s3_path": s3_path, "file_id": file_guid}
 
 
+@router.post("/validate-hermes")
+async def validate_hermes_csv(request: QCHermesFileRequest, user: User = Depends(get_current_user)):
+    busy = validation_pool.is_busy()
+    job_id = await run_in_threadpool(validation_pool.submit, engine, user.user_name, validate_and_save_hermes_file,
+                                     request, user.user_name)
+    result = None if busy else await validation_pool.wait(engine, job_id)
+    if result is None:
+        job = await run_in_threadpool(validation_pool.get_job, engine, job_id)
+        return JSONResponse(status_code=202, content=validation_pool.job_status(job))
+    return result
+
+
+@router.get("/validate-hermes/{job_id}")
+async def fetch_hermes_validation(job_id: str, user: User = Depends(get_current_user)):
+    job = await run_in_threadpool(validation_pool.get_job, engine, job_id)
+    if job is None or job['user_name'] != user.user_name:
+        raise fastapi.HTTPException(status_code=404, detail=f'Invalid validation job: {job_id}')
+    return validation_pool.job_status(job)
+
+
 @router.get("/upload-hermes/{file_id}")
-async def fetch_single_file_upload(file_id: UUID, user: User = Depends(get_current_user)):
+async def fetch_single_file_upload(file_id: UUID, user: User = Depends(get_current_user), include_log: bool = False):
     if VIEW_ALL_ROLES.intersection(user.roles) or query.get_file_owner(engine, file_id) == user.user_name:
-        return query.fetch_file_upload(engine, str(file_id).replace('-', ''))
+        return query.fetch_file_upload(engine, str(file_id).replace('-', ''), include_log)
     else:
         raise fastapi.HTTPException(status_code=401, detail='you aren\'t authorized to view this dataset')
 
 
+@router.get("/upload-hermes/{file_id}/log")
+async def fetch_file_upload_log(file_id: UUID, request: Request, tail: Optional[int] = Query(None, gt=0),
+                                user: User = Depends(get_current_user)):
+    if not VIEW_ALL_ROLES.intersection(user.roles) and query.get_file_owner(engine, file_id) != user.user_name:
+        raise fastapi.HTTPException(status_code=401, detail='you aren\'t authorized to view this dataset')
+    return log_response(query.get_file_upload_log(engine, file_id), request.headers.get('Range'), tail)
+
+
+def log_response(compressed_log: Optional[bytes], range_header: Optional[str], tail: Optional[int]):
+    """
+    Streams a stored log as text: the last tail lines when tail is given, otherwise the requested byte range of
+    the decompressed log or all of it.
+    """
+    if compressed_log is None:
+        raise fastapi.HTTPException(status_code=404, detail='No log available')
+    if tail:
+        return Response(logs.tail_log(compressed_log, tail), media_type='text/plain')
+    size = logs.log_size(compressed_log)
+    try:
+        byte_range = logs.parse_range(range_header, size)
+    except ValueError as e:
+        raise fastapi.HTTPException(status_code=416, detail=str(e), headers={'Content-Range': f'bytes */{size}'})
+    if byte_range is None:
+        return StreamingResponse(logs.iter_log(compressed_log), media_type='text/plain',
+                                 headers={'Accept-Ranges': 'bytes', 'Content-Length': str(size)})
+    start, end = byte_range
+    return StreamingResponse(logs.iter_log_range(compressed_log, start, end), status_code=206,
+                             media_type='text/plain',
+                             headers={'Accept-Ranges': 'bytes', 'Content-Range': f'bytes {start}-{end}/{size}',
+                                      'Content-Length': str(end - start + 1)})
+
+
 @router.get("/upload-hermes")
-async def fetch_all_file_uploads(user: User = Depends(get_current_user), statuses: List[str] = Query(None),
+async def fetch_all_file_uploads(response: Response, user: User = Depends(get_current_user),
+                                 statuses: List[str] = Query(None),
                                  limit: Optional[int] = Query(None), offset: Optional[int] = Query(None),
-                                 phenotype: Optional[str] = Query(None), uploader: Optional[str] = Query(None)):
-    if VIEW_ALL_ROLES.intersection(user.roles):
-        return query.fetch_file_uploads(engine, statuses, limit, offset, phenotype, uploader)
-    else:
-        return query.fetch_file_uploads(engine, statuses, limit, offset, phenotype, user.user_name)
+                                 phenotype: Optional[str] = Query(None), uploader: Optional[str] = Query(None),
+                                 cursor: Optional[str] = Query(None)):
+    if not VIEW_ALL_ROLES.intersection(user.roles):
+        uploader = user.user_name
+    try:
+        uploads = query.fetch_file_uploads(engine, statuses, limit, offset, phenotype, uploader, cursor)
+    except ValueError as e:
+        raise fastapi.HTTPException(status_code=400, detail=str(e))
+    if limit and len(uploads) == limit:
+        response.headers['X-Next-Cursor'] = query.encode_keyset_cursor(uploads[-1].uploaded_at, uploads[-1].id)
+    return uploads
 
 
 @router.patch("/upload-hermes/{file_id}")
@@ -469,17 +715,13 @@ async def upload_file_for_phenotype(data_set_id: str, dichotomous: bool, request
     filename = request.headers.get('Filename')
     logger.info(f"Uploading file {filename} for phenotype {phenotype} in dataset {data_set_id}")
     try:
-        saved_dataset = query.get_dataset(engine, UUID(data_set_id))
-        file_path = f"{saved_dataset.name}/{phenotype}"
-        parser = StreamingFormDataParser(request.headers)
-        parser.register("file", GzipS3Target(s3.get_file_path(file_path, filename), mode='wb'))
-        file_size = 0
-        async for chunk in request.stream():
-            file_size += len(chunk)
-            parser.data_received(chunk)
-        pd_id = query.insert_phenotype_data_set(engine, data_set_id, phenotype,
-                                                f"s3://{s3.BASE_BUCKET}/{file_path}/{filename}", dichotomous,
-                                                sample_size, cases, controls, filename, file_size)
+        file_size, stats, s3_path = await stream_blob_upload(request, filename)
+        try:
+            pd_id = query.insert_phenotype_data_set(engine, data_set_id, phenotype, s3_path, dichotomous,
+                                                    sample_size, cases, controls, filename, file_size, stats)
+        except Exception:
+            await run_in_threadpool(release_blob, stats.sha256)
+            raise
         return {"message": f"Successfully uploaded {filename}", "phenotype_data_set_id": pd_id}
     except Exception as e:
         logger.exception("There was a problem uploading file", e)
@@ -500,22 +742,22 @@ async def get_file_obj(file_id, ft):
     no_dash_id = query.shortened_file_id_lookup(file_id, ft, engine)
     try:
         if ft == "cs":
-            s3_path = query.get_credible_set_file(engine, no_dash_id)
+            s3_path, file_name = query.get_credible_set_file(engine, no_dash_id)
         elif ft == "d":
-            s3_path = query.get_phenotype_file(engine, no_dash_id)
+            s3_path, file_name = query.get_phenotype_file(engine, no_dash_id)
         else:
             raise fastapi.HTTPException(status_code=404, detail=f'Invalid file type: {ft}')
     except ValueError:
         raise fastapi.HTTPException(status_code=404, detail=f'Invalid file: {file_id}')
-    return await get_s3_file_name_and_obj(s3_path)
+    return await get_s3_file_name_and_obj(s3_path, file_name)
 
 
-async def get_s3_file_name_and_obj(s3_path):
+async def get_s3_file_name_and_obj(s3_path, file_name=None):
     split = s3_path[5:].split('/')
     bucket = split[0]
-    file_name = split[-1]
+    file_name = file_name or split[-1]
     file_path = '/'.join(split[1:])
-    obj = s3.get_file_obj(file_path, bucket)
+    obj = await s3.get_file_obj_async(file_path, bucket)
     return file_name, obj
 
 @router.get("/hermes-ma/results/{ma_id}")
@@ -531,31 +773,38 @@ async def stream_ma(ma_id: str):
 
 @router.get("/{ft}/{file_id}", name="stream_file")
 async def stream_file(file_id: str, ft: str):
-    no_dash_id = query.shortened_file_id_lookup(file_id, ft, engine)
-    try:
-        if ft == "cs":
-            s3_path = query.get_credible_set_file(engine, no_dash_id)
-        elif ft == "d":
-            s3_path = query.get_phenotype_file(engine, no_dash_id)
-        else:
-            raise fastapi.HTTPException(status_code=404, detail=f'Invalid file type: {ft}')
-    except ValueError:
-        raise fastapi.HTTPException(status_code=404, detail=f'Invalid file: {file_id}')
+    s3_path, file_name = file_paths.get((ft, file_id)) or (None, None)
+    if s3_path is None:
+        no_dash_id = query.shortened_file_id_lookup(file_id, ft, engine)
+        try:
+            if ft == "cs":
+                s3_path, file_name = query.get_credible_set_file(engine, no_dash_id)
+            elif ft == "d":
+                s3_path, file_name = query.get_phenotype_file(engine, no_dash_id)
+            else:
+                raise fastapi.HTTPException(status_code=404, detail=f'Invalid file type: {ft}')
+        except ValueError:
+            raise fastapi.HTTPException(status_code=404, detail=f'Invalid file: {file_id}')
+        file_paths.set((ft, file_id), (s3_path, file_name))
     split = s3_path[5:].split('/')
     bucket = split[0]
     path = '/'.join(split[1:])
-    return RedirectResponse(s3.get_signed_url(bucket, path))
+    return RedirectResponse(s3.get_signed_url(bucket, path, file_name))
 
 @router.get("/hermes/download/{file_id}")
 async def download_hermes_file(file_id: UUID, user: User = Depends(get_current_user)):
-    if VIEW_ALL_ROLES.intersection(user.roles) or query.get_file_owner(engine, file_id) == user.user_name:
-        upload = query.fetch_file_upload(engine, str(file_id).replace('-', ''))
-    else:
-       raise fastapi.HTTPException(status_code=401, detail='you aren\'t authorized to view this dataset')
-
-    s3_path = upload.s3_path
-    return RedirectResponse(s3.get_signed_url(s3.BASE_BUCKET, s3_path))
-
+    file_id = file_id.hex
+    cached = hermes_file_paths.get(file_id)
+    if cached is None:
+        file_upload = query.fetch_file_upload(engine, file_id)
+        if file_upload is None:
+            raise fastapi.HTTPException(status_code=404, detail=f"No file {file_id}")
+        cached = (file_upload.uploaded_by, file_upload.s3_path, file_upload.file_name)
+        hermes_file_paths.set(file_id, cached)
+    uploaded_by, s3_path, file_name = cached
+    if not VIEW_ALL_ROLES.intersection(user.roles) and uploaded_by != user.user_name:
+        raise fastapi.HTTPException(status_code=401, detail='you aren\'t authorized to view this dataset')
+    return RedirectResponse(s3.get_signed_url(s3.BASE_BUCKET, s3_path, file_name))
 
 
 def get_possible_files(ds_uuid):
@@ -588,16 +837,13 @@ async def upload_credible_set_for_phenotype(phenotype_data_set_id: str, credible
                 "You can't upload files to that dataset")
     filename = request.headers.get('Filename')
     try:
-        file_path = f"credible_sets/{phenotype_data_set_id}"
-        parser = StreamingFormDataParser(request.headers)
-        parser.register("file", GzipS3Target(s3.get_file_path(file_path, filename), mode='wb'))
-        file_size = 0
-        async for chunk in request.stream():
-            file_size += len(chunk)
-            parser.data_received(chunk)
-        cs_id = query.insert_credible_set(engine, phenotype_data_set_id,
-                                          f"s3://{s3.BASE_BUCKET}/{file_path}/{filename}", credible_set_name,
-                                          filename, file_size)
+        file_size, stats, s3_path = await stream_blob_upload(request, filename)
+        try:
+            cs_id = query.insert_credible_set(engine, phenotype_data_set_id, s3_path, credible_set_name, filename,
+                                              file_size, stats)
+        except Exception:
+            await run_in_threadpool(release_blob, stats.sha256)
+            raise
     except Exception as e:
         logger.exception("There was a problem uploading file", e)
         response.status_code = 400
@@ -606,6 +852,136 @@ async def upload_credible_set_for_phenotype(phenotype_data_set_id: str, credible
     return {"message": f"Successfully uploaded {filename}", "credible_set_id": cs_id}
 
 
+@router.post("/upload-sessions")
+async def create_upload_session(request: UploadSessionRequest, user: User = Depends(get_current_user)):
+    if request.kind == UploadSessionKind.PHENOTYPE:
+        if None in (request.dataset_id, request.phenotype, request.dichotomous, request.sample_size):
+            raise fastapi.HTTPException(status_code=400, detail="dataset_id, phenotype, dichotomous and sample_size "
+                                                                "are required")
+        check_perms(str(request.dataset_id), user, "You don't have permission to add files to this dataset")
+    else:
+        if None in (request.phenotype_data_set_id, request.credible_set_name):
+            raise fastapi.HTTPException(status_code=400, detail="phenotype_data_set_id and credible_set_name are "
+                                                                "required")
+        dataset_id = query.get_dataset_id_for_phenotype(engine, request.phenotype_data_set_id.hex)
+        if dataset_id is None:
+            raise fastapi.HTTPException(status_code=404, detail=f"No phenotype {request.phenotype_data_set_id}")
+        check_perms(dataset_id, user, "You can't upload files to that dataset")
+    # a key of its own, so completing the session can't overwrite a file another row points to
+    directory = f"{s3.UPLOADS_PREFIX}/sessions/{uuid.uuid4().hex}"
+    multipart_upload = await run_in_threadpool(s3.initiate_multi_part, directory, request.file_name)
+    session_id = query.insert_upload_session(engine, request, directory, multipart_upload['UploadId'], user.id)
+    return {"session_id": session_id}
+
+
+def get_open_upload_session(session_id: UUID, user: User) -> UploadSession:
+    try:
+        session = query.get_upload_session(engine, session_id)
+    except ValueError:
+        raise fastapi.HTTPException(status_code=404, detail=f"No upload session {session_id}")
+    if session.created_by != user.id:
+        raise fastapi.HTTPException(status_code=401, detail="That upload session isn't yours")
+    if session.status != 'OPEN':
+        raise fastapi.HTTPException(status_code=409, detail=f"Upload session {session_id} is {session.status}")
+    return session
+
+
+@router.put("/upload-sessions/{session_id}/parts/{part_number}")
+async def upload_session_part(session_id: UUID, request: Request, part_number: int = Path(..., ge=1, le=10000),
+                              user: User = Depends(get_current_user)):
+    """
+    Uploads one part of the file as the raw request body. Parts can be sent in parallel and resent, every part
+    but the last has to be at least 5MB and none can be more than UPLOAD_SESSION_MAX_PART_SIZE.
+    """
+    session = get_open_upload_session(session_id, user)
+    content_length = get_content_length(request)
+    if content_length is None:
+        raise fastapi.HTTPException(status_code=411, detail="Parts need a Content-Length")
+    if content_length > UPLOAD_SESSION_MAX_PART_SIZE:
+        raise fastapi.HTTPException(status_code=413, detail=f"Parts can't be more than "
+                                                            f"{UPLOAD_SESSION_MAX_PART_SIZE} bytes")
+    contents = bytearray()
+    async for chunk in request.stream():
+        contents += chunk
+        if len(contents) > content_length:
+            raise fastapi.HTTPException(status_code=400, detail="The part is longer than its Content-Length")
+    contents = bytes(contents)
+    response = await s3.put_bytes_async(session.directory, session.file_name, contents,
+                                        {'UploadId': session.s3_upload_id}, part_number)
+    query.save_upload_session_part(engine, session_id, part_number, response['ETag'], len(contents))
+    return {"part_number": part_number, "etag": response['ETag'], "size": len(contents)}
+
+
+def expire_upload_sessions():
+    """
+    Aborts the multipart upload of every open session that has gone UPLOAD_SESSION_TTL_SECONDS without a part, so
+    that s3 stops keeping the parts of uploads that were given up on.
+    """
+    for session in query.get_idle_upload_sessions(engine, UPLOAD_SESSION_TTL_SECONDS):
+        if not query.update_upload_session_status(engine, session.id, 'EXPIRED', 'OPEN'):
+            continue
+        try:
+            s3.abort_upload(session.directory, session.file_name, {'UploadId': session.s3_upload_id})
+        except ClientError as e:
+            # the upload is already gone if this is a retry
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+
+
+async def track_upload_sessions(interval: float = UPLOAD_SESSION_SWEEP_SECONDS):
+    while True:
+        try:
+            await run_in_threadpool(expire_upload_sessions)
+        except Exception:
+            logger.exception("Failed to expire upload sessions")
+        await asyncio.sleep(interval)
+
+
+@router.get("/upload-sessions/{session_id}/parts")
+async def get_upload_session_parts(session_id: UUID, user: User = Depends(get_current_user)):
+    get_open_upload_session(session_id, user)
+    return query.get_upload_session_parts(engine, session_id)
+
+
+@router.post("/upload-sessions/{session_id}/complete")
+async def complete_upload_session(session_id: UUID, user: User = Depends(get_current_user)):
+    session = get_open_upload_session(session_id, user)
+    parts = query.get_upload_session_parts(engine, session_id)
+    if not parts:
+        raise fastapi.HTTPException(status_code=400, detail="No parts have been uploaded")
+    if not query.update_upload_session_status(engine, session_id, 'COMPLETING', 'OPEN'):
+        raise fastapi.HTTPException(status_code=409, detail=f"Upload session {session_id} is already completing")
+    try:
+        await s3.finalize_upload_async(session.directory, session.file_name,
+                                       [{'PartNumber': part.part_number, 'ETag': part.etag} for part in parts],
+                                       {'UploadId': session.s3_upload_id})
+    except Exception as e:
+        query.update_upload_session_status(engine, session_id, 'OPEN', 'COMPLETING')
+        logger.exception("There was a problem completing upload session", e)
+        raise fastapi.HTTPException(status_code=400, detail=f"There was an error completing the upload of "
+                                                            f"{session.file_name}")
+    file_size = sum(part.size for part in parts)
+    # the parts can come in any order, so the file is hashed once it is put together
+    key = f"{session.directory}/{session.file_name}"
+    stats = await run_in_threadpool(object_stats, key)
+    s3_path = await run_in_threadpool(store_blob, key, file_size, stats.sha256)
+    try:
+        if session.kind == UploadSessionKind.PHENOTYPE:
+            pd_id = query.insert_phenotype_data_set(engine, session.dataset_id.hex, session.phenotype, s3_path,
+                                                    session.dichotomous, session.sample_size, session.cases,
+                                                    session.controls, session.file_name, file_size, stats)
+            result = {"message": f"Successfully uploaded {session.file_name}", "phenotype_data_set_id": pd_id}
+        else:
+            cs_id = query.insert_credible_set(engine, session.phenotype_data_set_id.hex, s3_path,
+                                              session.credible_set_name, session.file_name, file_size, stats)
+            result = {"message": f"Successfully uploaded {session.file_name}", "credible_set_id": cs_id}
+    except Exception:
+        await run_in_threadpool(release_blob, stats.sha256)
+        raise
+    query.update_upload_session_status(engine, session_id, 'COMPLETE', 'COMPLETING')
+    return result
+
+
 def get_latest_git_hash():
     return subprocess.getoutput("git rev-parse HEAD")
 
@@ -619,7 +995,8 @@ async def version():
 async def delete_dataset(data_set_id: str, response: fastapi.Response, user: User = Depends(get_current_user)):
     check_perms(data_set_id, user, "You don't have permission to delete this dataset")
     try:
-        query.delete_dataset(engine, data_set_id)
+        await run_in_threadpool(query.delete_dataset, engine, data_set_id, s3.delete_paths)
+        file_paths.clear()
     except Exception as e:
         logger.exception("There was a problem deleting dataset", e)
         response.status_code = 400
@@ -634,7 +1011,8 @@ async def delete_phenotype(phenotype_data_set_id: str, response: fastapi.Respons
     check_perms(query.get_dataset_id_for_phenotype(engine, phenotype_data_set_id), user,
                 "You don't have permission to delete files in this dataset")
     try:
-        query.delete_phenotype(engine, phenotype_data_set_id)
+        await run_in_threadpool(query.delete_phenotype, engine, phenotype_data_set_id, s3.delete_paths)
+        file_paths.clear()
     except Exception as e:
         logger.exception("There was a problem deleting phenotype", e)
         response.status_code = 400
@@ -673,6 +1051,7 @@ async def update_dataset(req: SavedDataset, user: User = Depends(get_current_use
     check_perms(str(req.id).replace('-', ''), user, "You do not have permission to update this dataset")
     try:
         query.update_dataset(engine, req)
+        file_paths.clear()
         return fastapi.responses.Response(content=None, status_code=200)
     except sqlalchemy.exc.IntegrityError as e:
         raise fastapi.HTTPException(status_code=400, detail=str(e))
@@ -719,16 +1098,3 @@ def logout(response: Response):
     response.delete_cookie(key=AUTH_COOKIE_NAME, domain='.kpndataregistry.org',
                            samesite='strict', secure=os.getenv('USE_HTTPS') == 'true')
     return {'status': 'success'}
-
-
-class GzipS3Target(S3Target):
-    def __init__(self, path, mode='wb', transport_params=None):
-        super().__init__(path, mode, transport_params)
-
-    def on_start(self):
-        self._fd = smart_open.open(
-            self._file_path,
-            self._mode,
-            compression='disable',
-            transport_params=self._transport_params,
-        )
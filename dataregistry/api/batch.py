@@ -1,10 +1,9 @@
-import time
-
 import boto3
 
-from dataregistry.api.model import HermesFileStatus
 from dataregistry.api.s3 import S3_REGION
 
+LOG_GROUP_NAME = '/aws/batch/job'
+
 
 def submit_aggregator_job(branch, method, extra_args):
     batch_client = boto3.client('batch', region_name=S3_REGION)
@@ -19,29 +18,17 @@ def submit_aggregator_job(branch, method, extra_args):
     return job_id
 
 
-def submit_and_await_job(engine, job_config, db_callback, identifier, is_qc=True):
-    batch_client = boto3.client('batch', region_name=S3_REGION)
-
-    response = batch_client.submit_job(**job_config)
-    job_id = response['jobId']
-    logs_client = boto3.client('logs', region_name=S3_REGION)
+def iter_log_pages(logs_client, log_stream_name, next_token=None):
+    """
+    Yields the messages of each page of events in a log stream after next_token along with the token for the
+    following page. CloudWatch hands back the token it was given once it reaches the current end of the stream.
+    """
     while True:
-        response = batch_client.describe_jobs(jobs=[job_id])
-        job_status = response['jobs'][0]['status']
-        if job_status in ['SUCCEEDED', 'FAILED']:
-            log_stream_name = response['jobs'][0]['container']['logStreamName']
-            log_group_name = '/aws/batch/job'
-            log_events = logs_client.get_log_events(
-                logGroupName=log_group_name,
-                logStreamName=log_stream_name
-            )
-            log_messages = [event['message'] for event in log_events['events']]
-            complete_log = '\n'.join(log_messages)
-            if is_qc:
-                db_callback(engine, complete_log, identifier,
-                            HermesFileStatus.READY_FOR_REVIEW if job_status == 'SUCCEEDED' else
-                            HermesFileStatus.FAILED_QC)
-            else:
-                db_callback(engine, complete_log, identifier, job_status)
-            break
-        time.sleep(60)
+        kwargs = {'logGroupName': LOG_GROUP_NAME, 'logStreamName': log_stream_name, 'startFromHead': True}
+        if next_token:
+            kwargs['nextToken'] = next_token
+        response = logs_client.get_log_events(**kwargs)
+        if response['nextForwardToken'] == next_token:
+            return
+        next_token = response['nextForwardToken']
+        yield [event['message'] for event in response['events']], next_token
@@ -1,10 +1,29 @@
+from typing import Tuple
 from uuid import UUID
 
 from bioindex.lib.index import Index
 from bioindex.lib import config
 
+from dataregistry.api import query, s3
 
-def create_new_bioindex(engine, idx_uuid: UUID, s3_path, schema):
+
+def find_changed_objects(objects: list, indexed: dict) -> Tuple[list, list]:
+    """
+    Compares the objects currently under an index's prefix with the ones recorded when it was last built, by
+    ETag and size, and returns the new or changed objects along with the keys of objects that were removed.
+    """
+    changed = [obj for obj in objects if indexed.get(obj['key']) != (obj['etag'], obj['size'])]
+    current_keys = {obj['key'] for obj in objects}
+    removed = [key for key in indexed if key not in current_keys]
+    return changed, removed
+
+
+def create_new_bioindex(engine, idx_uuid: UUID, s3_path, schema, skip_unchanged=False):
+    """
+    Builds the index from the objects under s3_path. With skip_unchanged an existing index is only brought up to
+    date: objects whose ETag and size match the ones recorded at its last build aren't read again, and the records of
+    objects that changed or were removed are deleted. Without it the index is rebuilt from every object.
+    """
     try:
         idx_name = str(idx_uuid)
         existing_index = Index.lookup_all(engine, idx_name)[0]
@@ -13,9 +32,24 @@ def create_new_bioindex(engine, idx_uuid: UUID, s3_path, schema):
     if not existing_index:
         Index.create(engine, idx_name, idx_name, s3_path, schema)
     try:
+        bioindex_config = config.Config()
+        objects = s3.list_objects_with_etags(s3_path, bioindex_config.s3_bucket)
         new_index = Index.lookup(engine, idx_name, schema.count(',') + 1)
-        new_index.prepare(engine, rebuild=True)
-        new_index.build(config.Config(), engine)
+        if skip_unchanged and existing_index:
+            changed, removed = find_changed_objects(objects, query.get_indexed_objects(engine, idx_name))
+            if not changed and not removed:
+                print(f"Index {idx_name} is up to date")
+                return
+            print(f"Updating {idx_name}, indexing {len(changed)} new or changed objects and dropping {len(removed)} "
+                  f"removed")
+            # bioindex records the ETag of every key it indexed. Unless the index is prepared for a rebuild, its
+            # build deletes the records of keys whose object changed or is gone and indexes only the objects
+            # without a current record, which are the changed ones
+            new_index.prepare(engine, rebuild=False)
+        else:
+            new_index.prepare(engine, rebuild=True)
+        new_index.build(bioindex_config, engine)
+        query.save_indexed_objects(engine, idx_name, objects)
     except Exception as e:
         print(f"Failed to create index {idx_name} with error {e}")
         raise e
@@ -1,13 +1,31 @@
+import asyncio
 import json
+import multiprocessing
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
 import boto3
+from starlette.concurrency import run_in_threadpool
 
 from dataregistry.api import query, bioidx
 from dataregistry.api.db import DataRegistryReadWriteDB
-from dataregistry.api.model import BioIndexCreationStatus
+from dataregistry.api.job_tracker import POLLER_ID
+from dataregistry.api.model import BioIndexCreationStatus, SavedCsvBioIndexRequest
 
 CLUSTER = 'TsvConverterCluster'
+POLL_INTERVAL_SECONDS = 30
+# the server indexing a conversion renews its lease every poll, if it stops another server indexes it again
+LEASE_SECONDS = 5 * POLL_INTERVAL_SECONDS
+DESCRIBE_TASKS_BATCH_SIZE = 100
+INDEXING_WORKERS = int(os.getenv('BIOINDEX_INDEXING_WORKERS', '2'))
+CONVERTING_STATUSES = [BioIndexCreationStatus.SUBMITTED_FOR_PROCESSING, BioIndexCreationStatus.SORTING,
+                       BioIndexCreationStatus.CONVERTING_TO_JSON]
+
+indexing_pool = None
+# futures of the indexing builds running in this server, by bidx_tracking name
+indexing = {}
 
 engine = DataRegistryReadWriteDB().get_engine()
 
@@ -34,6 +52,9 @@ def get_public_ip(ec2_client, eni_id):
 
 
 def run_ecs_sort_and_convert_job(s3_path, sort_columns, schema_info, already_sorted, process_id):
+    """
+    Starts the converter task and records its ARN, the conversion tracker follows it from there.
+    """
     ecs_client = boto3.client('ecs', region_name='us-east-1')
     # ec2_client = boto3.client('ec2', region_name='us-east-1')
 
@@ -54,7 +75,8 @@ def run_ecs_sort_and_convert_job(s3_path, sort_columns, schema_info, already_sor
                     'name': 'ConverterContainer',
                     'command': [
                         'python3', '-u', 'sort_file.py', '-s', s3_path, '-c', sort_columns,
-                        '-a', json.dumps(schema_info), '-o', str(already_sorted), '-p', str(process_id)
+                        '-a', json.dumps(schema_info), '-o', str(already_sorted), '-p', str(process_id),
+                        '--stream'
                     ],
                 }
             ]
@@ -62,23 +84,76 @@ def run_ecs_sort_and_convert_job(s3_path, sort_columns, schema_info, already_sor
     )
 
     task_arn = response['tasks'][0]['taskArn']
+    query.update_bioindex_task(engine, process_id, task_arn, BioIndexCreationStatus.SUBMITTED_FOR_PROCESSING)
+    return task_arn
+
+
+def build_bioindex(process_id, sort_columns):
+    # runs in an indexing worker process, which has its own engine
+    prefix = 'bioindex/' + str(process_id) + '/'
+    bioidx.create_new_bioindex(engine, process_id, prefix, sort_columns)
+
+
+def get_indexing_pool() -> ProcessPoolExecutor:
+    global indexing_pool
+    if indexing_pool is None:
+        # spawned rather than forked so workers don't inherit the server's connections and threads
+        indexing_pool = ProcessPoolExecutor(max_workers=INDEXING_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return indexing_pool
+
+
+def indexing_finished(process_id, future):
+    indexing.pop(process_id, None)
+    if future.exception() is not None:
+        print(f"Error creating bioindex: {future.exception()}")
+        query.update_bioindex_tracking(engine, process_id, BioIndexCreationStatus.FAILED)
+    else:
+        query.update_bioindex_tracking(engine, process_id, BioIndexCreationStatus.SUCCEEDED)
+
+
+def start_indexing(process_id, sort_columns):
+    if process_id in indexing:
+        return
+    future = get_indexing_pool().submit(build_bioindex, process_id, sort_columns)
+    indexing[process_id] = future
+    future.add_done_callback(lambda done: indexing_finished(process_id, done))
+
+
+def task_stopped(request: SavedCsvBioIndexRequest, task: Optional[dict]):
+    if task is None or task['containers'][0].get('exitCode', 1) != 0:
+        query.move_bioindex_tracking(engine, request.name, CONVERTING_STATUSES, BioIndexCreationStatus.FAILED)
+    elif query.move_bioindex_tracking(engine, request.name, CONVERTING_STATUSES, BioIndexCreationStatus.INDEXING,
+                                      POLLER_ID, LEASE_SECONDS):
+        start_indexing(request.name, request.column)
+
+
+def poll_conversions(ecs_client=None):
+    """
+    Moves every conversion on from the status recorded in bidx_tracking. Converter tasks are described up to
+    DESCRIBE_TASKS_BATCH_SIZE at a time. Every server polls, so a conversion is indexed by whichever one moves it to
+    INDEXING, which holds it on a lease; conversions whose lease runs out, because their server stopped, are indexed
+    again.
+    """
+    ecs_client = ecs_client or boto3.client('ecs', region_name='us-east-1')
+    for request in query.claim_bioindex_indexing(engine, POLLER_ID, LEASE_SECONDS):
+        start_indexing(request.name, request.column)
+    converting = query.get_unfinished_bioindex_tracking(engine, CONVERTING_STATUSES)
+    for start in range(0, len(converting), DESCRIBE_TASKS_BATCH_SIZE):
+        batch = converting[start:start + DESCRIBE_TASKS_BATCH_SIZE]
+        response = ecs_client.describe_tasks(cluster=CLUSTER, tasks=[request.task_arn for request in batch])
+        tasks = {task['taskArn']: task for task in response['tasks']}
+        for request in batch:
+            task = tasks.get(request.task_arn)
+            # ECS only describes stopped tasks for a while, one it can't find isn't coming back
+            if task is None or task['lastStatus'] == 'STOPPED':
+                task_stopped(request, task)
+
+
+async def track_conversions(interval: float = POLL_INTERVAL_SECONDS):
     while True:
-        response = ecs_client.describe_tasks(
-            cluster=CLUSTER,
-            tasks=[task_arn]
-        )
-        time.sleep(30)
-        if response['tasks'][0]['lastStatus'] == 'STOPPED':
-            container_exit_code = response['tasks'][0]['containers'][0].get('exitCode', 1)
-            if container_exit_code != 0:
-                query.update_bioindex_tracking(engine, process_id, BioIndexCreationStatus.FAILED)
-            else:
-                query.update_bioindex_tracking(engine, process_id, BioIndexCreationStatus.INDEXING)
-                try:
-                    prefix = 'bioindex/' + str(process_id) + '/'
-                    bioidx.create_new_bioindex(engine, process_id, prefix, sort_columns)
-                    query.update_bioindex_tracking(engine, process_id, BioIndexCreationStatus.SUCCEEDED)
-                except Exception as e:
-                    print(f"Error creating bioindex: {e}")
-                    query.update_bioindex_tracking(engine, process_id, BioIndexCreationStatus.FAILED)
-            return
+        try:
+            await run_in_threadpool(poll_conversions)
+        except Exception as e:
+            print(f"Error polling converter tasks: {e}")
+        await asyncio.sleep(interval)
@@ -1,11 +1,16 @@
 import gzip
 import io
-from typing import Tuple
+import zlib
+from typing import List, Tuple
 
 import pandas as pd
 import numpy as np
 from fastapi import UploadFile
 
+GZIP_MAGIC = b'\x1f\x8b'
+# how much decompressed text a preview reads, a gzipped sample can expand well past the bytes fetched for it
+PREVIEW_TEXT_BYTES = 1024 * 1024
+
 
 def infer_data_type(val):
     if isinstance(val, np.int64):
@@ -46,13 +51,18 @@ async def sample_file(lines: list) -> Tuple[io.StringIO, str]:
     return io.StringIO(sample), file_name
 
 
-async def get_text_sample(file: UploadFile) -> list:
-    text_bytes = b""
+async def read_upload(file: UploadFile) -> bytes:
+    chunks = []
     while True:
-        chunk = await file.read(2048)
+        chunk = await file.read(64 * 1024)
         if not chunk:
             break
-        text_bytes += chunk
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+async def get_text_sample(file: UploadFile) -> list:
+    text_bytes = await read_upload(file)
 
     lines = []
     text_stream = io.StringIO(text_bytes.decode('utf-8'))
@@ -68,12 +78,7 @@ async def get_text_sample(file: UploadFile) -> list:
 
 
 async def get_compressed_sample(file: UploadFile) -> list:
-    compressed_bytes = b""
-    while True:
-        chunk = await file.read(2048)
-        if not chunk:
-            break
-        compressed_bytes += chunk
+    compressed_bytes = await read_upload(file)
 
     lines = []
     with gzip.open(io.BytesIO(compressed_bytes), 'rt') as f:
@@ -86,3 +91,35 @@ async def get_compressed_sample(file: UploadFile) -> list:
             pass
     # last line might not be a full line
     return lines[:-1]
+
+
+def decompress_sample(sample: bytes, max_length: int = PREVIEW_TEXT_BYTES) -> Tuple[bytes, bool]:
+    """
+    Decompresses the start of a gzipped file, stopping after max_length bytes of text. Returns the text and whether
+    the sample held every gzip member to the end, block-gzip files being several members one after another.
+    """
+    text = bytearray()
+    while sample and len(text) < max_length:
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        text += decompressor.decompress(sample, max_length - len(text))
+        if not decompressor.eof:
+            return bytes(text), False
+        sample = decompressor.unused_data
+    return bytes(text), not sample
+
+
+def get_sample_lines(sample: bytes, complete: bool) -> List[str]:
+    """
+    Splits the first bytes of a file, gzipped or not, into lines. Unless the sample is the whole file its last line
+    may be cut off, so a last line without a line break is dropped.
+    """
+    if sample.startswith(GZIP_MAGIC):
+        sample, decompressed = decompress_sample(sample)
+        complete = complete and decompressed
+    elif len(sample) > PREVIEW_TEXT_BYTES:
+        sample, complete = sample[:PREVIEW_TEXT_BYTES], False
+    text = sample.decode('utf-8', errors='replace')
+    lines = text.splitlines()
+    if lines and not complete and not text.endswith('\n'):
+        lines = lines[:-1]
+    return lines
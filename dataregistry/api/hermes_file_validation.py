@@ -1,8 +1,10 @@
-import gzip
+import pandas as pd
 
-import boto3
-import csv
-from io import TextIOWrapper
+from dataregistry.api.s3 import get_s3_client
+
+CHUNK_SIZE = 500000
+INTEGER_PATTERN = r'\s*[+-]?\d+\s*'
+ALLELE_PATTERN = r'[ACTGDI]+'
 
 def validate_chromosome(chromosome):
     if not chromosome:
@@ -54,6 +56,62 @@ def validate_allele(val):
         return False
     return set(val).issubset({'A', 'C', 'T', 'G', 'D', 'I'})
 
+def to_integers(values: pd.Series) -> pd.Series:
+    # converting the whole column at once is much faster than parsing, so only fall back when it has a bad value
+    try:
+        return values.astype('int64')
+    except (ValueError, OverflowError):
+        is_int = values.str.fullmatch(INTEGER_PATTERN)
+        return pd.to_numeric(values.where(is_int), errors='coerce')
+
+def to_floats(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    try:
+        return values.astype(float)
+    except ValueError:
+        return pd.to_numeric(values, errors='coerce')
+
+def vector_chromosome(values: pd.Series) -> pd.Series:
+    return to_integers(values).between(1, 26)
+
+def vector_int_and_positive(values: pd.Series) -> pd.Series:
+    return to_integers(values) >= 0
+
+def vector_zero_to_one(values: pd.Series) -> pd.Series:
+    return to_floats(values).between(0, 1)
+
+def vector_numeric_and_positive(values: pd.Series) -> pd.Series:
+    return to_floats(values) > 0
+
+def vector_numeric(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.Series(True, index=values.index)
+    try:
+        values.astype(float)
+        return pd.Series(True, index=values.index)
+    except ValueError:
+        # float() accepts 'nan', which to_numeric can't tell apart from a value it failed to parse
+        return pd.to_numeric(values, errors='coerce').notna() | \
+            values.str.strip().str.lower().isin({'nan', '+nan', '-nan'})
+
+def vector_allele(values: pd.Series) -> pd.Series:
+    # allele columns hold few distinct values, so match those and look the rows up
+    distinct = pd.Series(values.unique())
+    return values.isin(distinct[distinct.str.fullmatch(ALLELE_PATTERN)])
+
+VECTOR_VALIDATORS = {
+    validate_chromosome: vector_chromosome,
+    validate_int_and_positive: vector_int_and_positive,
+    validate_zero_to_one: vector_zero_to_one,
+    validate_numeric_and_positive: vector_numeric_and_positive,
+    validate_numeric: vector_numeric,
+    validate_allele: vector_allele
+}
+
+# columns checked with float() are left for pandas to parse, if it can't the chunk holds the original strings
+FLOAT_VALIDATORS = {validate_zero_to_one, validate_numeric_and_positive, validate_numeric}
+
 VALIDATORS = [
     {
         "name": "chromosome",
@@ -153,29 +211,61 @@ def validate_row(row, schema, errors, active_validators):
         active_validators.remove(val)
     return len(active_validators) == 0
 
-async def validate_file(s3_path: str, schema: dict, validate: bool=False) -> tuple:
-    s3_client = boto3.client('s3')
+def get_column_name(val, schema):
+    if schema.get(val['name']) is None:
+        return schema.get(val.get('alt_name', None))
+    return schema.get(val['name'])
+
+
+def format_error(val, col_name, first_row, failed_rows):
+    return f"{val['error']} First invalid {col_name} value at row {first_row}, {failed_rows} rows failed."
+
+
+def validate_columns(stream, schema: dict, sep: str, compression=None, chunk_size: int = CHUNK_SIZE) -> list:
+    """
+    Reads the file in chunks holding only the mapped columns and applies each validator to a whole column at
+    once. Row numbers count data rows from 1, not including the header.
+    """
+    active_validators = [(val, get_column_name(val, schema)) for val in VALIDATORS]
+    active_validators = [(val, col_name) for val, col_name in active_validators if col_name]  # optional columns
+    columns = {col_name for _, col_name in active_validators}
+    string_columns = {col_name: str for val, col_name in active_validators
+                      if val['validator'] not in FLOAT_VALIDATORS}
+    first_rows, failed_rows = {}, {}
+    rows_read = 0
+    try:
+        reader = pd.read_csv(stream, sep=sep, compression=compression, dtype=string_columns, keep_default_na=False,
+                             usecols=lambda c: c in columns, chunksize=chunk_size)
+    except pd.errors.EmptyDataError:
+        return []
+    for chunk in reader:
+        for val, col_name in active_validators:
+            if col_name in chunk:
+                # with the NA filter off short rows read as empty strings, which fail like a missing value did
+                invalid = ~VECTOR_VALIDATORS[val['validator']](chunk[col_name]).to_numpy(dtype=bool)
+            else:
+                invalid = pd.Series(True, index=chunk.index).to_numpy()  # a missing column fails every row
+            failed = int(invalid.sum())
+            if failed:
+                first_rows.setdefault(val['name'], rows_read + int(invalid.argmax()) + 1)
+                failed_rows[val['name']] = failed_rows.get(val['name'], 0) + failed
+        rows_read += len(chunk)
+
+    return [format_error(val, col_name, first_rows[val['name']], failed_rows[val['name']])
+            for val, col_name in active_validators if val['name'] in first_rows]
+
+
+def validate_file(s3_path: str, schema: dict, validate: bool = False) -> tuple:
+    s3_client = get_s3_client()
     bucket, key = split_s3_path(s3_path)
-    obj = s3_client.get_object(Bucket=bucket, Key=key)
-    file_size = obj["ContentLength"]
-    errors = set()
     if not validate:
-        return list(errors), file_size
-
-    active_validators = VALIDATORS.copy()
-    if key.endswith('.gz'):
-        gzipfile = gzip.GzipFile(fileobj=obj['Body'], mode='rb')
-        text_file = TextIOWrapper(gzipfile, encoding='utf-8')  # Decoding bytes to text
-        reader = csv.DictReader(text_file, delimiter='\t' if '.tsv' in key else ',')
-        for row in reader:
-            if validate_row(row, schema, errors, active_validators):
-                break
-        text_file.close()
-    else:
-        text_file = TextIOWrapper(obj['Body'], encoding='utf-8')
-        reader = csv.DictReader(text_file, delimiter='\t' if '.tsv' in key else ',')
-        for row in reader:
-            if validate_row(row, schema, errors, active_validators):
-                break
-    text_file.close()
-    return list(errors), file_size
+        return [], s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+    obj = s3_client.get_object(Bucket=bucket, Key=key)
+    # the pooled connection is only released once the body is closed, whether or not it was read to the end
+    try:
+        compression = 'gzip' if key.endswith('.gz') else None
+        errors = validate_columns(obj['Body'], schema, '\t' if '.tsv' in key else ',', compression)
+    finally:
+        obj['Body'].close()
+    return errors, obj['ContentLength']
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import List
+
+import boto3
+from starlette.concurrency import run_in_threadpool
+
+from dataregistry.api import query
+from dataregistry.api.batch import iter_log_pages
+from dataregistry.api.model import HermesFileStatus, TrackedJob
+from dataregistry.api.s3 import S3_REGION
+
+POLL_INTERVAL_SECONDS = 60
+# a poller that stops renewing its lease, because it crashed or was scaled away, hands its jobs on after this long
+LEASE_SECONDS = 5 * POLL_INTERVAL_SECONDS
+DESCRIBE_JOBS_BATCH_SIZE = 100
+LOGGING_STATUSES = {'RUNNING', 'SUCCEEDED', 'FAILED'}
+FINISHED_STATUSES = {'SUCCEEDED', 'FAILED'}
+
+QC_JOB = 'qc'
+META_ANALYSIS_JOB = 'meta_analysis'
+
+logger = logging.getLogger(__name__)
+
+# every uvicorn worker and replica runs a tracker, each job is followed by whichever one holds its lease
+POLLER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def qc_status(job_status: str) -> str:
+    return HermesFileStatus.READY_FOR_REVIEW if job_status == 'SUCCEEDED' else HermesFileStatus.FAILED_QC
+
+
+# for each kind of job, the callbacks that append to its log and record its final status
+JOB_CALLBACKS = {
+    QC_JOB: (query.append_file_upload_qc_log, query.update_file_upload_qc_log, qc_status),
+    META_ANALYSIS_JOB: (query.append_meta_analysis_log, query.update_meta_analysis_log, lambda status: status)
+}
+
+
+def submit_job(engine, job_config: dict, kind: str, identifier: str) -> str:
+    """
+    Submits a batch job and records it so the tracker follows it until it finishes, across restarts.
+    """
+    batch_client = boto3.client('batch', region_name=S3_REGION)
+    job_id = batch_client.submit_job(**job_config)['jobId']
+    query.insert_job(engine, job_id, kind, identifier)
+    return job_id
+
+
+def update_job(engine, job: TrackedJob, description: dict, logs_client, owner: str = POLLER_ID):
+    append_log, update_status, final_status = JOB_CALLBACKS[job.kind]
+    job.status = description['status']
+    job.log_stream_name = description.get('container', {}).get('logStreamName') or job.log_stream_name
+    if job.log_stream_name and job.status in LOGGING_STATUSES:
+        for messages, log_token in iter_log_pages(logs_client, job.log_stream_name, job.log_token):
+            log_chunk = ''.join(f"{message}\n" for message in messages)
+            if not query.append_job_log(engine, job, owner, append_log, log_chunk, log_token):
+                logger.warning(f"Batch job {job.job_id} was taken over by another poller")
+                return
+            job.log_token = log_token
+    finished = job.status in FINISHED_STATUSES
+    if finished:
+        update_status(engine, None, job.identifier, final_status(job.status))
+    query.update_job(engine, job, owner, finished)
+
+
+def poll_jobs(engine, batch_client=None, logs_client=None, owner: str = POLLER_ID):
+    """
+    Leases the unfinished jobs no other poller holds and describes them, up to DESCRIBE_JOBS_BATCH_SIZE per call,
+    then writes new log events and records the status of jobs that finished.
+    """
+    batch_client = batch_client or boto3.client('batch', region_name=S3_REGION)
+    logs_client = logs_client or boto3.client('logs', region_name=S3_REGION)
+    jobs: List[TrackedJob] = query.claim_jobs(engine, owner, LEASE_SECONDS)
+    for start in range(0, len(jobs), DESCRIBE_JOBS_BATCH_SIZE):
+        batch = {job.job_id: job for job in jobs[start:start + DESCRIBE_JOBS_BATCH_SIZE]}
+        descriptions = {description['jobId']: description
+                        for description in batch_client.describe_jobs(jobs=list(batch))['jobs']}
+        for job_id, job in batch.items():
+            try:
+                if job_id in descriptions:
+                    update_job(engine, job, descriptions[job_id], logs_client, owner)
+                else:
+                    # batch forgets jobs some time after they finish, so there is nothing left to wait for
+                    logger.warning(f"Batch job {job_id} is no longer known, marking it failed")
+                    update_job(engine, job, {'status': 'FAILED'}, logs_client, owner)
+            except Exception:
+                logger.exception(f"Failed to update batch job {job_id}")
+
+
+async def track_jobs(engine, interval: float = POLL_INTERVAL_SECONDS):
+    while True:
+        try:
+            await run_in_threadpool(poll_jobs, engine)
+        except Exception:
+            logger.exception("Failed to poll batch jobs")
+        await asyncio.sleep(interval)
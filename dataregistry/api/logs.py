@@ -0,0 +1,90 @@
+import gzip
+import re
+import zlib
+from collections import deque
+from typing import Iterator, Optional, Tuple
+
+CHUNK_SIZE = 64 * 1024
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def compress_log(log: str) -> bytes:
+    """
+    Logs are stored as gzip members. Appending another member to a stored log keeps it a valid gzip stream, so
+    chunks can be added as they arrive without recompressing what is already there.
+    """
+    return gzip.compress(log.encode('utf-8'))
+
+
+def read_log(compressed: bytes) -> str:
+    return gzip.decompress(compressed).decode('utf-8', errors='replace')
+
+
+def iter_log(compressed: bytes, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Decompresses a log one chunk at a time, across every gzip member it holds.
+    """
+    remaining = compressed
+    while remaining:
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        for start in range(0, len(remaining), chunk_size):
+            data = decompressor.decompress(remaining[start:start + chunk_size])
+            if data:
+                yield data
+            if decompressor.eof:
+                remaining = decompressor.unused_data + remaining[start + chunk_size:]
+                break
+        else:
+            yield decompressor.flush()
+            return
+
+
+def log_size(compressed: bytes) -> int:
+    return sum(len(chunk) for chunk in iter_log(compressed))
+
+
+def iter_log_range(compressed: bytes, start: int, end: int) -> Iterator[bytes]:
+    """
+    Yields the bytes of the decompressed log from start to end inclusive.
+    """
+    offset = 0
+    for chunk in iter_log(compressed):
+        chunk_start, chunk_end = max(start - offset, 0), min(end + 1 - offset, len(chunk))
+        if chunk_start < chunk_end:
+            yield chunk[chunk_start:chunk_end]
+        offset += len(chunk)
+        if offset > end:
+            return
+
+
+def tail_log(compressed: bytes, lines: int) -> bytes:
+    last_lines = deque(maxlen=lines + 1)
+    partial = b''
+    for chunk in iter_log(compressed):
+        split = (partial + chunk).split(b'\n')
+        partial = split.pop()
+        last_lines.extend(split)
+    last_lines.append(partial)
+    # a trailing newline leaves an empty last entry, which doesn't count as a line
+    tail = list(last_lines)[-(lines + 1):] if partial == b'' else list(last_lines)[-lines:]
+    return b'\n'.join(tail)
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single byte range header into inclusive offsets, returning None when there is no range to apply and
+    raising ValueError for a range that can't be satisfied.
+    """
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.fullmatch(range_header.strip())
+    if match is None or match.groups() == ('', ''):
+        raise ValueError(f"Invalid range: {range_header}")
+    first, last = match.groups()
+    if first == '':
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {range_header} not satisfiable for {size} bytes")
+    return start, end
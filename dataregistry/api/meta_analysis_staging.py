@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
+
+from dataregistry.api import query, s3, s3_copy, job_tracker
+from dataregistry.api.job_tracker import POLLER_ID
+from dataregistry.api.model import HermesMetaAnalysisStatus, MetaAnalysisStaging
+
+POLL_INTERVAL_SECONDS = 10
+# a server that stops renewing the lease on its staging, because it crashed or restarted, leaves it to be failed
+LEASE_SECONDS = 6 * POLL_INTERVAL_SECONDS
+# every staging clears and fills the same aggregator prefixes, so only the server holding this lease stages
+PREFIXES_LEASE = 'meta-analysis-prefixes'
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='meta-analysis-staging')
+# the staging running in this server, by meta-analysis id, its progress is saved to meta_analysis_stagings each poll
+running = {}
+
+
+class StagingProgress:
+    def __init__(self, staging: MetaAnalysisStaging):
+        self.staging = staging
+        self.stage = staging.stage
+        self.deletes = s3.DeleteProgress()
+        self.copies = s3_copy.CopyProgress()
+
+    def snapshot(self) -> MetaAnalysisStaging:
+        return self.staging.copy(update={'stage': self.stage, 'deleted_objects': self.deletes.deleted_objects,
+                                         'copied_objects': self.copies.copied_objects,
+                                         'objects': self.copies.objects, 'copied_bytes': self.copies.copied_bytes,
+                                         'total_bytes': self.copies.total_bytes})
+
+
+def stage(engine, progress: StagingProgress, owner: str):
+    """
+    Clears the aggregator's working prefixes, copies the meta-analysis's inputs in and submits its job.
+    """
+    staging = progress.staging
+    s3.clear_meta_analysis_dirs(progress.deletes)
+    progress.stage = 'COPYING'
+    s3_copy.copy_prefixes([tuple(prefixes) for prefixes in staging.prefixes], progress=progress.copies)
+    # another server takes the prefixes once the lease is gone, the job can't be run on what it staged
+    if not query.update_meta_analysis_staging(engine, progress.snapshot(), owner, LEASE_SECONDS):
+        raise RuntimeError("The staging's lease ran out")
+    job_tracker.submit_job(engine, staging.job_config, job_tracker.META_ANALYSIS_JOB, staging.meta_analysis_id)
+    progress.stage = 'SUBMITTED'
+
+
+def run(engine, progress: StagingProgress, owner: str):
+    ma_id = progress.staging.meta_analysis_id
+    try:
+        stage(engine, progress, owner)
+    except Exception as e:
+        logger.exception(f"Staging meta-analysis {ma_id} failed")
+        progress.stage = 'FAILED'
+        query.update_meta_analysis_log(engine, f"Staging failed: {e}\n", ma_id, HermesMetaAnalysisStatus.FAILED)
+    finally:
+        query.update_meta_analysis_staging(engine, progress.snapshot(), owner, finished=True)
+        running.pop(ma_id, None)
+        query.release_lease(engine, PREFIXES_LEASE, owner)
+
+
+def poll_stagings(engine, owner: str = POLLER_ID):
+    """
+    Fails the stagings whose server went away, saves the progress of the staging running here and renews its
+    leases, then starts the oldest queued staging if this server can take the prefixes. A staging waits until no
+    meta-analysis job is running, as the job reads the prefixes the staging would clear.
+    """
+    for ma_id in query.fail_abandoned_meta_analysis_stagings(engine):
+        logger.warning(f"Staging meta-analysis {ma_id} was abandoned, marking it failed")
+        query.update_meta_analysis_log(engine, "Staging failed: the server staging it stopped\n", ma_id,
+                                       HermesMetaAnalysisStatus.FAILED)
+    for progress in list(running.values()):
+        if not query.update_meta_analysis_staging(engine, progress.snapshot(), owner, LEASE_SECONDS):
+            logger.warning(f"Lost the lease on staging meta-analysis {progress.staging.meta_analysis_id}")
+    if not query.claim_lease(engine, PREFIXES_LEASE, owner, LEASE_SECONDS) or running:
+        return
+    staging = query.claim_meta_analysis_staging(engine, owner, LEASE_SECONDS, job_tracker.META_ANALYSIS_JOB)
+    if staging is None:
+        query.release_lease(engine, PREFIXES_LEASE, owner)
+        return
+    progress = StagingProgress(staging)
+    running[staging.meta_analysis_id] = progress
+    executor.submit(run, engine, progress, owner)
+
+
+async def track_stagings(engine, interval: float = POLL_INTERVAL_SECONDS):
+    while True:
+        try:
+            await run_in_threadpool(poll_stagings, engine)
+        except Exception:
+            logger.exception("Failed to poll meta-analysis stagings")
+        await asyncio.sleep(interval)
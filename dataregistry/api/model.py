@@ -137,6 +137,60 @@ class HermesFileStatus(str, Enum):
     REVIEW_REJECTED = "REVIEW REJECTED"
 
 
+class TrackedJob(BaseModel):
+    job_id: str
+    kind: str
+    identifier: str
+    status: str
+    log_stream_name: Union[str, None]
+    log_token: Union[str, None]
+
+
+class MetaAnalysisStaging(BaseModel):
+    meta_analysis_id: str
+    stage: str
+    prefixes: list
+    job_config: dict
+    deleted_objects: int = 0
+    copied_objects: int = 0
+    objects: int = 0
+    copied_bytes: int = 0
+    total_bytes: int = 0
+
+
+class UploadSessionKind(str, Enum):
+    PHENOTYPE = "phenotype"
+    CREDIBLE_SET = "credible_set"
+
+
+class UploadSessionRequest(BaseModel):
+    kind: UploadSessionKind
+    file_name: str
+    dataset_id: Union[UUID, None]
+    phenotype: Union[str, None]
+    dichotomous: Union[bool, None]
+    sample_size: Union[int, None]
+    cases: Union[int, None]
+    controls: Union[int, None]
+    phenotype_data_set_id: Union[UUID, None]
+    credible_set_name: Union[str, None]
+
+
+class UploadSession(UploadSessionRequest):
+    id: UUID
+    directory: str
+    s3_upload_id: str
+    created_by: int
+    status: str
+    created_at: datetime
+
+
+class UploadSessionPart(BaseModel):
+    part_number: int
+    etag: str
+    size: int
+
+
 class HermesMetaAnalysisStatus(str, Enum):
     SUBMITTED = "SUBMITTED"
     FAILED = "FAILED"
@@ -165,6 +219,7 @@ class CsvBioIndexRequest(BaseModel):
 class SavedCsvBioIndexRequest(CsvBioIndexRequest):
     name: UUID
     ip_address: Union[str, None]
+    task_arn: Union[str, None]
 
 
 class SavedDataset(DataSet):
@@ -214,6 +269,13 @@ class SavedCredibleSet(BaseModel):
     short_id: Union[str, None]
 
 
+class FileStats(BaseModel):
+    sha256: str
+    gzipped: bool
+    row_count: int
+    header_sample: str
+
+
 class UserCredentials(BaseModel):
     user_name: str
     password: Union[str, None]
@@ -246,6 +308,7 @@ class User(BaseModel):
 class CreateBiondexRequest(BaseModel):
     dataset_id: UUID
     schema_desc: str
+    skip_unchanged: bool = False
 
 
 class BioIndex(BaseModel):
@@ -1,9 +1,11 @@
+import base64
 import datetime
 import json
 import re
 import uuid
+from collections import Counter
 from functools import lru_cache
-from typing import Optional, List, Tuple, Any
+from typing import Optional, List, Tuple, Any, Callable
 
 import bcrypt
 from sqlalchemy import text
@@ -11,7 +13,9 @@ from sqlalchemy.exc import IntegrityError
 
 from dataregistry.api.model import SavedDataset, DataSet, Study, SavedStudy, SavedPhenotypeDataSet, SavedCredibleSet, \
     CsvBioIndexRequest, SavedCsvBioIndexRequest, User, FileUpload, NewUserRequest, HermesUser, MetaAnalysisRequest, \
-    HermesMetaAnalysisStatus, SavedMetaAnalysisRequest, HermesPhenotype
+    HermesMetaAnalysisStatus, SavedMetaAnalysisRequest, HermesPhenotype, SavedDatasetInfo, TrackedJob, \
+    MetaAnalysisStaging, UploadSessionRequest, UploadSession, UploadSessionPart, FileStats, BioIndexCreationStatus
+from dataregistry.api.logs import compress_log, read_log
 from dataregistry.id_shortener import shorten_uuid
 
 
@@ -32,6 +36,65 @@ def get_all_datasets_for_user(engine, user: User) -> list:
     return [SavedDataset(**row._asdict()) for row in results]
 
 
+DATASET_FILTERS = ['ancestry', 'data_type', 'genome_build', 'study_id', 'publicly_available']
+
+
+def encode_keyset_cursor(timestamp: datetime.datetime, row_id) -> str:
+    key = json.dumps([timestamp.isoformat(), str(row_id).replace('-', '')])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('utf-8')
+
+
+def decode_keyset_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    try:
+        created_at, dataset_id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        if not re.fullmatch('[0-9a-f]{32}', dataset_id):
+            raise ValueError(f"Invalid dataset id: {dataset_id}")
+        return datetime.datetime.fromisoformat(created_at), dataset_id
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def get_datasets_page(engine, filters: dict, user_id: Optional[int] = None, fields: Optional[List[str]] = None,
+                      limit: Optional[int] = None, cursor: Optional[str] = None) -> dict:
+    """
+    Returns datasets in (created_at, id) order, starting after the cursor when one is given, along with the
+    cursor for the next page. Only the filters in DATASET_FILTERS are applied.
+    """
+    if fields and not set(fields).issubset(SavedDataset.__fields__):
+        raise ValueError(f"Invalid fields: {', '.join(sorted(set(fields) - set(SavedDataset.__fields__)))}")
+    conditions = []
+    params = {}
+    for name in DATASET_FILTERS:
+        if filters.get(name) is not None:
+            conditions.append(f"{name} = :{name}")
+            value = getattr(filters[name], 'value', filters[name])
+            params[name] = value.replace('-', '') if name == 'study_id' else value
+    if user_id is not None:
+        conditions.append("user_id = :user_id")
+        params['user_id'] = user_id
+    if cursor:
+        params['cursor_created_at'], params['cursor_id'] = decode_keyset_cursor(cursor)
+        conditions.append("(created_at > :cursor_created_at or (created_at = :cursor_created_at and id > :cursor_id))")
+    sql = """select id, name, data_source_type, data_type, genome_build, ancestry, sex, global_sample_size, status,
+    data_submitter, data_submitter_email, data_contributor, data_contributor_email, study_id, description, pub_id,
+    publication, created_at, publicly_available from datasets"""
+    if conditions:
+        sql += " where " + " and ".join(conditions)
+    sql += " order by created_at, id"
+    if limit:
+        # one extra row tells us whether there is a next page
+        sql += " limit :limit"
+        params['limit'] = limit + 1
+    with engine.connect() as conn:
+        datasets = [SavedDataset(**row._asdict()) for row in conn.execute(text(sql), params)]
+    next_cursor = None
+    if limit and len(datasets) > limit:
+        datasets = datasets[:limit]
+        next_cursor = encode_keyset_cursor(datasets[-1].created_at, datasets[-1].id)
+    return {'datasets': [dataset.dict(include=set(fields)) if fields else dataset for dataset in datasets],
+            'next_cursor': next_cursor}
+
+
 def get_bioindex_schema(engine, dataset_id: str) -> str:
     with engine.connect() as conn:
         result = conn.execute(text("""
@@ -115,36 +178,97 @@ def update_dataset(engine, data: SavedDataset):
 
 
 def insert_phenotype_data_set(engine, dataset_id: str, phenotype: str, s3_path: str, dichotomous: bool,
-                              sample_size: int, cases: int, controls: int, file_name: str, file_size: int):
+                              sample_size: int, cases: int, controls: int, file_name: str, file_size: int,
+                              stats: Optional[FileStats] = None):
     with engine.connect() as conn:
         pd_id = str(uuid.uuid4()).replace('-', '')
         sql_params = {'id': pd_id, 'dataset_id': dataset_id, 's3_path': s3_path, 'phenotype': phenotype,
                       'dichotomous': dichotomous, 'sample_size': sample_size, 'cases': cases, 'file_name': file_name,
-                      'controls': controls, 'file_size': file_size
+                      'controls': controls, 'file_size': file_size, **file_stats_params(stats)
                       }
         conn.execute(text("""
             INSERT INTO dataset_phenotypes (id, dataset_id, phenotype, s3_path, dichotomous, sample_size, cases,
-            created_at, file_name, controls, file_size)
+            created_at, file_name, controls, file_size, sha256, gzipped, row_count, header_sample)
             VALUES(:id, :dataset_id, :phenotype, :s3_path, :dichotomous, :sample_size, :cases, NOW(), :file_name,
-            :controls, :file_size)"""), sql_params)
+            :controls, :file_size, :sha256, :gzipped, :row_count, :header_sample)"""), sql_params)
         save_shortened_file_id(conn, pd_id, 'd')
         conn.commit()
         return pd_id
 
 
-def insert_credible_set(engine, phenotype_dataset_id: str, s3_path: str, name: str, file_name: str, file_size: int):
+def insert_credible_set(engine, phenotype_dataset_id: str, s3_path: str, name: str, file_name: str, file_size: int,
+                        stats: Optional[FileStats] = None):
     with engine.connect() as conn:
         credible_set_id = str(uuid.uuid4()).replace('-', '')
         sql_params = {'id': credible_set_id, 'phenotype_data_set_id': phenotype_dataset_id, 's3_path': s3_path,
-                      'name': name, 'file_name': file_name, 'file_size': file_size}
+                      'name': name, 'file_name': file_name, 'file_size': file_size, **file_stats_params(stats)}
         conn.execute(text("""
-            INSERT INTO credible_sets (id, phenotype_data_set_id, s3_path, name, file_name, file_size, created_at)
-            VALUES(:id, :phenotype_data_set_id, :s3_path, :name, :file_name, :file_size, NOW())"""), sql_params)
+            INSERT INTO credible_sets (id, phenotype_data_set_id, s3_path, name, file_name, file_size, created_at,
+            sha256, gzipped, row_count, header_sample)
+            VALUES(:id, :phenotype_data_set_id, :s3_path, :name, :file_name, :file_size, NOW(), :sha256, :gzipped,
+            :row_count, :header_sample)"""), sql_params)
         save_shortened_file_id(conn, credible_set_id, 'cs')
         conn.commit()
         return credible_set_id
 
 
+def claim_blob(engine, sha256: str, s3_path: str) -> str:
+    """
+    Adds a reference to the stored file with this content, recording s3_path as its location if there isn't one yet,
+    and returns the path that holds the content. The reference is committed before the caller looks for the file, so
+    release_blobs can't remove it in between. A file row saved with this sha256 takes over the reference, a caller
+    that fails before saving one gives it back with release_blob.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("""INSERT INTO blobs (sha256, s3_path, ref_count, created_at)
+            VALUES (:sha256, :s3_path, 1, NOW()) ON DUPLICATE KEY UPDATE ref_count = ref_count + 1"""),
+                     {'sha256': sha256, 's3_path': s3_path})
+        conn.commit()
+        return conn.execute(text("SELECT s3_path FROM blobs WHERE sha256 = :sha256"), {'sha256': sha256}).scalar()
+
+
+def release_blob(engine, sha256: str, delete_paths: Callable[[List[str]], None]):
+    with engine.connect() as conn:
+        release_blobs(conn, [sha256], delete_paths)
+        conn.commit()
+
+
+def release_blobs(conn, sha256s: List[str], delete_paths: Callable[[List[str]], None]):
+    """
+    Drops one reference per hash given and deletes the blobs nothing refers to any more. Their files are deleted with
+    delete_paths before the transaction commits, while it still holds the rows, so a claim_blob of the same content
+    waits for the delete and then stores the content again instead of finding a file that is about to go.
+    """
+    counts = Counter(sha256 for sha256 in sha256s if sha256)
+    if not counts:
+        return
+    conn.execute(text("UPDATE blobs SET ref_count = ref_count - :count WHERE sha256 = :sha256"),
+                 [{'sha256': sha256, 'count': count} for sha256, count in counts.items()])
+    unreferenced = conn.execute(text("SELECT sha256, s3_path FROM blobs WHERE sha256 in :sha256s AND ref_count <= 0"),
+                                {'sha256s': tuple(counts)}).fetchall()
+    if unreferenced:
+        conn.execute(text("DELETE FROM blobs WHERE sha256 in :sha256s"),
+                     {'sha256s': tuple(row.sha256 for row in unreferenced)})
+        delete_paths([row.s3_path for row in unreferenced])
+
+
+def get_blob_orphans(engine) -> List[str]:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT DISTINCT s3_path FROM blob_orphans")).scalars().all()
+
+
+def delete_blob_orphan(engine, s3_path: str):
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM blob_orphans WHERE s3_path = :s3_path"), {'s3_path': s3_path})
+        conn.commit()
+
+
+def file_stats_params(stats: Optional[FileStats]) -> dict:
+    if stats is None:
+        return {'sha256': None, 'gzipped': None, 'row_count': None, 'header_sample': None}
+    return stats.dict()
+
+
 def get_study_for_dataset(engine, study_id: str) -> SavedStudy:
     with engine.connect() as conn:
         result = conn.execute(text("""
@@ -169,9 +293,17 @@ def get_phenotypes_for_dataset(engine, dataset_id: uuid.UUID) -> list:
             return [SavedPhenotypeDataSet(**row._asdict()) for row in results]
 
 
-def delete_dataset(engine, data_set_id):
+def delete_dataset(engine, data_set_id, delete_paths: Callable[[List[str]], None]):
+    """
+    Deletes the files that were only referred to by this dataset with delete_paths.
+    """
     with engine.connect() as conn:
         no_dash_id = str(data_set_id).replace('-', '')
+        sha256s = conn.execute(text("""
+            SELECT sha256 FROM credible_sets where phenotype_data_set_id in
+            ( select id from dataset_phenotypes where dataset_id = :id)
+            UNION ALL SELECT sha256 FROM dataset_phenotypes where dataset_id = :id
+        """), {'id': no_dash_id}).scalars().all()
         conn.execute(text("""
             DELETE FROM credible_sets where phenotype_data_set_id in
             ( select id from dataset_phenotypes where dataset_id = :id)
@@ -182,24 +314,33 @@ def delete_dataset(engine, data_set_id):
         conn.execute(text("""
             DELETE FROM datasets where id = :id
         """), {'id': no_dash_id})
+        release_blobs(conn, sha256s, delete_paths)
         conn.commit()
 
 
-def delete_phenotype(engine, phenotype_id):
+def delete_phenotype(engine, phenotype_id, delete_paths: Callable[[List[str]], None]):
+    """
+    Deletes the files that were only referred to by this phenotype and its credible sets with delete_paths.
+    """
     with engine.connect() as conn:
         no_dash_id = str(phenotype_id).replace('-', '')
+        sha256s = conn.execute(text("""
+            SELECT sha256 FROM credible_sets where phenotype_data_set_id = :id
+            UNION ALL SELECT sha256 FROM dataset_phenotypes where id = :id
+        """), {'id': no_dash_id}).scalars().all()
         conn.execute(text("""
             DELETE FROM credible_sets where phenotype_data_set_id = :id
         """), {'id': no_dash_id})
         conn.execute(text("""
             DELETE FROM dataset_phenotypes where id = :id
         """), {'id': no_dash_id})
+        release_blobs(conn, sha256s, delete_paths)
         conn.commit()
 
 
-def get_credible_set_file(engine, credible_set_id: str) -> str:
+def get_credible_set_file(engine, credible_set_id: str) -> Tuple[str, str]:
     with engine.connect() as conn:
-        result = conn.execute(text("""SELECT cs.s3_path FROM credible_sets cs
+        result = conn.execute(text("""SELECT cs.s3_path, cs.file_name FROM credible_sets cs
         join dataset_phenotypes p on cs.phenotype_data_set_id = p.id
         join datasets d on p.dataset_id = d.id
         where cs.id = :id and d.publicly_available = true
@@ -207,18 +348,127 @@ def get_credible_set_file(engine, credible_set_id: str) -> str:
         if result is None:
             raise ValueError(f"No records for id {credible_set_id}")
         else:
-            return result.s3_path
+            return result.s3_path, result.file_name
 
 
-def get_phenotype_file(engine, phenotype_id: str) -> str:
+def get_phenotype_file(engine, phenotype_id: str) -> Tuple[str, str]:
     with engine.connect() as conn:
-        result = conn.execute(text("""SELECT p.s3_path FROM dataset_phenotypes p
+        result = conn.execute(text("""SELECT p.s3_path, p.file_name FROM dataset_phenotypes p
         join datasets d on p.dataset_id = d.id where p.id = :id and d.publicly_available = true
             """), {'id': phenotype_id}).first()
         if result is None:
             raise ValueError(f"No records for id {phenotype_id}")
         else:
-            return result.s3_path
+            return result.s3_path, result.file_name
+
+
+def insert_upload_session(engine, request: UploadSessionRequest, directory: str, s3_upload_id: str,
+                          user_id: int) -> str:
+    with engine.connect() as conn:
+        session_id = str(uuid.uuid4()).replace('-', '')
+        sql_params = {'id': session_id, 'kind': request.kind, 'phenotype': request.phenotype,
+                      'dataset_id': str(request.dataset_id).replace('-', '') if request.dataset_id else None,
+                      'dichotomous': request.dichotomous, 'sample_size': request.sample_size, 'cases': request.cases,
+                      'controls': request.controls, 'credible_set_name': request.credible_set_name,
+                      'phenotype_data_set_id': str(request.phenotype_data_set_id).replace('-', '')
+                      if request.phenotype_data_set_id else None,
+                      'directory': directory, 'file_name': request.file_name, 's3_upload_id': s3_upload_id,
+                      'created_by': user_id}
+        conn.execute(text("""
+            INSERT INTO upload_sessions (id, kind, dataset_id, phenotype, dichotomous, sample_size, cases, controls,
+            phenotype_data_set_id, credible_set_name, directory, file_name, s3_upload_id, created_by, status,
+            created_at) VALUES (:id, :kind, :dataset_id, :phenotype, :dichotomous, :sample_size, :cases, :controls,
+            :phenotype_data_set_id, :credible_set_name, :directory, :file_name, :s3_upload_id, :created_by, 'OPEN',
+            NOW())
+        """), sql_params)
+        conn.commit()
+    return session_id
+
+
+def get_upload_session(engine, session_id: uuid.UUID) -> UploadSession:
+    with engine.connect() as conn:
+        result = conn.execute(text("""SELECT id, kind, dataset_id, phenotype, dichotomous, sample_size, cases, controls,
+        phenotype_data_set_id, credible_set_name, directory, file_name, s3_upload_id, created_by, status, created_at
+        FROM upload_sessions WHERE id = :id"""), {'id': str(session_id).replace('-', '')}).first()
+    if result is None:
+        raise ValueError(f"No upload session {session_id}")
+    return UploadSession(**result._asdict())
+
+
+def save_upload_session_part(engine, session_id: uuid.UUID, part_number: int, etag: str, size: int):
+    with engine.connect() as conn:
+        conn.execute(text("""INSERT INTO upload_session_parts (session_id, part_number, etag, size, uploaded_at)
+            VALUES (:session_id, :part_number, :etag, :size, NOW())
+            ON DUPLICATE KEY UPDATE etag = :etag, size = :size, uploaded_at = NOW()"""),
+                     {'session_id': str(session_id).replace('-', ''), 'part_number': part_number, 'etag': etag,
+                      'size': size})
+        conn.commit()
+
+
+def get_upload_session_parts(engine, session_id: uuid.UUID) -> List[UploadSessionPart]:
+    with engine.connect() as conn:
+        results = conn.execute(text("""SELECT part_number, etag, size FROM upload_session_parts
+        WHERE session_id = :session_id ORDER BY part_number"""), {'session_id': str(session_id).replace('-', '')})
+        return [UploadSessionPart(**row._asdict()) for row in results]
+
+
+def update_upload_session_status(engine, session_id: uuid.UUID, status: str, from_status: str) -> bool:
+    """
+    Moves the session to status if it is still in from_status, returning whether it did. Completing claims the
+    session this way so two requests can't complete it twice.
+    """
+    with engine.connect() as conn:
+        result = conn.execute(text("""UPDATE upload_sessions SET status = :status,
+        completed_at = IF(:status = 'COMPLETE', NOW(), completed_at) WHERE id = :id AND status = :from_status"""),
+                              {'id': str(session_id).replace('-', ''), 'status': status, 'from_status': from_status})
+        conn.commit()
+        return result.rowcount == 1
+
+
+def get_idle_upload_sessions(engine, idle_seconds: int) -> List[UploadSession]:
+    """
+    Returns the open sessions that were started, and had their last part uploaded, over idle_seconds ago.
+    """
+    with engine.connect() as conn:
+        results = conn.execute(text("""SELECT id, kind, dataset_id, phenotype, dichotomous, sample_size, cases,
+        controls, phenotype_data_set_id, credible_set_name, directory, file_name, s3_upload_id, created_by, status,
+        created_at FROM upload_sessions s WHERE status = 'OPEN' AND created_at < NOW() - INTERVAL :seconds SECOND
+        AND NOT EXISTS (SELECT 1 FROM upload_session_parts p WHERE p.session_id = s.id
+        AND p.uploaded_at >= NOW() - INTERVAL :seconds SECOND)"""), {'seconds': idle_seconds})
+    return [UploadSession(**row._asdict()) for row in results]
+
+
+def get_file_key_owners(engine, key: str, s3_path: str) -> Tuple[List[str], List[int]]:
+    """
+    Returns the user names of the HERMES uploads stored at key, or that were given a url to upload it, and the owners of the datasets with a phenotype or
+    credible set file at s3_path, the same object as a full s3:// path.
+    """
+    with engine.connect() as conn:
+        uploaders = conn.execute(text("""SELECT uploaded_by FROM file_uploads WHERE s3_path = :key
+            UNION SELECT user_name FROM hermes_presigned_uploads WHERE s3_path = :key"""),
+                                 {'key': key}).scalars().all()
+        dataset_owners = conn.execute(text("""SELECT d.user_id FROM datasets d
+            join dataset_phenotypes p on p.dataset_id = d.id WHERE p.s3_path = :s3_path
+            UNION SELECT d.user_id FROM datasets d join dataset_phenotypes p on p.dataset_id = d.id
+            join credible_sets cs on cs.phenotype_data_set_id = p.id WHERE cs.s3_path = :s3_path"""),
+                                      {'s3_path': s3_path}).scalars().all()
+        return uploaders, dataset_owners
+
+
+def claim_hermes_upload_key(engine, key: str, user_name: str) -> bool:
+    """
+    Records that user_name is uploading to key, returning False if the key already belongs to another user, either
+    through an upload url issued to them or a file they uploaded before urls were recorded.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("""INSERT IGNORE INTO hermes_presigned_uploads (s3_path, user_name, created_at)
+            SELECT :key, :user_name, NOW() FROM DUAL WHERE NOT EXISTS
+            (SELECT 1 FROM file_uploads WHERE s3_path = :key AND uploaded_by <> :user_name)"""),
+                     {'key': key, 'user_name': user_name})
+        conn.commit()
+        owner = conn.execute(text("SELECT user_name FROM hermes_presigned_uploads WHERE s3_path = :key"),
+                             {'key': key}).scalar()
+        return owner == user_name
 
 
 def get_dataset_id_for_phenotype(engine, phenotype_data_set_id: str) -> Optional[str]:
@@ -246,6 +496,63 @@ def get_credible_sets_for_dataset(engine, phenotype_ids: list) -> list:
             return [SavedCredibleSet(**row._asdict()) for row in results]
 
 
+def get_dataset_infos(engine, dataset_ids: list, user_id: Optional[int] = None) -> List[SavedDatasetInfo]:
+    """
+    Assembles the dataset, study, phenotypes and credible sets for many datasets with two queries on one
+    connection. When user_id is given only datasets owned by that user are returned.
+    """
+    if len(dataset_ids) == 0:
+        return []
+    params = {'ids': tuple([str(ds_id).replace('-', '') for ds_id in dataset_ids])}
+    owner_filter = ''
+    if user_id is not None:
+        owner_filter = 'and d.user_id = :user_id'
+        params['user_id'] = user_id
+    with engine.connect() as conn:
+        datasets = conn.execute(text(f"""SELECT d.*, s.name as study_name, s.institution as study_institution,
+        s.created_at as study_created_at FROM datasets d join studies s on s.id = d.study_id
+        where d.id in :ids {owner_filter}"""), params).fetchall()
+        if len(datasets) == 0:
+            return []
+        files = conn.execute(text("""SELECT p.id, p.dataset_id, p.phenotype, p.dichotomous, p.sample_size, p.cases,
+        p.controls, p.created_at, p.file_name, p.s3_path, p.file_size, df.short_id, cs.id as cs_id, cs.name as cs_name,
+        cs.s3_path as cs_s3_path, cs.file_name as cs_file_name, cs.created_at as cs_created_at,
+        cs.file_size as cs_file_size, cfi.short_id as cs_short_id
+        FROM dataset_phenotypes p join data_file_ids df on df.id = p.id
+        left join (credible_sets cs join cs_file_ids cfi on cfi.id = cs.id) on cs.phenotype_data_set_id = p.id
+        where p.dataset_id in :ids"""), {'ids': tuple(row.id for row in datasets)}).fetchall()
+
+    phenotypes, credible_sets = {}, {}
+    for row in files:
+        row_dict = row._asdict()
+        phenotype = SavedPhenotypeDataSet(**{k: v for k, v in row_dict.items() if not k.startswith('cs_')})
+        dataset_phenotypes = phenotypes.setdefault(phenotype.dataset_id, {})
+        dataset_phenotypes.setdefault(phenotype.id, phenotype)
+        if row.cs_id is not None:
+            credible_set = SavedCredibleSet(**{k[3:]: v for k, v in row_dict.items() if k.startswith('cs_')},
+                                            phenotype_data_set_id=phenotype.id, phenotype=phenotype.phenotype)
+            credible_sets.setdefault(phenotype.dataset_id, []).append(credible_set)
+
+    infos = []
+    for row in datasets:
+        row_dict = row._asdict()
+        study = SavedStudy(id=row.study_id, name=row_dict.pop('study_name'),
+                           institution=row_dict.pop('study_institution'),
+                           created_at=row_dict.pop('study_created_at'))
+        dataset = SavedDataset(**row_dict)
+        infos.append(SavedDatasetInfo(dataset=dataset, study=study,
+                                      phenotypes=list(phenotypes.get(dataset.id, {}).values()),
+                                      credible_sets=credible_sets.get(dataset.id, [])))
+    return infos
+
+
+def get_dataset_info(engine, dataset_id: uuid.UUID, user_id: Optional[int] = None) -> SavedDatasetInfo:
+    infos = get_dataset_infos(engine, [dataset_id], user_id)
+    if len(infos) == 0:
+        raise ValueError(f"No records for id {dataset_id}")
+    return infos[0]
+
+
 def save_shortened_file_id(conn, file_id: str, file_type: str):
     short_id = shorten_uuid(file_id)
     if file_type == 'd':
@@ -290,8 +597,8 @@ def add_bioindex_tracking(engine, request: CsvBioIndexRequest):
 def get_bioindex_tracking(engine, req_id) -> SavedCsvBioIndexRequest:
     with engine.connect() as conn:
         params = {'name': str(req_id).replace('-', '')}
-        result = conn.execute(text("""SELECT name, status, `column`, already_sorted, s3_path, created_at, ip_address
-        from bidx_tracking where name = :name"""), params).first()
+        result = conn.execute(text("""SELECT name, status, `column`, already_sorted, s3_path, created_at, ip_address,
+        task_arn from bidx_tracking where name = :name"""), params).first()
     if result is None:
         raise ValueError(f"No records for id {req_id}")
     else:
@@ -305,6 +612,71 @@ def update_bioindex_tracking(engine, req_id, new_status):
         conn.commit()
 
 
+def update_bioindex_task(engine, req_id, task_arn: str, new_status):
+    with engine.connect() as conn:
+        params = {'name': str(req_id).replace('-', ''), 'task_arn': task_arn, 'status': new_status}
+        conn.execute(text("""UPDATE bidx_tracking SET task_arn = :task_arn, status = :status where name = :name"""),
+                     params)
+        conn.commit()
+
+
+def move_bioindex_tracking(engine, req_id, from_statuses: list, new_status, owner: Optional[str] = None,
+                           lease_seconds: int = 0) -> bool:
+    """
+    Moves a conversion to new_status, leased to owner for lease_seconds, only if it is still in one of from_statuses.
+    Returns whether this call moved it, so only one of several pollers acts on a change.
+    """
+    with engine.connect() as conn:
+        result = conn.execute(text("""UPDATE bidx_tracking SET status = :status, leased_by = :owner,
+            lease_expires_at = NOW() + INTERVAL :lease_seconds SECOND where name = :name and status in :from_statuses"""),
+                              {'name': str(req_id).replace('-', ''), 'status': new_status, 'owner': owner,
+                               'lease_seconds': lease_seconds, 'from_statuses': tuple(from_statuses)})
+        conn.commit()
+        return result.rowcount == 1
+
+
+def claim_bioindex_indexing(engine, owner: str, lease_seconds: int) -> List[SavedCsvBioIndexRequest]:
+    """
+    Renews owner's lease on the conversions it is indexing and takes over those whose lease ran out, returning every
+    conversion owner now holds.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("""UPDATE bidx_tracking SET leased_by = :owner,
+            lease_expires_at = NOW() + INTERVAL :lease_seconds SECOND where status = :status and
+            (leased_by = :owner or lease_expires_at is null or lease_expires_at < NOW())"""),
+                     {'owner': owner, 'lease_seconds': lease_seconds, 'status': BioIndexCreationStatus.INDEXING})
+        conn.commit()
+        results = conn.execute(text("""SELECT name, status, `column`, already_sorted, s3_path, created_at, ip_address,
+        task_arn from bidx_tracking where status = :status and leased_by = :owner"""),
+                               {'owner': owner, 'status': BioIndexCreationStatus.INDEXING})
+        return [SavedCsvBioIndexRequest(**row._asdict()) for row in results]
+
+
+def get_unfinished_bioindex_tracking(engine, statuses: list) -> List[SavedCsvBioIndexRequest]:
+    with engine.connect() as conn:
+        results = conn.execute(text("""SELECT name, status, `column`, already_sorted, s3_path, created_at, ip_address,
+        task_arn from bidx_tracking where task_arn is not null and status in :statuses"""),
+                               {'statuses': tuple(statuses)})
+        return [SavedCsvBioIndexRequest(**row._asdict()) for row in results]
+
+
+def get_indexed_objects(engine, index_name: str) -> dict:
+    with engine.connect() as conn:
+        results = conn.execute(text("SELECT s3_key, etag, size FROM bioindex_objects WHERE index_name = :index_name"),
+                               {'index_name': index_name})
+        return {row.s3_key: (row.etag, row.size) for row in results}
+
+
+def save_indexed_objects(engine, index_name: str, objects: list):
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM bioindex_objects WHERE index_name = :index_name"), {'index_name': index_name})
+        if objects:
+            conn.execute(text("INSERT INTO bioindex_objects (index_name, s3_key, etag, size, indexed_at) "
+                              "VALUES (:index_name, :key, :etag, :size, NOW())"),
+                         [dict(obj, index_name=index_name) for obj in objects])
+        conn.commit()
+
+
 def get_user(engine, creds) -> Optional[User]:
     with engine.connect() as conn:
         params = {'user_name': creds.user_name}
@@ -404,16 +776,17 @@ def retrieve_meta_data_mapping(engine, user: str) -> [dict]:
 
         return {row.dataset: json.loads(row.metadata) for row in results}
 
-def save_file_upload_info(engine, dataset, metadata, s3_path, filename, file_size, uploader, qc_script_options) -> str:
+def save_file_upload_info(engine, dataset, metadata, s3_path, filename, file_size, uploader, qc_script_options,
+                          sha256=None) -> str:
     with engine.connect() as conn:
         new_guid = str(uuid.uuid4())
         conn.execute(text("""INSERT INTO file_uploads(id, dataset, file_name, file_size, uploaded_at, uploaded_by,
-        metadata, s3_path, qc_script_options, qc_status) VALUES(:id, :dataset, :file_name, :file_size, NOW(), :uploaded_by, :metadata,
-         :s3_path, :qc_script_options, 'SUBMITTED TO QC')"""), {'id': new_guid.replace('-', ''), 'dataset': dataset,
+        metadata, s3_path, qc_script_options, qc_status, sha256) VALUES(:id, :dataset, :file_name, :file_size, NOW(), :uploaded_by, :metadata,
+         :s3_path, :qc_script_options, 'SUBMITTED TO QC', :sha256)"""), {'id': new_guid.replace('-', ''), 'dataset': dataset,
                                             'file_name': filename,
                                             'file_size': file_size, 'uploaded_by': uploader,
                                             'metadata': json.dumps(metadata), 's3_path': s3_path,
-                                            'qc_script_options': json.dumps(qc_script_options)})
+                                            'qc_script_options': json.dumps(qc_script_options), 'sha256': sha256})
         conn.commit()
         return new_guid
 
@@ -421,33 +794,49 @@ def update_file_qc_options(engine, file_id: str, qc_script_options: dict):
     with engine.connect() as conn:
         conn.execute(text("""UPDATE file_uploads 
                            SET qc_script_options = :qc_script_options,
-                               qc_status = 'SUBMITTED TO QC'
+                               qc_status = 'SUBMITTED TO QC',
+                               qc_log_gz = NULL
                            WHERE id = :file_id"""),
                     {'qc_script_options': json.dumps(qc_script_options),
                      'file_id': str(file_id).replace('-', '')})
         conn.commit()
 
 
-def gen_fetch_ds_sql(params, param_to_where):
+def fetch_file_uploads(engine, statuses=None, limit=None, offset=None, phenotype=None, uploader=None,
+                       cursor=None) -> List[FileUpload]:
+    """
+    Lists uploads newest first, without their qc logs. A cursor from encode_keyset_cursor of the last upload on a
+    page resumes right after it.
+    """
+    conditions = []
+    params = {}
+    if statuses:
+        params['qc_status'] = statuses
+        conditions.append("qc_status in :qc_status")
+    if phenotype:
+        params['phenotype'] = phenotype
+        conditions.append("phenotype = :phenotype")
+    if uploader:
+        params['uploaded_by'] = uploader
+        conditions.append("uploaded_by = :uploaded_by")
+    if cursor:
+        params['cursor_uploaded_at'], params['cursor_id'] = decode_keyset_cursor(cursor)
+        conditions.append("(uploaded_at < :cursor_uploaded_at or "
+                          "(uploaded_at = :cursor_uploaded_at and id < :cursor_id))")
     sql = "select id, dataset as dataset_name, file_name, file_size, uploaded_at, uploaded_by, qc_status, " \
-          "qc_log, metadata->>'$.phenotype' as phenotype, metadata, s3_path from file_uploads "
-
-    for index, (col, value) in enumerate(params.items(), start=0):
-        if col in {"limit", "offset"}:
-            break
-        if index == 0:
-            sql += f"WHERE {param_to_where.get(col)} "
-        else:
-            sql += f" AND {param_to_where.get(col)} "
-
-    sql += " order by uploaded_at desc"
-    return f"{sql} {param_to_where.get('limit', '')} {param_to_where.get('offset', '')}".rstrip()
-
+          "null as qc_log, phenotype, metadata, s3_path from file_uploads"
+    if conditions:
+        sql += " where " + " and ".join(conditions)
+    sql += " order by uploaded_at desc, id desc"
+    if limit or offset:
+        # mysql only accepts an offset after a limit
+        params['limit'] = limit or 18446744073709551615
+        sql += " limit :limit"
+    if offset:
+        params['offset'] = offset
+        sql += " offset :offset"
 
-def fetch_file_uploads(engine, statuses=None, limit=None, offset=None, phenotype=None,
-                       uploader=None) -> List[FileUpload]:
     with engine.connect() as conn:
-        sql, params = get_file_upload_sql_and_params(limit, offset, phenotype, statuses, uploader)
         results = conn.execute(text(sql), params)
         file_uploads = []
         for row in results:
@@ -458,50 +847,257 @@ def fetch_file_uploads(engine, statuses=None, limit=None, offset=None, phenotype
         return file_uploads
 
 
-def get_file_upload_sql_and_params(limit, offset, phenotype, statuses, uploader):
-    param_to_sql = {}
-    params = {}
-    if statuses:
-        params['qc_status'] = statuses
-        param_to_sql['qc_status'] = "qc_status in :qc_status"
-    if phenotype:
-        params['phenotype'] = phenotype
-        param_to_sql['phenotype'] = "metadata->>'$.phenotype' = :phenotype"
-    if uploader:
-        params['uploaded_by'] = uploader
-        param_to_sql['uploaded_by'] = "uploaded_by = :uploaded_by"
-    if limit:
-        params['limit'] = limit
-        param_to_sql['limit'] = "limit :limit"
-    if offset:
-        params['offset'] = offset
-        param_to_sql['limit'] = "offset :offset"
-    sql = gen_fetch_ds_sql(params, param_to_sql)
-    return sql, params
-
-
-def update_file_upload_qc_log(engine, qc_log: str, file_upload_id: str, qc_status: str):
+def update_file_upload_qc_log(engine, qc_log: Optional[str], file_upload_id: str, qc_status: str):
+    """
+    Sets the qc status, and replaces the qc log unless qc_log is None.
+    """
     with engine.connect() as conn:
-        conn.execute(text("UPDATE file_uploads set qc_log=:qc_log, qc_status = :qc_status where id = :file_upload_id"),
-                     {'qc_log': qc_log, 'qc_status': qc_status,
+        conn.execute(text("UPDATE file_uploads set qc_log_gz = coalesce(:qc_log, qc_log_gz), qc_status = :qc_status "
+                          "where id = :file_upload_id"),
+                     {'qc_log': compress_log(qc_log) if qc_log is not None else None, 'qc_status': qc_status,
                       'file_upload_id': file_upload_id.replace('-', '')})
         conn.commit()
 
 
-def update_meta_analysis_log(engine, log: str, meta_analysis_id: str, status: str):
+def append_file_upload_qc_log(conn, log_chunk: str, file_upload_id: str):
+    conn.execute(text("UPDATE file_uploads set qc_log_gz = concat(coalesce(qc_log_gz, ''), :log_chunk) "
+                      "where id = :file_upload_id"),
+                 {'log_chunk': compress_log(log_chunk), 'file_upload_id': file_upload_id.replace('-', '')})
+
+
+def update_meta_analysis_log(engine, log: Optional[str], meta_analysis_id: str, status: str):
+    """
+    Sets the meta-analysis status, and replaces its log unless log is None.
+    """
     with engine.connect() as conn:
-        conn.execute(text("UPDATE meta_analyses set log=:log, status = :status where id = :meta_analysis_id"),
-                     {'log': log, 'status': status,
+        conn.execute(text("UPDATE meta_analyses set log_gz = coalesce(:log, log_gz), status = :status "
+                          "where id = :meta_analysis_id"),
+                     {'log': compress_log(log) if log is not None else None, 'status': status,
                       'meta_analysis_id': meta_analysis_id.replace('-', '')})
         conn.commit()
 
 
-def fetch_file_upload(engine, file_id) -> FileUpload:
+def append_meta_analysis_log(conn, log_chunk: str, meta_analysis_id: str):
+    conn.execute(text("UPDATE meta_analyses set log_gz = concat(coalesce(log_gz, ''), :log_chunk) "
+                      "where id = :meta_analysis_id"),
+                 {'log_chunk': compress_log(log_chunk), 'meta_analysis_id': meta_analysis_id.replace('-', '')})
+
+
+def get_file_upload_log(engine, file_id) -> Optional[bytes]:
+    with engine.connect() as conn:
+        result = conn.execute(text("SELECT qc_log_gz FROM file_uploads WHERE id = :file_id"),
+                              {'file_id': str(file_id).replace('-', '')}).first()
+    return result.qc_log_gz if result else None
+
+
+def get_meta_analysis_log(engine, meta_analysis_id) -> Optional[bytes]:
+    with engine.connect() as conn:
+        result = conn.execute(text("SELECT log_gz FROM meta_analyses WHERE id = :id"),
+                              {'id': str(meta_analysis_id).replace('-', '')}).first()
+    return result.log_gz if result else None
+
+
+def insert_validation_job(engine, job_id: str, user_name: str):
+    with engine.connect() as conn:
+        conn.execute(text("INSERT INTO validation_jobs (job_id, user_name, status, submitted_at) "
+                          "VALUES (:job_id, :user_name, 'RUNNING', NOW())"),
+                     {'job_id': job_id, 'user_name': user_name})
+        conn.commit()
+
+
+def finish_validation_job(engine, job_id: str, status: str, result: dict):
+    with engine.connect() as conn:
+        conn.execute(text("UPDATE validation_jobs SET status = :status, result = :result, finished_at = NOW() "
+                          "WHERE job_id = :job_id"),
+                     {'job_id': job_id, 'status': status, 'result': json.dumps(result, default=str)})
+        conn.commit()
+
+
+def get_validation_job(engine, job_id: str) -> Optional[dict]:
+    with engine.connect() as conn:
+        result = conn.execute(text("SELECT job_id, user_name, status, result, submitted_at FROM validation_jobs "
+                                   "WHERE job_id = :job_id"), {'job_id': job_id}).first()
+    if result is None:
+        return None
+    job = result._asdict()
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def delete_expired_validation_jobs(engine, retention_seconds: int):
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM validation_jobs WHERE submitted_at < NOW() - INTERVAL :seconds SECOND"),
+                     {'seconds': retention_seconds})
+        conn.commit()
+
+
+def insert_job(engine, job_id: str, kind: str, identifier: str):
+    with engine.connect() as conn:
+        conn.execute(text("INSERT INTO jobs (job_id, kind, identifier, status, created_at) "
+                          "VALUES (:job_id, :kind, :identifier, 'SUBMITTED', NOW())"),
+                     {'job_id': job_id, 'kind': kind, 'identifier': identifier.replace('-', '')})
+        conn.commit()
+
+
+def claim_jobs(engine, owner: str, lease_seconds: int) -> List[TrackedJob]:
+    """
+    Leases every unfinished job that isn't leased to another poller, or whose lease ran out, to owner for
+    lease_seconds, renewing the jobs owner already holds. Returns the jobs owner holds.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("UPDATE jobs SET leased_by = :owner, "
+                          "lease_expires_at = NOW() + INTERVAL :lease_seconds SECOND WHERE finished_at IS NULL AND "
+                          "(leased_by = :owner OR lease_expires_at IS NULL OR lease_expires_at < NOW())"),
+                     {'owner': owner, 'lease_seconds': lease_seconds})
+        conn.commit()
+        results = conn.execute(text("SELECT job_id, kind, identifier, status, log_stream_name, log_token FROM jobs "
+                                    "WHERE finished_at IS NULL AND leased_by = :owner"), {'owner': owner})
+        return [TrackedJob(**row._asdict()) for row in results]
+
+
+def append_job_log(engine, job: TrackedJob, owner: str, append_log, log_chunk: Optional[str], log_token: str) -> bool:
+    """
+    Appends a page of log events with append_log and moves the job on to the token after the page, in one
+    transaction, as long as owner still holds the job and its token is still job.log_token. Returns whether it did,
+    so a page is written once even if a lease runs out part way through a poll.
+    """
+    with engine.connect() as conn:
+        result = conn.execute(text("UPDATE jobs SET log_stream_name = :log_stream_name, log_token = :log_token "
+                                   "WHERE job_id = :job_id AND leased_by = :owner AND log_token <=> :previous_token"),
+                              {'log_stream_name': job.log_stream_name, 'log_token': log_token, 'job_id': job.job_id,
+                               'owner': owner, 'previous_token': job.log_token})
+        if result.rowcount != 1:
+            conn.rollback()
+            return False
+        if log_chunk:
+            append_log(conn, log_chunk, job.identifier)
+        conn.commit()
+        return True
+
+
+def update_job(engine, job: TrackedJob, owner: str, finished: bool = False) -> bool:
+    with engine.connect() as conn:
+        result = conn.execute(text(f"UPDATE jobs SET status = :status, log_stream_name = :log_stream_name"
+                                   f"{', finished_at = NOW()' if finished else ''} "
+                                   f"WHERE job_id = :job_id AND leased_by = :owner"), {**job.dict(), 'owner': owner})
+        conn.commit()
+        return result.rowcount == 1
+
+
+def claim_lease(engine, name: str, owner: str, lease_seconds: int) -> bool:
+    """
+    Takes the named lease for owner for lease_seconds, or renews it if owner already holds it. Returns whether owner
+    holds it, a lease whose holder stops renewing it can be taken once it runs out.
+    """
+    with engine.connect() as conn:
+        result = conn.execute(text("UPDATE leases SET leased_by = :owner, "
+                                   "lease_expires_at = NOW() + INTERVAL :lease_seconds SECOND WHERE name = :name AND "
+                                   "(leased_by = :owner OR lease_expires_at IS NULL OR lease_expires_at < NOW())"),
+                              {'name': name, 'owner': owner, 'lease_seconds': lease_seconds})
+        conn.commit()
+        return result.rowcount == 1
+
+
+def release_lease(engine, name: str, owner: str):
+    with engine.connect() as conn:
+        conn.execute(text("UPDATE leases SET leased_by = NULL, lease_expires_at = NULL "
+                          "WHERE name = :name AND leased_by = :owner"), {'name': name, 'owner': owner})
+        conn.commit()
+
+
+def insert_meta_analysis_staging(engine, meta_analysis_id: str, prefixes: list, job_config: dict):
+    with engine.connect() as conn:
+        conn.execute(text("INSERT INTO meta_analysis_stagings (meta_analysis_id, stage, prefixes, job_config, "
+                          "created_at) VALUES (:meta_analysis_id, 'QUEUED', :prefixes, :job_config, NOW())"),
+                     {'meta_analysis_id': meta_analysis_id.replace('-', ''), 'prefixes': json.dumps(prefixes),
+                      'job_config': json.dumps(job_config)})
+        conn.commit()
+
+
+def meta_analysis_staging_from_row(row) -> MetaAnalysisStaging:
+    return MetaAnalysisStaging(**{**row._asdict(), 'meta_analysis_id': row.meta_analysis_id.decode('utf-8'),
+                                  'prefixes': json.loads(row.prefixes), 'job_config': json.loads(row.job_config)})
+
+
+def get_meta_analysis_staging(engine, meta_analysis_id: str) -> Optional[MetaAnalysisStaging]:
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT meta_analysis_id, stage, prefixes, job_config, deleted_objects, "
+                                "copied_objects, objects, copied_bytes, total_bytes FROM meta_analysis_stagings "
+                                "WHERE meta_analysis_id = :meta_analysis_id"),
+                           {'meta_analysis_id': meta_analysis_id.replace('-', '')}).first()
+        return meta_analysis_staging_from_row(row) if row else None
+
+
+def claim_meta_analysis_staging(engine, owner: str, lease_seconds: int,
+                                job_kind: str) -> Optional[MetaAnalysisStaging]:
+    """
+    Moves the oldest queued staging to CLEARING, leased to owner for lease_seconds, unless a meta-analysis job of
+    job_kind is still running on the prefixes the staging would clear. Returns the staging owner took, if any.
+    """
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT meta_analysis_id, stage, prefixes, job_config FROM meta_analysis_stagings "
+                                "WHERE stage = 'QUEUED' AND NOT EXISTS (SELECT 1 FROM jobs WHERE kind = :job_kind "
+                                "AND finished_at IS NULL) ORDER BY created_at LIMIT 1"),
+                           {'job_kind': job_kind}).first()
+        if row is None:
+            return None
+        result = conn.execute(text("UPDATE meta_analysis_stagings SET stage = 'CLEARING', leased_by = :owner, "
+                                   "lease_expires_at = NOW() + INTERVAL :lease_seconds SECOND "
+                                   "WHERE meta_analysis_id = :meta_analysis_id AND stage = 'QUEUED'"),
+                              {'meta_analysis_id': row.meta_analysis_id, 'owner': owner,
+                               'lease_seconds': lease_seconds})
+        conn.commit()
+        if result.rowcount != 1:
+            return None
+        return meta_analysis_staging_from_row(row).copy(update={'stage': 'CLEARING'})
+
+
+def update_meta_analysis_staging(engine, staging: MetaAnalysisStaging, owner: str, lease_seconds: int = 0,
+                                 finished: bool = False) -> bool:
+    """
+    Records the stage and progress of a staging owner holds and renews its lease, or ends the lease once the staging
+    finished. Returns whether owner still held it.
+    """
+    lease = 'leased_by = NULL, lease_expires_at = NULL' if finished else \
+        'lease_expires_at = NOW() + INTERVAL :lease_seconds SECOND'
+    with engine.connect() as conn:
+        result = conn.execute(text(f"UPDATE meta_analysis_stagings SET stage = :stage, "
+                                   f"deleted_objects = :deleted_objects, copied_objects = :copied_objects, "
+                                   f"objects = :objects, copied_bytes = :copied_bytes, total_bytes = :total_bytes, "
+                                   f"{lease} WHERE meta_analysis_id = :meta_analysis_id AND leased_by = :owner"),
+                              {**staging.dict(exclude={'prefixes', 'job_config'}),
+                               'meta_analysis_id': staging.meta_analysis_id.replace('-', ''), 'owner': owner,
+                               'lease_seconds': lease_seconds})
+        conn.commit()
+        return result.rowcount == 1
+
+
+def fail_abandoned_meta_analysis_stagings(engine) -> List[str]:
+    """
+    Marks FAILED the stagings whose server stopped renewing their lease part way through, returning their
+    meta-analysis ids.
+    """
+    with engine.connect() as conn:
+        ids = conn.execute(text("SELECT meta_analysis_id FROM meta_analysis_stagings WHERE stage IN "
+                                "('CLEARING', 'COPYING') AND lease_expires_at < NOW()")).scalars().all()
+        failed = []
+        for meta_analysis_id in ids:
+            result = conn.execute(text("UPDATE meta_analysis_stagings SET stage = 'FAILED', leased_by = NULL, "
+                                       "lease_expires_at = NULL WHERE meta_analysis_id = :meta_analysis_id AND "
+                                       "stage IN ('CLEARING', 'COPYING') AND lease_expires_at < NOW()"),
+                                  {'meta_analysis_id': meta_analysis_id})
+            if result.rowcount == 1:
+                failed.append(meta_analysis_id.decode('utf-8'))
+        conn.commit()
+        return failed
+
+
+def fetch_file_upload(engine, file_id, include_log=False) -> FileUpload:
     with engine.connect() as conn:
         result = conn.execute(
             text("SELECT id, dataset as dataset_name, file_name, file_size, uploaded_at, uploaded_by, metadata, "
-                 "s3_path, qc_log, metadata->>'$.phenotype' as phenotype, qc_status, qc_script_options "
-                 "FROM file_uploads WHERE id = :file_id"),
+                 f"s3_path, {'qc_log_gz' if include_log else 'null as qc_log_gz'}, phenotype, qc_status, "
+                 "qc_script_options FROM file_uploads WHERE id = :file_id"),
             {'file_id': file_id}).first()
 
         if result is None:
@@ -515,6 +1111,8 @@ def fetch_file_upload(engine, file_id) -> FileUpload:
         if result_dict['qc_script_options'] is not None:
             result_dict['qc_script_options'] = json.loads(result_dict['qc_script_options'])
 
+        qc_log = result_dict.pop('qc_log_gz')
+        result_dict['qc_log'] = read_log(qc_log) if qc_log is not None else None
         return FileUpload(**result_dict)
 
 
@@ -535,10 +1133,10 @@ def update_file_qc_status(engine, file_id, qc_status):
 def fetch_used_phenotypes(engine, statuses) -> List[str]:
     with engine.connect() as conn:
         if statuses:
-            result = conn.execute(text("SELECT distinct metadata->>'$.phenotype' as phenotype from file_uploads "
-                                       "where qc_status in :statuses"), {'statuses': statuses})
+            result = conn.execute(text("SELECT distinct phenotype from file_uploads where qc_status in :statuses"),
+                                  {'statuses': statuses})
         else:
-            result = conn.execute(text("SELECT distinct metadata->>'$.phenotype' as phenotype from file_uploads"))
+            result = conn.execute(text("SELECT distinct phenotype from file_uploads"))
         return [row[0] for row in result]
 
 
@@ -655,21 +1253,30 @@ def save_dataset_name(engine, ds_name, ancestry):
                      {'dataset': ds_name, 'ancestry': ancestry})
         conn.commit()
 
-def delete_hermes_dataset(engine, ds_id):
+def delete_hermes_dataset(engine, ds_id, delete_paths: Callable[[List[str]], None]) -> List[Tuple[str, str, str]]:
+    """
+    Returns the id, s3 path and file name of every file upload that was deleted, the stored files nothing else
+    refers to are deleted with delete_paths.
+    """
     no_hyphens = str(ds_id).replace('-', '')
     with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, s3_path, file_name, sha256 FROM file_uploads WHERE id = :ds_id"),
+                            {'ds_id': no_hyphens}).fetchall()
         conn.execute(text("DELETE FROM meta_analysis_datasets WHERE dataset_id = :ds_id"), {'ds_id': no_hyphens})
         conn.execute(text("DELETE FROM meta_analyses WHERE id NOT IN (SELECT DISTINCT meta_analysis_id "
                           "FROM meta_analysis_datasets)"), {})
         conn.execute(text("DELETE FROM file_uploads WHERE id = :ds_id"), {'ds_id': no_hyphens})
+        release_blobs(conn, [row.sha256 for row in rows], delete_paths)
         conn.commit()
+    return [(row.id, row.s3_path, row.file_name) for row in rows]
 
 
-def get_meta_analysis(engine, ma_id: uuid.UUID) -> SavedMetaAnalysisRequest:
+def get_meta_analysis(engine, ma_id: uuid.UUID, include_log=False) -> SavedMetaAnalysisRequest:
     with engine.connect() as conn:
-        sql = """
+        sql = f"""
             select ma.id, ma.name, ma.phenotype, ma.status, ma.method, ma.created_at, ma.created_by, 
-            group_concat(fu.dataset) as dataset_names, ma.log, group_concat(mad.dataset_id) as datasets 
+            group_concat(fu.dataset) as dataset_names, {'ma.log_gz' if include_log else 'null as log_gz'}, 
+            group_concat(mad.dataset_id) as datasets 
             from meta_analyses ma join meta_analysis_datasets mad on ma.id = mad.meta_analysis_id 
             join file_uploads fu on fu.id = mad.dataset_id where ma.id = :id group by ma.id
         """
@@ -682,7 +1289,7 @@ def get_meta_analysis(engine, ma_id: uuid.UUID) -> SavedMetaAnalysisRequest:
             method=result['method'],
             created_at=result['created_at'],
             created_by=result['created_by'],
-            log=result['log'],
+            log=read_log(result['log_gz']) if result['log_gz'] is not None else None,
             datasets=[uuid.UUID(hex=x) for x in result['datasets'].decode('utf-8').split(',') if x],
             dataset_names=result['dataset_names'].split(',')
         )
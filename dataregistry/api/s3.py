@@ -1,57 +1,109 @@
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
 
 import boto3
 import os
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from starlette.concurrency import run_in_threadpool
+
+from dataregistry.api.ttl_cache import TTLCache
 
 S3_REGION = 'us-east-1'
 BASE_BUCKET = os.environ.get('DATA_REGISTRY_BUCKET', 'dig-data-registry')
+MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', '50'))
+DELETE_WORKERS = int(os.environ.get('S3_DELETE_WORKERS', '8'))
+SIGNED_URL_EXPIRY_SECONDS = 7200
+# phenotype and credible set files are stored once per content, under their sha256
+BLOBS_PREFIX = 'blobs'
+# where uploads wait while they are hashed, and resumable uploads are assembled, each under a key of its own
+UPLOADS_PREFIX = 'uploads'
+# cached urls are handed out until they have at least an hour of validity left
+signed_urls = TTLCache(ttl=SIGNED_URL_EXPIRY_SECONDS - 3600)
 
+_s3_client = None
+_s3_client_lock = threading.Lock()
 
-def create_record_directory(record_name):
-    _create_directory(f'{record_name}/')
 
+def get_s3_client():
+    """
+    Returns the process wide S3 client, creating it on first use. boto3 clients are thread safe, so every request
+    and worker thread shares one client and its pool of open connections instead of building a client per call.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.client('s3', region_name=S3_REGION,
+                                          config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+    return _s3_client
 
-def clear_variants_raw():
-    clear_dir('hermes/variants_raw')
 
+def reset_s3_client():
+    global _s3_client
+    with _s3_client_lock:
+        _s3_client = None
+    signed_urls.clear()
 
-def clear_variants():
-    clear_dir('hermes/variants')
 
+def create_record_directory(record_name):
+    _create_directory(f'{record_name}/')
 
-def clear_variants_processed():
-    clear_dir('hermes/variants_processed')
 
+# the aggregator reads its inputs from and writes its output to these shared prefixes, so each meta-analysis starts
+# by clearing them and meta_analysis_staging runs one meta-analysis at a time
+META_ANALYSIS_PREFIXES = ['hermes/variants_raw', 'hermes/variants_processed', 'hermes/out/metaanalysis',
+                          'hermes/variants']
 
-def clear_meta_analysis():
-    clear_dir('hermes/out/metaanalysis')
 
+class DeleteProgress:
+    def __init__(self):
+        self.deleted_objects = 0
+        self._lock = threading.Lock()
 
-def clear_dir(prefix: str):
-    s3 = boto3.client('s3')
-    paginator = s3.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=BASE_BUCKET, Prefix=prefix)
+    def add(self, count: int):
+        with self._lock:
+            self.deleted_objects += count
 
-    for page in page_iterator:
-        if "Contents" in page:
-            delete_keys = {'Objects': [{'Key': obj['Key']} for obj in page['Contents']]}
-            s3.delete_objects(Bucket=BASE_BUCKET, Delete=delete_keys)
 
+def clear_meta_analysis_dirs(progress: DeleteProgress = None) -> DeleteProgress:
+    return clear_dirs(META_ANALYSIS_PREFIXES, progress)
 
-def copy_files_for_meta_analysis(source_prefix, destination_prefix):
-    s3_client = boto3.client('s3')
 
-    paginator = s3_client.get_paginator('list_objects_v2')
-    for page in paginator.paginate(Bucket=BASE_BUCKET, Prefix=source_prefix):
-        for obj in page.get('Contents', []):
-            source_key = obj['Key']
-            rest_of_path = source_key[len(source_prefix):]
-            destination_key = f"{destination_prefix}/{rest_of_path}"
-            copy_source = {
-                'Bucket': BASE_BUCKET,
-                'Key': source_key
-            }
-            s3_client.copy(copy_source, BASE_BUCKET, destination_key)
+def clear_dir(prefix: str):
+    clear_dirs([prefix])
+
+
+def clear_dirs(prefixes: List[str], progress: DeleteProgress = None) -> DeleteProgress:
+    """
+    Deletes everything under the prefixes. Each prefix is listed on its own thread, and every page of up to 1000
+    keys is handed to a pool of delete workers as soon as it is listed, so deletes overlap with the listing.
+    """
+    s3 = get_s3_client()
+    progress = progress or DeleteProgress()
+    # a prefix that starts with another one is already listed with it, hermes/variants covers hermes/variants_raw
+    prefixes = [prefix for prefix in prefixes
+                if not any(prefix != other and prefix.startswith(other) for other in prefixes)]
+
+    def delete_page(keys):
+        response = s3.delete_objects(Bucket=BASE_BUCKET, Delete={'Objects': keys, 'Quiet': True})
+        if response.get('Errors'):
+            raise Exception(f"Failed to delete {len(response['Errors'])} objects, first {response['Errors'][0]}")
+        progress.add(len(keys))
+
+    def list_prefix(prefix):
+        paginator = s3.get_paginator('list_objects_v2')
+        return [delete_pool.submit(delete_page, [{'Key': obj['Key']} for obj in page['Contents']])
+                for page in paginator.paginate(Bucket=BASE_BUCKET, Prefix=prefix) if 'Contents' in page]
+
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as delete_pool, \
+            ThreadPoolExecutor(max_workers=len(prefixes)) as list_pool:
+        deletes = [future for listed in list_pool.map(list_prefix, prefixes) for future in listed]
+        for future in deletes:
+            future.result()
+    return progress
 
 
 def create_dataset_directory(record_name, bucket_name):
@@ -59,38 +111,66 @@ def create_dataset_directory(record_name, bucket_name):
 
 
 def _create_directory(directory):
-    s3_client = boto3.client('s3', region_name=S3_REGION)
+    s3_client = get_s3_client()
     s3_client.put_object(Bucket=BASE_BUCKET, Key=directory)
 
 
+def blob_key(sha256: str) -> str:
+    return f"{BLOBS_PREFIX}/{sha256}"
+
+
+def split_path(s3_path: str) -> Tuple[str, str]:
+    """
+    Splits an s3://bucket/key path into its bucket and key.
+    """
+    bucket, key = s3_path[5:].split('/', 1)
+    return bucket, key
+
+
+def path_exists(s3_path: str) -> bool:
+    bucket, key = split_path(s3_path)
+    try:
+        get_s3_client().head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return False
+        raise
+    return True
+
+
 def get_full_s3_path(path, file):
     return f's3://{BASE_BUCKET}/{path}/{file}'
 
 
 def upload_metadata(metadata, path):
-    s3_client = boto3.client('s3', region_name=S3_REGION)
+    s3_client = get_s3_client()
     s3_client.put_object(Bucket=BASE_BUCKET, Key=f"{path}/metadata", Body=json.dumps(metadata).encode('utf-8'))
 
 
 def initiate_multi_part(directory: str, filename: str):
-    s3_client = boto3.client('s3', region_name=S3_REGION)
+    s3_client = get_s3_client()
     return s3_client.create_multipart_upload(Bucket=BASE_BUCKET, Key=f"{directory}/{filename}")
 
-def get_signed_url(bucket, path):
-    s3_client = boto3.client('s3', region_name=S3_REGION)
-    return s3_client.generate_presigned_url('get_object', Params={'Bucket': bucket,
-                                                                  'Key': path,
-                                                                  'ResponseContentDisposition': f'attachment; filename="{path.split("/")[-1]}"'}, ExpiresIn=7200)
+def get_signed_url(bucket, path, filename=None):
+    """
+    filename is the name the download is saved as, by default the last part of the path. Deduplicated files are
+    stored under the path of their first upload, so other uploads of the same content give their own name.
+    """
+    filename = filename or path.split("/")[-1]
+    signed_url = signed_urls.get((bucket, path, filename))
+    if signed_url is None:
+        s3_client = get_s3_client()
+        signed_url = s3_client.generate_presigned_url('get_object', Params={'Bucket': bucket,
+                                                                            'Key': path,
+                                                                            'ResponseContentDisposition': f'attachment; filename="{filename}"'},
+                                                      ExpiresIn=SIGNED_URL_EXPIRY_SECONDS)
+        signed_urls.set((bucket, path, filename), signed_url)
+    return signed_url
 
 def put_bytes(directory, file_name, contents, upload, part_number):
-    s3_client = boto3.resource('s3', region_name=S3_REGION)
-    upload_part = s3_client.MultipartUploadPart(
-        BASE_BUCKET, f"{directory}/{file_name}", upload['UploadId'], part_number
-    )
-    upload_part_response = upload_part.upload(
-        Body=contents,
-    )
-    return upload_part_response
+    s3_client = get_s3_client()
+    return s3_client.upload_part(Bucket=BASE_BUCKET, Key=f"{directory}/{file_name}", UploadId=upload['UploadId'],
+                                 PartNumber=part_number, Body=contents)
 
 
 def get_file_path(directory, file_name):
@@ -108,7 +188,7 @@ def list_files_in_bioindex_path(prefix):
     Returns:
     - List of tuples containing filenames and their sizes.
     """
-    s3 = boto3.client('s3')
+    s3 = get_s3_client()
 
     results = []
     paginator = s3.get_paginator('list_objects_v2')
@@ -123,22 +203,67 @@ def list_files_in_bioindex_path(prefix):
     return results
 
 
+def list_objects_with_etags(prefix, bucket=BASE_BUCKET):
+    """
+    List the key, ETag and size of every object under a prefix in an S3 bucket.
+    """
+    s3_client = get_s3_client()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    return [{'key': obj['Key'], 'etag': obj['ETag'].strip('"'), 'size': obj['Size']}
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix) for obj in page.get('Contents', [])]
+
+
 def get_file_obj(path: str, bucket: str):
-    s3_client = boto3.client('s3', region_name=S3_REGION)
+    s3_client = get_s3_client()
     return s3_client.get_object(Bucket=bucket, Key=path)
 
 
+def get_file_start(path: str, bucket: str, length: int) -> Tuple[bytes, bool]:
+    """
+    Reads up to the first length bytes of an object with a ranged GET. Returns the bytes and whether they are the
+    whole object.
+    """
+    s3_client = get_s3_client()
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=path, Range=f"bytes=0-{length - 1}")
+    except ClientError as e:
+        # S3 won't serve a range of an empty object
+        if e.response['Error']['Code'] == 'InvalidRange':
+            return b'', True
+        raise
+    contents = response['Body'].read()
+    # Content-Range is "bytes 0-{end}/{object size}"
+    size = response.get('ContentRange', '').rpartition('/')[2]
+    return contents, int(size) <= length if size.isdigit() else len(contents) < length
+
+
+async def get_file_obj_async(path: str, bucket: str):
+    return await run_in_threadpool(get_file_obj, path, bucket)
+
+
+async def upload_metadata_async(metadata, path):
+    await run_in_threadpool(upload_metadata, metadata, path)
+
+
+async def put_bytes_async(directory, file_name, contents, upload, part_number):
+    return await run_in_threadpool(put_bytes, directory, file_name, contents, upload, part_number)
+
+
+async def finalize_upload_async(directory, name, parts, multipart_upload):
+    await run_in_threadpool(finalize_upload, directory, name, parts, multipart_upload)
+
+
 def delete_record_directory(record_name):
     _delete_directory(record_name)
 
 
 def _delete_directory(directory):
-    s3_client = boto3.client('s3', region_name=S3_REGION)
+    s3_client = get_s3_client()
     s3_client.put_object(Bucket=BASE_BUCKET, Key=f'{directory}/_DELETED')
 
 
 def finalize_upload(directory, name, parts, multipart_upload):
-    s3_client = boto3.client('s3', region_name=S3_REGION)
+    s3_client = get_s3_client()
     s3_client.complete_multipart_upload(
         Bucket=BASE_BUCKET,
         Key=f"{directory}/{name}",
@@ -149,6 +274,27 @@ def finalize_upload(directory, name, parts, multipart_upload):
     )
 
 
+def abort_upload(directory, name, multipart_upload):
+    s3_client = get_s3_client()
+    s3_client.abort_multipart_upload(Bucket=BASE_BUCKET, Key=f"{directory}/{name}",
+                                     UploadId=multipart_upload['UploadId'])
+
+
+def delete_paths(s3_paths: List[str]):
+    """
+    Deletes objects given as s3://bucket/key paths.
+    """
+    s3_client = get_s3_client()
+    for s3_path in s3_paths:
+        bucket, key = split_path(s3_path)
+        s3_client.delete_object(Bucket=bucket, Key=key)
+
+
+def put_empty_file(directory, name):
+    s3_client = get_s3_client()
+    s3_client.put_object(Bucket=BASE_BUCKET, Key=f"{directory}/{name}", Body=b'')
+
+
 def generate_presigned_url(param, params, expires_in):
-    s3_client = boto3.client('s3', region_name=S3_REGION)
+    s3_client = get_s3_client()
     return s3_client.generate_presigned_url(param, Params=params, ExpiresIn=expires_in)
@@ -0,0 +1,126 @@
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from dataregistry.api.s3 import BASE_BUCKET, get_s3_client
+
+COPY_WORKERS = int(os.environ.get('S3_COPY_WORKERS', '16'))
+PART_COPY_WORKERS = int(os.environ.get('S3_PART_COPY_WORKERS', '16'))
+# copy_object handles up to 5GB, but one request per object leaves large files copying on a single connection
+MULTIPART_COPY_THRESHOLD = 256 * 1024 * 1024
+PART_SIZE = 128 * 1024 * 1024
+MAX_PARTS = 10000
+PROGRESS_INTERVAL_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+
+class CopyProgress:
+    """
+    Counts the objects and bytes copied so far, logging throughput at most every PROGRESS_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, objects: int = 0, total_bytes: int = 0):
+        self.objects = objects
+        self.total_bytes = total_bytes
+        self.copied_objects = 0
+        self.copied_bytes = 0
+        self.started_at = time.monotonic()
+        self._reported_at = self.started_at
+        self._lock = threading.Lock()
+
+    def add(self, size: int):
+        with self._lock:
+            self.copied_objects += 1
+            self.copied_bytes += size
+            now = time.monotonic()
+            if now - self._reported_at >= PROGRESS_INTERVAL_SECONDS:
+                self._reported_at = now
+                logger.info(f"Copied {self.summary()}")
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        return (f"{self.copied_objects}/{self.objects} objects, {self.copied_bytes / 2 ** 20:.0f}/"
+                f"{self.total_bytes / 2 ** 20:.0f}MB in {elapsed:.1f}s ({self.copied_bytes / 2 ** 20 / elapsed:.1f}MB/s)")
+
+
+def list_copies(source_prefix: str, destination_prefix: str, bucket: str) -> List[Tuple[str, str, int]]:
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    return [(obj['Key'], f"{destination_prefix}/{obj['Key'][len(source_prefix):]}", obj['Size'])
+            for page in paginator.paginate(Bucket=bucket, Prefix=source_prefix) for obj in page.get('Contents', [])]
+
+
+def copy_parts(part_pool: ThreadPoolExecutor, source_key: str, destination_key: str, size: int, bucket: str):
+    s3_client = get_s3_client()
+    part_size = max(PART_SIZE, math.ceil(size / MAX_PARTS))
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=destination_key)['UploadId']
+
+    def copy_part(part_number):
+        start = (part_number - 1) * part_size
+        end = min(start + part_size, size) - 1
+        response = s3_client.upload_part_copy(Bucket=bucket, Key=destination_key, UploadId=upload_id,
+                                              PartNumber=part_number, CopySourceRange=f"bytes={start}-{end}",
+                                              CopySource={'Bucket': bucket, 'Key': source_key})
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+    try:
+        parts = list(part_pool.map(copy_part, range(1, math.ceil(size / part_size) + 1)))
+        s3_client.complete_multipart_upload(Bucket=bucket, Key=destination_key, UploadId=upload_id,
+                                            MultipartUpload={'Parts': parts})
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=destination_key, UploadId=upload_id)
+        raise
+
+
+def copy_object(part_pool: ThreadPoolExecutor, progress: CopyProgress, source_key: str, destination_key: str,
+                size: int, bucket: str):
+    if size > MULTIPART_COPY_THRESHOLD:
+        copy_parts(part_pool, source_key, destination_key, size, bucket)
+    else:
+        get_s3_client().copy_object(Bucket=bucket, Key=destination_key,
+                                    CopySource={'Bucket': bucket, 'Key': source_key})
+    progress.add(size)
+
+
+def copy_prefixes(prefixes: List[Tuple[str, str]], bucket: str = BASE_BUCKET,
+                  progress: CopyProgress = None) -> CopyProgress:
+    """
+    Copies every object under each source prefix to its destination prefix within the bucket, listing the prefixes
+    in parallel.
+    """
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+        copies = [copy for listed in pool.map(lambda prefix: list_copies(*prefix, bucket), prefixes)
+                  for copy in listed]
+    return copy_objects(copies, bucket, progress)
+
+
+def copy_objects(copies: List[Tuple[str, str, int]], bucket: str = BASE_BUCKET,
+                 progress: CopyProgress = None) -> CopyProgress:
+    """
+    Copies each (source key, destination key, size) within the bucket, server side. All the objects share one bounded
+    pool, small ones with a single copy_object and large ones as parts copied in parallel on a second pool. Pass in a
+    progress to follow the copy from another thread. Raises the first error once every copy has finished or failed.
+    """
+    progress = progress or CopyProgress()
+    progress.objects, progress.total_bytes = len(copies), sum(size for _, _, size in copies)
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool, \
+            ThreadPoolExecutor(max_workers=PART_COPY_WORKERS) as part_pool:
+        futures = [pool.submit(copy_object, part_pool, progress, source_key, destination_key, size, bucket)
+                   for source_key, destination_key, size in copies]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+    logger.info(f"Copied {progress.summary()}")
+    if errors:
+        raise errors[0]
+    return progress
+
+
+def move_object(source_key: str, destination_key: str, size: int, bucket: str = BASE_BUCKET):
+    """
+    Copies an object to a new key within the bucket and deletes the original.
+    """
+    copy_objects([(source_key, destination_key, size)], bucket)
+    get_s3_client().delete_object(Bucket=bucket, Key=source_key)
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import math
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from streaming_form_data.targets import BaseTarget
+
+from dataregistry.api import s3
+from dataregistry.api.model import FileStats
+
+MIN_PART_SIZE = 8 * 1024 * 1024
+MAX_PART_SIZE = 64 * 1024 * 1024
+# part sizes are picked so an upload of the advertised length needs about this many parts
+TARGET_PARTS = 1000
+UPLOAD_WORKERS = int(os.environ.get('S3_UPLOAD_WORKERS', '16'))
+MAX_PARTS_IN_FLIGHT = int(os.environ.get('S3_UPLOAD_PARTS_IN_FLIGHT', '4'))
+# file stats are worked out off the event loop once this much of the file is waiting for them
+STATS_BATCH_SIZE = 4 * 1024 * 1024
+HEADER_SAMPLE_BYTES = 16 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+
+upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+
+
+def choose_part_size(content_length: Optional[int]) -> int:
+    if not content_length:
+        return MIN_PART_SIZE
+    return min(max(MIN_PART_SIZE, math.ceil(content_length / TARGET_PARTS)), MAX_PART_SIZE)
+
+
+class UploadStats:
+    """
+    Works out a file's FileStats from its bytes in order, one chunk at a time: the sha256 of the bytes as uploaded,
+    whether they are gzipped, and from the decompressed text the number of rows after the header and the first
+    complete lines up to HEADER_SAMPLE_BYTES.
+    """
+
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.gzipped = None
+        self.lines = 0
+        self.header_sample = bytearray()
+        self._decompressor = None
+        self._sampling = True
+        self._last_byte = b''
+
+    def update(self, chunk: bytes):
+        if not chunk:
+            return
+        self.sha256.update(chunk)
+        if self.gzipped is None:
+            self.gzipped = chunk.startswith(GZIP_MAGIC)
+        if self.gzipped:
+            self._decompress(chunk)
+        else:
+            self._count(chunk)
+
+    def _decompress(self, chunk: bytes):
+        # files written by block-gzip tools are several gzip members one after another
+        while chunk:
+            if self._decompressor is None:
+                self._decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+            self._count(self._decompressor.decompress(chunk))
+            if not self._decompressor.eof:
+                return
+            chunk = self._decompressor.unused_data
+            self._decompressor = None
+
+    def _count(self, text: bytes):
+        if not text:
+            return
+        self.lines += text.count(b'\n')
+        self._last_byte = text[-1:]
+        if self._sampling:
+            self.header_sample += text[:HEADER_SAMPLE_BYTES - len(self.header_sample)]
+            self._sampling = len(self.header_sample) < HEADER_SAMPLE_BYTES
+
+    def result(self) -> FileStats:
+        lines = self.lines + (1 if self._last_byte not in (b'', b'\n') else 0)
+        sample = bytes(self.header_sample)
+        if not self._sampling and b'\n' in sample:
+            sample = sample[:sample.rindex(b'\n') + 1]
+        return FileStats(sha256=self.sha256.hexdigest(), gzipped=bool(self.gzipped), row_count=max(lines - 1, 0),
+                         header_sample=sample.decode('utf-8', errors='replace'))
+
+
+def object_stats(key: str, bucket: str = s3.BASE_BUCKET) -> FileStats:
+    """
+    Works out the FileStats of a file that reached S3 without streaming through a MultipartS3Target by reading it
+    through once.
+    """
+    stats = UploadStats()
+    body = s3.get_file_obj(key, bucket)['Body']
+    try:
+        for chunk in iter(lambda: body.read(STATS_BATCH_SIZE), b''):
+            stats.update(chunk)
+    finally:
+        body.close()
+    return stats.result()
+
+
+class MultipartS3Target(BaseTarget):
+    """
+    A streaming-form-data target that cuts the file into parts and uploads them to S3 concurrently on a shared pool
+    of upload threads. The parser calls data_received synchronously, so the request handler has to await open before
+    streaming, drain after feeding each chunk to hold the request back while MAX_PARTS_IN_FLIGHT parts are uploading,
+    and complete (or abort on error) at the end. The file's stats are gathered in the same pass. Completing is also
+    available as finish_parts then commit, so the caller can look at the stats before deciding to keep the file.
+    """
+
+    def __init__(self, directory: str, filename: str, content_length: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.filename = filename
+        self.part_size = choose_part_size(content_length)
+        self.size = 0
+        self._buffer = bytearray()
+        self._upload = None
+        self._uploads = []
+        self._responses = []
+        self.stats = UploadStats()
+        self._unhashed = bytearray()
+
+    async def open(self):
+        self._upload = await run_in_threadpool(s3.initiate_multi_part, self.directory, self.filename)
+
+    def _upload_part(self, contents: bytes):
+        part_number = len(self._uploads) + 1
+        self._uploads.append(upload_pool.submit(s3.put_bytes, self.directory, self.filename, contents, self._upload,
+                                                part_number))
+
+    def on_data_received(self, chunk: bytes):
+        self.size += len(chunk)
+        self._buffer += chunk
+        self._unhashed += chunk
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def on_finish(self):
+        if self._buffer:
+            self._upload_part(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    async def _update_stats(self):
+        unhashed, self._unhashed = bytes(self._unhashed), bytearray()
+        await run_in_threadpool(self.stats.update, unhashed)
+
+    async def drain(self):
+        if len(self._unhashed) >= STATS_BATCH_SIZE:
+            await self._update_stats()
+        in_flight = [asyncio.wrap_future(future) for future in self._uploads if not future.done()]
+        while len(in_flight) > MAX_PARTS_IN_FLIGHT:
+            done, pending = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                future.result()
+            in_flight = list(pending)
+
+    async def finish_parts(self) -> FileStats:
+        """
+        Waits for every part to upload and returns the file's stats, leaving the upload to be committed or aborted.
+        """
+        await self._update_stats()
+        self._responses = [await asyncio.wrap_future(future) for future in self._uploads]
+        return self.stats.result()
+
+    async def commit(self):
+        if not self._responses:
+            # S3 won't complete a multipart upload without parts
+            await run_in_threadpool(s3.abort_upload, self.directory, self.filename, self._upload)
+            await run_in_threadpool(s3.put_empty_file, self.directory, self.filename)
+            return
+        parts = [{'PartNumber': number, 'ETag': response['ETag']}
+                 for number, response in enumerate(self._responses, 1)]
+        await s3.finalize_upload_async(self.directory, self.filename, parts, self._upload)
+
+    async def complete(self) -> FileStats:
+        stats = await self.finish_parts()
+        await self.commit()
+        return stats
+
+    async def abort(self):
+        for future in self._uploads:
+            future.cancel()
+        await asyncio.gather(*[asyncio.wrap_future(future) for future in self._uploads if not future.cancelled()],
+                             return_exceptions=True)
+        if self._upload is not None:
+            await run_in_threadpool(s3.abort_upload, self.directory, self.filename, self._upload)
@@ -0,0 +1,77 @@
+import asyncio
+import datetime
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from dataregistry.api import query
+
+VALIDATION_WORKERS = int(os.getenv('HERMES_VALIDATION_WORKERS', '4'))
+VALIDATION_WAIT_SECONDS = float(os.getenv('HERMES_VALIDATION_WAIT_SECONDS', '10'))
+# a validation still running after this long was lost with the server running it
+VALIDATION_TIMEOUT_SECONDS = int(os.getenv('HERMES_VALIDATION_TIMEOUT_SECONDS', str(60 * 60)))
+JOB_RETENTION_SECONDS = 24 * 60 * 60
+
+executor = ThreadPoolExecutor(max_workers=VALIDATION_WORKERS, thread_name_prefix='hermes-validation')
+# futures of the validations running in this server, by job id, their status is kept in validation_jobs
+running = {}
+
+
+def is_busy() -> bool:
+    return len(running) >= VALIDATION_WORKERS
+
+
+def run(engine, job_id: str, fn, *args):
+    try:
+        result = fn(*args)
+    except Exception as e:
+        query.finish_validation_job(engine, job_id, 'FAILED', {'detail': str(e)})
+        raise
+    query.finish_validation_job(engine, job_id, 'COMPLETE', result)
+    return result
+
+
+def submit(engine, user_name: str, fn, *args) -> str:
+    query.delete_expired_validation_jobs(engine, JOB_RETENTION_SECONDS)
+    job_id = str(uuid.uuid4())
+    query.insert_validation_job(engine, job_id, user_name)
+    future = executor.submit(run, engine, job_id, fn, *args)
+    running[job_id] = future
+    future.add_done_callback(lambda done: running.pop(job_id, None))
+    return job_id
+
+
+def get_job(engine, job_id: str) -> Optional[dict]:
+    return query.get_validation_job(engine, job_id)
+
+
+async def wait(engine, job_id: str, timeout: float = VALIDATION_WAIT_SECONDS):
+    """
+    Waits up to timeout seconds for a job without blocking the event loop, returning its result or None if it is
+    still running or failed. The job itself keeps running when the wait times out.
+    """
+    future = running.get(job_id)
+    if future is None:
+        # it already finished, or is running in another server
+        job = query.get_validation_job(engine, job_id)
+        return job['result'] if job and job['status'] == 'COMPLETE' else None
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+    except asyncio.TimeoutError:
+        return None
+    except Exception:
+        # the failure is recorded with the job
+        return None
+
+
+def job_status(job: dict) -> dict:
+    job_id, status = job['job_id'], job['status']
+    if status == 'RUNNING':
+        timed_out = datetime.datetime.now() - datetime.timedelta(seconds=VALIDATION_TIMEOUT_SECONDS)
+        if job['submitted_at'] < timed_out:
+            return {'job_id': job_id, 'status': 'FAILED', 'detail': 'Validation did not finish'}
+        return {'job_id': job_id, 'status': 'RUNNING'}
+    if status == 'FAILED':
+        return {'job_id': job_id, 'status': 'FAILED', 'detail': job['result']['detail']}
+    return {'job_id': job_id, 'status': 'COMPLETE', 'result': job['result']}
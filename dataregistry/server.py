@@ -1,9 +1,11 @@
+import asyncio
+
 import fastapi
 from fastapi import Depends
 from fastapi.middleware.cors import CORSMiddleware
 
-from dataregistry.api import api
-from dataregistry.api.api import get_current_user
+from dataregistry.api import api, ecs, job_tracker, meta_analysis_staging
+from dataregistry.api.api import get_current_user, engine
 
 ROUTES_WITHOUT_AUTH = {'stream_file', 'version', 'login', 'google_login', 'start_aggregator'}
 
@@ -14,6 +16,16 @@ for route in api.router.routes:
     if route.name not in ROUTES_WITHOUT_AUTH:
         route.dependencies.append(Depends(get_current_user))
 
+
+@app.on_event('startup')
+async def start_trackers():
+    # picks up any jobs, conversions and meta-analysis stagings that were still waiting when the server last stopped
+    asyncio.create_task(job_tracker.track_jobs(engine))
+    asyncio.create_task(ecs.track_conversions())
+    asyncio.create_task(api.track_upload_sessions())
+    asyncio.create_task(meta_analysis_staging.track_stagings(engine))
+
+
 # all the various routers for each api
 app.include_router(api.router, prefix='/api', tags=['api'])
 
@@ -34,4 +46,6 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=['*'],
     allow_headers=['*'],
+    # the frontend pages through the hermes uploads with this
+    expose_headers=['X-Next-Cursor'],
 )
@@ -5,10 +5,11 @@ import boto3
 import click
 
 
-def download_file_from_s3(s3_path):
+def download_file_from_s3(s3_path, file_name=None):
     s3 = boto3.client('s3')
     bucket, key = s3_path.replace("s3://", "").split("/", 1)
-    remote_file_name = key.split('/')[-1]
+    # uploads are stored under their sha256, file_name keeps the extension the qc script reads
+    remote_file_name = file_name or key.split('/')[-1]
     s3.download_file(bucket, key, remote_file_name)
     return remote_file_name
 
@@ -78,9 +79,10 @@ def run_r_commands(file_path, file_guid, col_map, script_options):
 @click.option('--file_guid', '-g', type=str, required=True)
 @click.option('--column_map', '-c', type=str, required=True)
 @click.option('--script_options', '-o', type=str, required=True)
-def main(s3_path, file_guid, column_map, script_options):
+@click.option('--file_name', '-f', type=str, default=None)
+def main(s3_path, file_guid, column_map, script_options, file_name):
     download_file_from_s3("s3://dig-data-registry-qa/hermes/nick-reference/HRC.r1-1.GRCh37.wgs.mac5.sites.tab.gz")
-    local_file = download_file_from_s3(s3_path)
+    local_file = download_file_from_s3(s3_path, file_name)
     run_r_commands(local_file, file_guid, json.loads(column_map), json.loads(script_options))
 
 
@@ -0,0 +1,35 @@
+"""bioindex objects
+
+Revision ID: 5e1c2a7b9d40
+Revises: d2ebd3a31541
+Create Date: 2026-10-18 09:15:12.418377
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '5e1c2a7b9d40'
+down_revision = 'd2ebd3a31541'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    query = """
+        CREATE TABLE `bioindex_objects` (
+        `index_name` varchar(200) NOT NULL,
+        `s3_key` varchar(500) NOT NULL,
+        `etag` varchar(100) NOT NULL,
+        `size` bigint NOT NULL,
+        `indexed_at` datetime NOT NULL,
+        PRIMARY KEY (`index_name`, `s3_key`)
+        )
+        """
+    conn.execute(text(query))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP TABLE `bioindex_objects`"))
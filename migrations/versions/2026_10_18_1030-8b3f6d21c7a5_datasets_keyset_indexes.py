@@ -0,0 +1,27 @@
+"""datasets keyset indexes
+
+Revision ID: 8b3f6d21c7a5
+Revises: 5e1c2a7b9d40
+Create Date: 2026-10-18 10:30:41.207731
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '8b3f6d21c7a5'
+down_revision = '5e1c2a7b9d40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("CREATE INDEX datasets_created_at_id_idx ON datasets (created_at, id)"))
+    conn.execute(text("CREATE INDEX datasets_user_created_at_id_idx ON datasets (user_id, created_at, id)"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP INDEX datasets_created_at_id_idx ON datasets"))
+    conn.execute(text("DROP INDEX datasets_user_created_at_id_idx ON datasets"))
@@ -0,0 +1,32 @@
+"""file uploads phenotype column
+
+Revision ID: c41a9e7d2f36
+Revises: 8b3f6d21c7a5
+Create Date: 2026-10-18 11:15:03.592148
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = 'c41a9e7d2f36'
+down_revision = '8b3f6d21c7a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""ALTER TABLE file_uploads ADD COLUMN phenotype varchar(100)
+        GENERATED ALWAYS AS (JSON_UNQUOTE(JSON_EXTRACT(metadata, '$.phenotype'))) STORED"""))
+    conn.execute(text("CREATE INDEX file_uploads_uploaded_at_idx ON file_uploads (uploaded_at, id)"))
+    conn.execute(text("CREATE INDEX file_uploads_phenotype_idx ON file_uploads (phenotype, uploaded_at, id)"))
+    conn.execute(text("CREATE INDEX file_uploads_uploaded_by_idx ON file_uploads (uploaded_by, uploaded_at, id)"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP INDEX file_uploads_uploaded_by_idx ON file_uploads"))
+    conn.execute(text("DROP INDEX file_uploads_phenotype_idx ON file_uploads"))
+    conn.execute(text("DROP INDEX file_uploads_uploaded_at_idx ON file_uploads"))
+    conn.execute(text("ALTER TABLE file_uploads DROP COLUMN phenotype"))
@@ -0,0 +1,42 @@
+"""compressed logs
+
+Revision ID: 7d2e5f9a4b13
+Revises: c41a9e7d2f36
+Create Date: 2026-10-18 12:00:27.845203
+
+"""
+import gzip
+
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '7d2e5f9a4b13'
+down_revision = 'c41a9e7d2f36'
+branch_labels = None
+depends_on = None
+
+LOG_COLUMNS = [('file_uploads', 'qc_log', 'qc_log_gz'), ('meta_analyses', 'log', 'log_gz')]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    for table, column, compressed_column in LOG_COLUMNS:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {compressed_column} LONGBLOB NULL"))
+        rows = conn.execute(text(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL")).fetchall()
+        for row_id, log in rows:
+            conn.execute(text(f"UPDATE {table} SET {compressed_column} = :log WHERE id = :id"),
+                         {'log': gzip.compress(log.encode('utf-8')), 'id': row_id})
+        conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    for table, column, compressed_column in LOG_COLUMNS:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} text NULL"))
+        rows = conn.execute(text(f"SELECT id, {compressed_column} FROM {table} "
+                                 f"WHERE {compressed_column} IS NOT NULL")).fetchall()
+        for row_id, log in rows:
+            conn.execute(text(f"UPDATE {table} SET {column} = :log WHERE id = :id"),
+                         {'log': gzip.decompress(log).decode('utf-8'), 'id': row_id})
+        conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {compressed_column}"))
@@ -0,0 +1,39 @@
+"""jobs
+
+Revision ID: a6c8d0e2f417
+Revises: 7d2e5f9a4b13
+Create Date: 2026-10-18 13:00:52.116480
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = 'a6c8d0e2f417'
+down_revision = '7d2e5f9a4b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    query = """
+        CREATE TABLE `jobs` (
+        `job_id` varchar(100) NOT NULL,
+        `kind` varchar(50) NOT NULL,
+        `identifier` varchar(100) NOT NULL,
+        `status` varchar(50) NOT NULL,
+        `log_stream_name` varchar(500) NULL,
+        `log_token` varchar(500) NULL,
+        `created_at` datetime NOT NULL,
+        `finished_at` datetime NULL,
+        PRIMARY KEY (`job_id`),
+        KEY `jobs_finished_at_idx` (`finished_at`)
+        )
+        """
+    conn.execute(text(query))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP TABLE `jobs`"))
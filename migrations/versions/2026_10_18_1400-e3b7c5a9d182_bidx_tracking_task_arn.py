@@ -0,0 +1,27 @@
+"""bidx_tracking task arn
+
+Revision ID: e3b7c5a9d182
+Revises: a6c8d0e2f417
+Create Date: 2026-10-18 14:00:27.604113
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = 'e3b7c5a9d182'
+down_revision = 'a6c8d0e2f417'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("ALTER TABLE `bidx_tracking` ADD COLUMN `task_arn` varchar(200) NULL"))
+    conn.execute(text("CREATE INDEX `bidx_tracking_status_idx` ON `bidx_tracking` (`status`)"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP INDEX `bidx_tracking_status_idx` ON `bidx_tracking`"))
+    conn.execute(text("ALTER TABLE `bidx_tracking` DROP COLUMN `task_arn`"))
@@ -0,0 +1,66 @@
+"""upload sessions
+
+Revision ID: 5f2d8e6c1a90
+Revises: e3b7c5a9d182
+Create Date: 2026-10-18 15:00:14.382920
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '5f2d8e6c1a90'
+down_revision = 'e3b7c5a9d182'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    query = """
+        CREATE TABLE `upload_sessions` (
+        `id` binary(32) NOT NULL,
+        `kind` varchar(50) NOT NULL,
+        `dataset_id` binary(32) NULL,
+        `phenotype` varchar(100) NULL,
+        `dichotomous` boolean NULL,
+        `sample_size` int NULL,
+        `cases` int NULL,
+        `controls` int NULL,
+        `phenotype_data_set_id` binary(32) NULL,
+        `credible_set_name` varchar(100) NULL,
+        `directory` varchar(500) NOT NULL,
+        `file_name` varchar(500) NOT NULL,
+        `s3_upload_id` varchar(1024) NOT NULL,
+        `created_by` int NOT NULL,
+        `status` varchar(50) NOT NULL,
+        `created_at` datetime NOT NULL,
+        `completed_at` datetime NULL,
+        PRIMARY KEY (`id`)
+        )
+        """
+    conn.execute(text(query))
+    query = """
+        CREATE TABLE `upload_session_parts` (
+        `session_id` binary(32) NOT NULL,
+        `part_number` int NOT NULL,
+        `etag` varchar(100) NOT NULL,
+        `size` bigint NOT NULL,
+        `uploaded_at` datetime NOT NULL,
+        PRIMARY KEY (`session_id`, `part_number`),
+        CONSTRAINT `fk_upload_session_parts_session` FOREIGN KEY (`session_id`) REFERENCES `upload_sessions` (`id`)
+            ON DELETE CASCADE
+        )
+        """
+    conn.execute(text(query))
+    # resumable uploads are meant for files of several GB
+    conn.execute(text("ALTER TABLE `dataset_phenotypes` MODIFY COLUMN file_size bigint not null default 0"))
+    conn.execute(text("ALTER TABLE `credible_sets` MODIFY COLUMN file_size bigint not null default 0"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("ALTER TABLE `dataset_phenotypes` MODIFY COLUMN file_size int not null default 0"))
+    conn.execute(text("ALTER TABLE `credible_sets` MODIFY COLUMN file_size int not null default 0"))
+    conn.execute(text("DROP TABLE `upload_session_parts`"))
+    conn.execute(text("DROP TABLE `upload_sessions`"))
@@ -0,0 +1,35 @@
+"""upload stats
+
+Revision ID: 9c4a1f7e3b25
+Revises: 5f2d8e6c1a90
+Create Date: 2026-10-18 16:00:41.905263
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '9c4a1f7e3b25'
+down_revision = '5f2d8e6c1a90'
+branch_labels = None
+depends_on = None
+
+TABLES = ['dataset_phenotypes', 'credible_sets']
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    for table in TABLES:
+        conn.execute(text(f"""
+            ALTER TABLE `{table}` ADD COLUMN `sha256` char(64) NULL, ADD COLUMN `gzipped` boolean NULL,
+            ADD COLUMN `row_count` bigint NULL, ADD COLUMN `header_sample` text NULL
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    for table in TABLES:
+        conn.execute(text(f"""
+            ALTER TABLE `{table}` DROP COLUMN `sha256`, DROP COLUMN `gzipped`, DROP COLUMN `row_count`,
+            DROP COLUMN `header_sample`
+        """))
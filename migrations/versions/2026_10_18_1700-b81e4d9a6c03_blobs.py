@@ -0,0 +1,69 @@
+"""blobs
+
+Revision ID: b81e4d9a6c03
+Revises: 9c4a1f7e3b25
+Create Date: 2026-10-18 17:00:09.517348
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = 'b81e4d9a6c03'
+down_revision = '9c4a1f7e3b25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    query = """
+        CREATE TABLE `blobs` (
+        `sha256` char(64) NOT NULL,
+        `s3_path` varchar(1024) NOT NULL,
+        `ref_count` int NOT NULL,
+        `created_at` datetime NOT NULL,
+        PRIMARY KEY (`sha256`)
+        )
+        """
+    conn.execute(text(query))
+    # files hashed before blobs existed each have their own object, the blob keeps one of them
+    conn.execute(text("""
+        INSERT INTO `blobs` (sha256, s3_path, ref_count, created_at)
+        SELECT sha256, MIN(s3_path), COUNT(*), NOW() FROM (
+            SELECT sha256, s3_path FROM dataset_phenotypes WHERE sha256 IS NOT NULL
+            UNION ALL SELECT sha256, s3_path FROM credible_sets WHERE sha256 IS NOT NULL
+        ) files GROUP BY sha256
+    """))
+    # the other copies are recorded for scripts/delete_blob_orphans.py, unless something else still uses the path
+    query = """
+        CREATE TABLE `blob_orphans` (
+        `s3_path` varchar(1024) NOT NULL,
+        `sha256` char(64) NOT NULL,
+        `created_at` datetime NOT NULL
+        )
+        """
+    conn.execute(text(query))
+    conn.execute(text("""
+        INSERT INTO `blob_orphans` (s3_path, sha256, created_at)
+        SELECT DISTINCT files.s3_path, files.sha256, NOW() FROM (
+            SELECT sha256, s3_path FROM dataset_phenotypes WHERE sha256 IS NOT NULL
+            UNION ALL SELECT sha256, s3_path FROM credible_sets WHERE sha256 IS NOT NULL
+        ) files JOIN blobs b ON b.sha256 = files.sha256
+        WHERE files.s3_path != b.s3_path
+        AND files.s3_path NOT IN (SELECT s3_path FROM blobs)
+        AND files.s3_path NOT IN (SELECT s3_path FROM dataset_phenotypes WHERE sha256 IS NULL)
+        AND files.s3_path NOT IN (SELECT s3_path FROM credible_sets WHERE sha256 IS NULL)
+    """))
+    conn.execute(text("UPDATE dataset_phenotypes p JOIN blobs b ON b.sha256 = p.sha256 SET p.s3_path = b.s3_path"))
+    conn.execute(text("UPDATE credible_sets cs JOIN blobs b ON b.sha256 = cs.sha256 SET cs.s3_path = b.s3_path"))
+    conn.execute(text("CREATE INDEX `dataset_phenotypes_sha256_idx` ON `dataset_phenotypes` (`sha256`)"))
+    conn.execute(text("CREATE INDEX `credible_sets_sha256_idx` ON `credible_sets` (`sha256`)"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP INDEX `credible_sets_sha256_idx` ON `credible_sets`"))
+    conn.execute(text("DROP INDEX `dataset_phenotypes_sha256_idx` ON `dataset_phenotypes`"))
+    conn.execute(text("DROP TABLE `blob_orphans`"))
+    conn.execute(text("DROP TABLE `blobs`"))
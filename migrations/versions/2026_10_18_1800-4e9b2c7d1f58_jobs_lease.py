@@ -0,0 +1,26 @@
+"""jobs lease
+
+Revision ID: 4e9b2c7d1f58
+Revises: b81e4d9a6c03
+Create Date: 2026-10-18 18:00:41.208519
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '4e9b2c7d1f58'
+down_revision = 'b81e4d9a6c03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("ALTER TABLE `jobs` ADD COLUMN `leased_by` varchar(200) NULL, "
+                      "ADD COLUMN `lease_expires_at` datetime NULL"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("ALTER TABLE `jobs` DROP COLUMN `lease_expires_at`, DROP COLUMN `leased_by`"))
@@ -0,0 +1,26 @@
+"""bidx_tracking lease
+
+Revision ID: 8a3f6d2e9c71
+Revises: 4e9b2c7d1f58
+Create Date: 2026-10-18 19:00:13.772904
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '8a3f6d2e9c71'
+down_revision = '4e9b2c7d1f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("ALTER TABLE `bidx_tracking` ADD COLUMN `leased_by` varchar(200) NULL, "
+                      "ADD COLUMN `lease_expires_at` datetime NULL"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("ALTER TABLE `bidx_tracking` DROP COLUMN `lease_expires_at`, DROP COLUMN `leased_by`"))
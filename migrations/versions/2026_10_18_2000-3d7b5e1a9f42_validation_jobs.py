@@ -0,0 +1,37 @@
+"""validation jobs
+
+Revision ID: 3d7b5e1a9f42
+Revises: 8a3f6d2e9c71
+Create Date: 2026-10-18 20:00:17.604215
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '3d7b5e1a9f42'
+down_revision = '8a3f6d2e9c71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    query = """
+        CREATE TABLE `validation_jobs` (
+        `job_id` char(36) NOT NULL,
+        `user_name` varchar(200) NOT NULL,
+        `status` varchar(20) NOT NULL,
+        `result` mediumtext NULL,
+        `submitted_at` datetime NOT NULL,
+        `finished_at` datetime NULL,
+        PRIMARY KEY (`job_id`),
+        KEY `validation_jobs_submitted_at` (`submitted_at`)
+        )
+        """
+    conn.execute(text(query))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP TABLE `validation_jobs`"))
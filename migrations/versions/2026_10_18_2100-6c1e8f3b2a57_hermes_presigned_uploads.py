@@ -0,0 +1,34 @@
+"""hermes presigned uploads
+
+Revision ID: 6c1e8f3b2a57
+Revises: 3d7b5e1a9f42
+Create Date: 2026-10-18 21:00:42.913580
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '6c1e8f3b2a57'
+down_revision = '3d7b5e1a9f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # who each presigned HERMES upload url was issued to, before validate-hermes adds the file_uploads row
+    query = """
+        CREATE TABLE `hermes_presigned_uploads` (
+        `s3_path` varchar(700) NOT NULL,
+        `user_name` varchar(200) NOT NULL,
+        `created_at` datetime NOT NULL,
+        PRIMARY KEY (`s3_path`)
+        )
+        """
+    conn.execute(text(query))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP TABLE `hermes_presigned_uploads`"))
@@ -0,0 +1,26 @@
+"""file uploads sha256
+
+Revision ID: 5a2d9c4e7b18
+Revises: 6c1e8f3b2a57
+Create Date: 2026-10-18 22:00:17.402916
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '5a2d9c4e7b18'
+down_revision = '6c1e8f3b2a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # HERMES uploads saved from now on are stored as blobs, older ones keep their own object and have no sha256
+    conn.execute(text("ALTER TABLE `file_uploads` ADD COLUMN `sha256` char(64) NULL"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("ALTER TABLE `file_uploads` DROP COLUMN `sha256`"))
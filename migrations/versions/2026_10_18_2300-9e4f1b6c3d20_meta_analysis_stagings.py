@@ -0,0 +1,56 @@
+"""meta analysis stagings
+
+Revision ID: 9e4f1b6c3d20
+Revises: 5a2d9c4e7b18
+Create Date: 2026-10-18 23:00:05.118374
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '9e4f1b6c3d20'
+down_revision = '5a2d9c4e7b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # the inputs, job and progress of each meta-analysis's staging, leased to the server running it
+    query = """
+        CREATE TABLE `meta_analysis_stagings` (
+        `meta_analysis_id` binary(32) NOT NULL,
+        `stage` varchar(20) NOT NULL,
+        `prefixes` json NOT NULL,
+        `job_config` json NOT NULL,
+        `deleted_objects` int NOT NULL DEFAULT 0,
+        `copied_objects` int NOT NULL DEFAULT 0,
+        `objects` int NOT NULL DEFAULT 0,
+        `copied_bytes` bigint NOT NULL DEFAULT 0,
+        `total_bytes` bigint NOT NULL DEFAULT 0,
+        `leased_by` varchar(200) NULL,
+        `lease_expires_at` datetime NULL,
+        `created_at` datetime NOT NULL,
+        PRIMARY KEY (`meta_analysis_id`),
+        KEY `meta_analysis_stagings_stage` (`stage`, `created_at`)
+        )
+        """
+    conn.execute(text(query))
+    # named locks held on a lease, the meta-analysis prefixes can only be staged by one server at a time
+    query = """
+        CREATE TABLE `leases` (
+        `name` varchar(100) NOT NULL,
+        `leased_by` varchar(200) NULL,
+        `lease_expires_at` datetime NULL,
+        PRIMARY KEY (`name`)
+        )
+        """
+    conn.execute(text(query))
+    conn.execute(text("INSERT INTO `leases` (name) VALUES ('meta-analysis-prefixes')"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP TABLE `leases`"))
+    conn.execute(text("DROP TABLE `meta_analysis_stagings`"))
@@ -0,0 +1,25 @@
+import click
+
+from dataregistry.api import query, s3
+from dataregistry.api.db import DataRegistryReadWriteDB
+
+
+@click.command()
+@click.option('--dry-run', is_flag=True, help='list the objects without deleting them')
+def main(dry_run):
+    """
+    Deletes the duplicate copies of files left behind when blobs were introduced, each file's rows now point at the
+    one copy its blob kept.
+    """
+    engine = DataRegistryReadWriteDB().get_engine()
+    orphans = query.get_blob_orphans(engine)
+    for s3_path in orphans:
+        print(s3_path)
+        if not dry_run:
+            s3.delete_paths([s3_path])
+            query.delete_blob_orphan(engine, s3_path)
+    print(f"{'Found' if dry_run else 'Deleted'} {len(orphans)} orphaned copies")
+
+
+if __name__ == '__main__':
+    main()
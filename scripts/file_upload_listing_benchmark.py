@@ -0,0 +1,73 @@
+import datetime
+import json
+import statistics
+import time
+import uuid
+
+import click
+from sqlalchemy import text
+
+from dataregistry.api import query
+from dataregistry.api.db import DataRegistryReadWriteDB
+from dataregistry.api.logs import compress_log
+
+BENCHMARK_UPLOADER = 'listing-benchmark'
+PHENOTYPES = ['T2D', 'T1D', 'BMI', 'HEIGHT', 'LDL', 'HDL', 'CAD', 'AF']
+
+
+def add_uploads(engine, count, log_size):
+    qc_log = 'x' * log_size
+    now = datetime.datetime.now()
+    rows = [{'id': uuid.uuid4().hex, 'dataset': f'benchmark-{i}', 'file_name': 'benchmark.tsv.gz',
+             'file_size': 1000, 'uploaded_at': now - datetime.timedelta(minutes=i), 'uploaded_by': BENCHMARK_UPLOADER,
+             'metadata': json.dumps({'phenotype': PHENOTYPES[i % len(PHENOTYPES)], 'column_map': {'chromosome': 'CHR'}}),
+             's3_path': 'hermes/benchmark/benchmark.tsv.gz', 'qc_log': compress_log(qc_log)} for i in range(count)]
+    with engine.connect() as conn:
+        conn.execute(text("""INSERT INTO file_uploads(id, dataset, file_name, file_size, uploaded_at, uploaded_by,
+        metadata, s3_path, qc_status, qc_log_gz) VALUES(:id, :dataset, :file_name, :file_size, :uploaded_at,
+        :uploaded_by, :metadata, :s3_path, 'READY FOR REVIEW', :qc_log)"""), rows)
+        conn.commit()
+
+
+def remove_uploads(engine):
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM file_uploads WHERE uploaded_by = :uploader"), {'uploader': BENCHMARK_UPLOADER})
+        conn.commit()
+
+
+def time_listing(engine, repeats, **kwargs):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        uploads = query.fetch_file_uploads(engine, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, uploads
+
+
+@click.command()
+@click.option('--sizes', default='1000,10000,100000', help='table sizes to measure at, comma separated')
+@click.option('--log-size', type=int, default=20000, help='bytes of qc log stored per upload, before compression')
+@click.option('--page-size', type=int, default=50)
+@click.option('--repeats', type=int, default=5)
+def main(sizes, log_size, page_size, repeats):
+    """
+    Fills file_uploads with benchmark rows in the database from DATA_REGISTRY_DB_CONNECTION and times the
+    /upload-hermes listing queries at each table size. The rows are removed at the end.
+    """
+    engine = DataRegistryReadWriteDB().get_engine()
+    remove_uploads(engine)
+    inserted = 0
+    try:
+        for size in [int(size) for size in sizes.split(',')]:
+            add_uploads(engine, size - inserted, log_size)
+            inserted = size
+            first_page, uploads = time_listing(engine, repeats, phenotype='T2D', limit=page_size)
+            cursor = query.encode_keyset_cursor(uploads[-1].uploaded_at, uploads[-1].id)
+            next_page, _ = time_listing(engine, repeats, phenotype='T2D', limit=page_size, cursor=cursor)
+            print(f"{size} rows: first page {first_page:.1f}ms, next page {next_page:.1f}ms")
+    finally:
+        remove_uploads(engine)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import click
+from moto import mock_s3
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+from dataregistry.api import s3
+
+KEY = 'benchmark/metadata'
+
+
+def per_request_client():
+    s3_client = boto3.client('s3', region_name=s3.S3_REGION)
+    return s3_client.get_object(Bucket=s3.BASE_BUCKET, Key=KEY)['Body'].read()
+
+
+def shared_client():
+    return s3.get_file_obj(KEY, s3.BASE_BUCKET)['Body'].read()
+
+
+def time_requests(fn, requests, threads):
+    def timed(_):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(timed, range(requests)))
+    return latencies, time.perf_counter() - start
+
+
+@click.command()
+@click.option('--requests', type=int, default=500)
+@click.option('--threads', type=int, default=8)
+@mock_s3
+def main(requests, threads):
+    """
+    Compares per-request latency of building an S3 client for every call against the shared client, using moto as a
+    local S3 stand-in so only the client side of each request is measured.
+    """
+    boto3.client('s3', region_name=s3.S3_REGION).create_bucket(Bucket=s3.BASE_BUCKET)
+    s3.upload_metadata({'benchmark': True}, 'benchmark')
+    for name, fn in [('per-request client', per_request_client), ('shared client', shared_client)]:
+        latencies, elapsed = time_requests(fn, requests, threads)
+        latencies.sort()
+        print(f"{name}: mean {statistics.mean(latencies) * 1000:.2f}ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f}ms, {requests / elapsed:.0f} requests/s")
+
+
+if __name__ == '__main__':
+    main()
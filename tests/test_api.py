@@ -1,3 +1,6 @@
+import base64
+import gzip
+import hashlib
 import io
 import json
 import re
@@ -6,9 +9,11 @@ import boto3
 import pytest
 from fastapi.testclient import TestClient
 from moto import mock_s3, mock_batch
+from sqlalchemy import text
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY, HTTP_200_OK, HTTP_404_NOT_FOUND, HTTP_401_UNAUTHORIZED, \
-    HTTP_400_BAD_REQUEST
+    HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
 
+from dataregistry.api import api, query
 from dataregistry.api.model import DataFormat, User, HermesFileStatus
 from dataregistry.api.jwt_utils import get_encoded_jwt_data
 
@@ -16,6 +21,7 @@ AUTHORIZATION = "Authorization"
 
 auth_token = f"Bearer {get_encoded_jwt_data(User(user_name='test', roles=['admin'], id=1))}"
 view_only_token = f"Bearer {get_encoded_jwt_data(User(user_name='view', roles=['viewer'], id=2))}"
+uploader_token = f"Bearer {get_encoded_jwt_data(User(user_name='uploader', roles=['uploader'], id=3))}"
 
 dataset_api_path = '/api/datasets'
 study_api_path = '/api/studies'
@@ -106,16 +112,113 @@ def test_post_then_retrieve_by_id(api_client: TestClient):
     assert response.status_code == HTTP_200_OK
 
 
+@mock_s3
+def test_paginate_datasets(api_client: TestClient):
+    study_id = save_study(api_client)
+    for name, ancestry in [('first', 'EA'), ('second', 'AA'), ('third', 'EA')]:
+        new_dataset = example_dataset_json.copy()
+        new_dataset.update({'study_id': study_id, 'name': name, 'ancestry': ancestry})
+        create_new_dataset(api_client, new_dataset)
+    first_page = api_client.get(f"{dataset_api_path}?limit=2&fields=name", headers={AUTHORIZATION: auth_token}).json()
+    assert len(first_page['datasets']) == 2
+    assert all(ds.keys() == {'name'} for ds in first_page['datasets'])
+    second_page = api_client.get(f"{dataset_api_path}?limit=2&fields=name&cursor={first_page['next_cursor']}",
+                                 headers={AUTHORIZATION: auth_token}).json()
+    assert len(second_page['datasets']) == 1
+    assert second_page['next_cursor'] is None
+    names = {ds['name'] for ds in first_page['datasets'] + second_page['datasets']}
+    assert names == {'first', 'second', 'third'}
+    filtered = api_client.get(f"{dataset_api_path}?ancestry=EA", headers={AUTHORIZATION: auth_token}).json()
+    assert {ds['name'] for ds in filtered['datasets']} == {'first', 'third'}
+    response = api_client.get(f"{dataset_api_path}?cursor=not-a-cursor", headers={AUTHORIZATION: auth_token})
+    assert response.status_code == HTTP_400_BAD_REQUEST
+
+
+def encoded_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('utf-8')
+
+
+@mock_s3
+def test_datasets_page_keyset(api_client: TestClient):
+    study_id = save_study(api_client)
+    for i in range(5):
+        create_new_dataset(api_client, {**example_dataset_json, 'study_id': study_id, 'name': f'keyset_{i}'})
+    # every dataset shares its created_at, so the pages are ordered by the binary ids alone
+    with api.engine.connect() as conn:
+        conn.execute(text("UPDATE datasets SET created_at = '2026-01-01 00:00:00'"))
+        conn.commit()
+    all_ids = [dataset.id for dataset in query.get_datasets_page(api.engine, {})['datasets']]
+    assert all_ids == sorted(all_ids, key=lambda ds_id: ds_id.hex)
+
+    pages, cursor = [], None
+    while True:
+        page = query.get_datasets_page(api.engine, {}, limit=2, cursor=cursor)
+        pages.append([dataset.id for dataset in page['datasets']])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert [len(ids) for ids in pages] == [2, 2, 1]
+    assert [ds_id for ids in pages for ds_id in ids] == all_ids
+
+    # a last page that is exactly full has no next page
+    first_page = query.get_datasets_page(api.engine, {}, limit=4)
+    last_page = query.get_datasets_page(api.engine, {}, limit=1, cursor=first_page['next_cursor'])
+    assert [dataset.id for dataset in last_page['datasets']] == all_ids[4:]
+    assert last_page['next_cursor'] is None
+    assert query.get_datasets_page(api.engine, {}, limit=5)['next_cursor'] is None
+
+    for cursor in ['not-a-cursor', encoded_cursor(['2026-01-01T00:00:00']),
+                   encoded_cursor(['2026-01-01T00:00:00', "' or 1=1 --"]), encoded_cursor(['yesterday', all_ids[0].hex]),
+                   encoded_cursor({'created_at': '2026-01-01T00:00:00', 'id': all_ids[0].hex})]:
+        with pytest.raises(ValueError):
+            query.get_datasets_page(api.engine, {}, limit=2, cursor=cursor)
+
+
+@mock_s3
+def test_dataset_details(api_client: TestClient):
+    ds = add_ds_with_file(api_client)
+    phenotype_id = str(ds['phenotypes'][0]['id']).replace('-', '')
+    with open("tests/sample_upload.txt", "rb") as f:
+        upload_response = api_client.post(f"/api/crediblesetupload/{phenotype_id}/credible_set",
+                                          headers={AUTHORIZATION: auth_token, "Filename": "sample_upload.txt"},
+                                          files={"file": f})
+        assert upload_response.status_code == HTTP_200_OK
+    copy, other_id = create_new_dataset(api_client, {**example_dataset_json, 'name': 'details_without_files'})
+    ids = [ds['dataset']['id'], other_id]
+
+    response = api_client.get("/api/dataset-details", params={'ids': ids}, headers={AUTHORIZATION: auth_token})
+    assert response.status_code == HTTP_200_OK
+    details = {info['dataset']['name']: info for info in response.json()}
+    assert details.keys() == {'file_upload_test', 'details_without_files'}
+    with_files = details['file_upload_test']
+    assert with_files['study']['name'] == example_study_json['name']
+    assert [phenotype['phenotype'] for phenotype in with_files['phenotypes']] == ['t1d']
+    assert [(cs['name'], cs['phenotype']) for cs in with_files['credible_sets']] == [('credible_set', 't1d')]
+    assert details['details_without_files']['phenotypes'] == []
+    assert details['details_without_files']['credible_sets'] == []
+
+    # datasets are only returned to their owner or users who can view everything
+    infos = query.get_dataset_infos(api.engine, ids, user_id=2)
+    assert infos == []
+    response = api_client.get("/api/dataset-details", params={'ids': ids}, headers={AUTHORIZATION: view_only_token})
+    assert response.status_code == HTTP_200_OK
+    assert response.json() == []
+    assert len(query.get_dataset_infos(api.engine, ids, user_id=1)) == 2
+
+
 @mock_s3
 def test_upload_file(api_client: TestClient):
     new_record = add_ds_with_file(api_client)
     s3_conn = boto3.resource("s3", region_name="us-east-1")
-    file_text = s3_conn.Object("dig-data-registry", f"{new_record['dataset']['name']}/t1d/sample_upload.txt").get()[
-        "Body"].read() \
+    file_text = s3_conn.Object("dig-data-registry", stored_key(new_record['phenotypes'][0])).get()["Body"].read() \
         .decode("utf-8")
     assert file_text == "The answer is 47!\n"
 
 
+def stored_key(file_info):
+    return file_info['s3_path'].replace('s3://dig-data-registry/', '')
+
+
 @mock_s3
 def test_uploaded_file_is_not_public(api_client: TestClient):
     new_record = add_ds_with_file(api_client)
@@ -166,6 +269,105 @@ def test_upload_credible_set(api_client: TestClient):
     assert len(credible_sets) == 1
 
 
+@mock_s3
+def test_duplicate_upload_shares_stored_file(api_client: TestClient):
+    datasets = []
+    for name in ['dedup_first', 'dedup_second']:
+        copy, new_dataset_id = create_new_dataset(api_client, {**example_dataset_json, 'name': name})
+        with open("tests/sample_upload.txt", "rb") as f:
+            upload_response = api_client.post(f"/api/uploadfile/{new_dataset_id.replace('-', '')}/true/10?phenotype=t1d",
+                                              headers={AUTHORIZATION: auth_token, "Filename": f"{name}.txt"},
+                                              files={"file": f})
+            assert upload_response.status_code == HTTP_200_OK
+        datasets.append(api_client.get(f"/api/datasets/{new_dataset_id}", headers={AUTHORIZATION: auth_token}).json())
+    with open("tests/sample_upload.txt", "rb") as f:
+        blob_key = f"blobs/{hashlib.sha256(f.read()).hexdigest()}"
+    assert stored_key(datasets[0]['phenotypes'][0]) == blob_key
+    assert stored_key(datasets[1]['phenotypes'][0]) == blob_key
+    s3_conn = boto3.resource("s3", region_name="us-east-1")
+    bucket = s3_conn.Bucket("dig-data-registry")
+    assert [obj.key for obj in bucket.objects.filter(Prefix="uploads/")] == []
+
+    # other content under the same name is stored separately and leaves the shared file alone
+    first_id = datasets[0]['dataset']['id'].replace('-', '')
+    upload_response = api_client.post(f"/api/uploadfile/{first_id}/true/10?phenotype=t2d",
+                                      headers={AUTHORIZATION: auth_token, "Filename": "dedup_first.txt"},
+                                      files={"file": ("dedup_first.txt", b"Something else\n")})
+    assert upload_response.status_code == HTTP_200_OK
+    assert s3_conn.Object("dig-data-registry", blob_key).get()["Body"].read() == b"The answer is 47!\n"
+
+    api_client.delete(f"{dataset_api_path}/{datasets[0]['dataset']['id']}", headers={AUTHORIZATION: auth_token})
+    assert [obj.key for obj in bucket.objects.filter(Prefix="blobs/")] == [blob_key]
+    api_client.delete(f"{dataset_api_path}/{datasets[1]['dataset']['id']}", headers={AUTHORIZATION: auth_token})
+    assert [obj.key for obj in bucket.objects.filter(Prefix="blobs/")] == []
+
+
+@mock_s3
+def test_resumable_upload_session(api_client: TestClient):
+    copy, new_dataset_id = create_new_dataset(api_client, {**example_dataset_json, 'name': 'resumable_upload_test'})
+    session = api_client.post("/api/upload-sessions", headers={AUTHORIZATION: auth_token},
+                              json={'kind': 'phenotype', 'file_name': 'sample_upload.txt', 'dataset_id': new_dataset_id,
+                                    'phenotype': 't1d', 'dichotomous': True, 'sample_size': 10})
+    assert session.status_code == HTTP_200_OK
+    session_path = f"/api/upload-sessions/{session.json()['session_id']}"
+    first_part = b'x' * 5 * 1024 * 1024
+    # resending a part replaces it
+    for part_number, contents in [(2, b'The answer is 47!\n'), (1, b'lost'), (1, first_part)]:
+        response = api_client.put(f"{session_path}/parts/{part_number}", headers={AUTHORIZATION: auth_token},
+                                  content=contents)
+        assert response.status_code == HTTP_200_OK
+    parts = api_client.get(f"{session_path}/parts", headers={AUTHORIZATION: auth_token}).json()
+    assert [(part['part_number'], part['size']) for part in parts] == [(1, len(first_part)), (2, 18)]
+
+    response = api_client.post(f"{session_path}/complete", headers={AUTHORIZATION: auth_token})
+    assert response.status_code == HTTP_200_OK
+    assert 'phenotype_data_set_id' in response.json()
+    dataset = api_client.get(f"/api/datasets/{new_dataset_id}", headers={AUTHORIZATION: auth_token}).json()
+    s3_conn = boto3.resource("s3", region_name="us-east-1")
+    file_text = s3_conn.Object("dig-data-registry", stored_key(dataset['phenotypes'][0])).get()["Body"].read()
+    assert file_text == first_part + b'The answer is 47!\n'
+    assert stored_key(dataset['phenotypes'][0]) == f"blobs/{hashlib.sha256(file_text).hexdigest()}"
+    bucket = s3_conn.Bucket("dig-data-registry")
+    assert [obj.key for obj in bucket.objects.filter(Prefix="uploads/")] == []
+    assert api_client.post(f"{session_path}/complete", headers={AUTHORIZATION: auth_token}).status_code == 409
+
+    api_client.delete(f"{dataset_api_path}/{new_dataset_id}", headers={AUTHORIZATION: auth_token})
+    assert [obj.key for obj in bucket.objects.filter(Prefix="blobs/")] == []
+
+
+@mock_s3
+def test_upload_restores_claimed_blob_without_file(api_client: TestClient):
+    with open("tests/sample_upload.txt", "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    # a claim whose upload failed before storing the file
+    api.claim_blob(sha256)
+    ds = add_ds_with_file(api_client)
+    assert stored_key(ds['phenotypes'][0]) == f"blobs/{sha256}"
+    s3_conn = boto3.resource("s3", region_name="us-east-1")
+    assert s3_conn.Object("dig-data-registry", f"blobs/{sha256}").get()["Body"].read() == b"The answer is 47!\n"
+
+
+@mock_s3
+def test_upload_session_limits(api_client: TestClient, monkeypatch):
+    copy, new_dataset_id = create_new_dataset(api_client, {**example_dataset_json, 'name': 'abandoned_upload_test'})
+    session = api_client.post("/api/upload-sessions", headers={AUTHORIZATION: auth_token},
+                              json={'kind': 'phenotype', 'file_name': 'sample_upload.txt', 'dataset_id': new_dataset_id,
+                                    'phenotype': 't1d', 'dichotomous': True, 'sample_size': 10})
+    session_path = f"/api/upload-sessions/{session.json()['session_id']}"
+    monkeypatch.setattr(api, 'UPLOAD_SESSION_MAX_PART_SIZE', 10)
+    response = api_client.put(f"{session_path}/parts/1", headers={AUTHORIZATION: auth_token},
+                              content=b'The answer is 47!\n')
+    assert response.status_code == 413
+
+    # a session without parts for longer than the ttl is aborted
+    monkeypatch.setattr(api, 'UPLOAD_SESSION_TTL_SECONDS', -1)
+    api.expire_upload_sessions()
+    s3_client = boto3.client("s3", region_name="us-east-1")
+    assert 'Uploads' not in s3_client.list_multipart_uploads(Bucket="dig-data-registry")
+    response = api_client.put(f"{session_path}/parts/1", headers={AUTHORIZATION: auth_token}, content=b'late')
+    assert response.status_code == 409
+
+
 @pytest.mark.parametrize("df", DataFormat.__members__.values())
 @mock_s3
 def test_valid_data_formats_post(api_client: TestClient, df: DataFormat):
@@ -214,11 +416,69 @@ def test_preview_delimited_file(api_client: TestClient):
         assert res.json() == {'columns': ["ID","CHR","BP","OA","EA","EAF","BETA","SE","P","EUR_EAF","SNP"]}
 
 
+@mock_s3
+def test_preview_s3_file(api_client: TestClient):
+    set_up_moto_bucket()
+    with open('tests/test_csv_upload.csv', mode='rb') as f:
+        file_bytes = f.read()
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.put_object(Bucket='dig-data-registry', Key='hermes/preview/test.csv.gz',
+                         Body=gzip.compress(file_bytes) + gzip.compress(file_bytes.split(b'\n', 1)[1]))
+    res = api_client.get('api/preview-delimited-file/s3', headers={AUTHORIZATION: auth_token},
+                         params={'key': 'hermes/preview/test.csv.gz', 'sample_kb': 1})
+    assert res.status_code == HTTP_200_OK
+    assert res.json()['columns'] == ["ID", "CHR", "BP", "OA", "EA", "EAF", "BETA", "SE", "P", "EUR_EAF", "SNP"]
+    assert res.json()['types']['BP'] == 'INTEGER'
+    assert res.json()['types']['BETA'] == 'DECIMAL'
+    assert res.json()['types']['SNP'] == 'TEXT'
+
+    s3_client.put_object(Bucket='dig-data-registry', Key='hermes/preview/dupes.csv', Body=b'a,b,a\n1,2,3\n')
+    res = api_client.get('api/preview-delimited-file/s3', headers={AUTHORIZATION: auth_token},
+                         params={'key': 'hermes/preview/dupes.csv'})
+    assert res.status_code == HTTP_400_BAD_REQUEST
+    res = api_client.get('api/preview-delimited-file/s3', headers={AUTHORIZATION: auth_token},
+                         params={'key': 'hermes/preview/missing.csv'})
+    assert res.status_code == HTTP_404_NOT_FOUND
+
+
+@mock_s3
+def test_preview_s3_file_of_another_user(api_client: TestClient):
+    new_record = add_ds_with_file(api_client)
+    key = stored_key(new_record['phenotypes'][0])
+    res = api_client.get('api/preview-delimited-file/s3', headers={AUTHORIZATION: view_only_token},
+                         params={'key': key})
+    assert res.status_code == HTTP_403_FORBIDDEN
+    res = api_client.get('api/preview-delimited-file/s3', headers={AUTHORIZATION: view_only_token},
+                         params={'key': 'hermes/someone-else/upload.csv'})
+    assert res.status_code == HTTP_403_FORBIDDEN
+
+
+@mock_s3
+def test_preview_own_presigned_upload(api_client: TestClient):
+    set_up_moto_bucket()
+    headers = {AUTHORIZATION: uploader_token, 'Dataset': 'own-upload', 'Filename': 'upload.csv'}
+    res = api_client.get('api/get-hermes-pre-signed-url', headers=headers)
+    assert res.status_code == HTTP_200_OK
+    key = res.json()['s3_path']
+    # the client puts the file with the url, there is no file_uploads row until it is validated
+    boto3.client('s3', region_name='us-east-1').put_object(Bucket='dig-data-registry', Key=key, Body=b'a,b\n1,2\n')
+    res = api_client.get('api/preview-delimited-file/s3', headers={AUTHORIZATION: uploader_token},
+                         params={'key': key})
+    assert res.status_code == HTTP_200_OK
+    assert res.json()['columns'] == ['a', 'b']
+
+    res = api_client.get('api/get-hermes-pre-signed-url', headers={**headers, AUTHORIZATION: view_only_token})
+    assert res.status_code == HTTP_403_FORBIDDEN
+    res = api_client.get('api/preview-delimited-file/s3', headers={AUTHORIZATION: view_only_token},
+                         params={'key': key})
+    assert res.status_code == HTTP_403_FORBIDDEN
+
+
 @mock_s3
 @mock_batch
 def test_start_meta_analysis(mocker, api_client: TestClient):
     set_up_moto_bucket()
-    patch = mocker.patch('dataregistry.api.batch.submit_and_await_job')
+    patch = mocker.patch('dataregistry.api.job_tracker.submit_job')
     patch.return_value = None
     mocker.patch('boto3.client').return_value.generate_presigned_url.return_value = 'http://mocked-presigned-url'
 
@@ -227,8 +487,9 @@ def test_start_meta_analysis(mocker, api_client: TestClient):
     with open('tests/test_csv_upload.csv', mode='rb') as f:
         file_bytes = f.read()
 
+    # the file is read once to validate it and once to hash it
     mock_s3_get_object = mocker.patch('boto3.client').return_value.get_object
-    mock_s3_get_object.return_value = {
+    mock_s3_get_object.side_effect = lambda **kwargs: {
         'Body': io.BytesIO(file_bytes),
         'ContentLength': len(file_bytes)
     }
@@ -250,16 +511,17 @@ def test_start_meta_analysis(mocker, api_client: TestClient):
                                                                                            'phenotype': 'T2D',
                                                                                            'created_by': 'dhite'})
     assert "meta-analysis-id" in res.json()
+    staging = api_client.get(f"api/hermes-meta-analysis/{res.json()['meta-analysis-id']}/staging",
+                             headers={AUTHORIZATION: auth_token})
+    assert staging.json()['stage'] == 'QUEUED'
     res = api_client.get('api/hermes-meta-analysis', headers={AUTHORIZATION: auth_token})
     ma_results = res.json()
     assert ma_results[0].get("name") == "Test Metadata"
     assert ma_results[0].get("dataset_names") == ['unit-test-dataset']
 
-@mock_s3
-@mock_batch
-def test_upload_hermes_csv(mocker, api_client: TestClient):
+def validate_hermes_upload(mocker, api_client):
     set_up_moto_bucket()
-    patch = mocker.patch('dataregistry.api.batch.submit_and_await_job')
+    patch = mocker.patch('dataregistry.api.job_tracker.submit_job')
     patch.return_value = None
     mocker.patch('boto3.client').return_value.generate_presigned_url.return_value = 'http://mocked-presigned-url'
 
@@ -268,8 +530,9 @@ def test_upload_hermes_csv(mocker, api_client: TestClient):
     with open('tests/test_csv_upload.csv', mode='rb') as f:
         file_bytes = f.read()
 
+    # the file is read once to validate it and once to hash it
     mock_s3_get_object = mocker.patch('boto3.client').return_value.get_object
-    mock_s3_get_object.return_value = {
+    mock_s3_get_object.side_effect = lambda **kwargs: {
         'Body': io.BytesIO(file_bytes),
         'ContentLength': len(file_bytes)
     }
@@ -283,7 +546,13 @@ def test_upload_hermes_csv(mocker, api_client: TestClient):
                                                                                                 "se": "SE",
                                                                                                 "pValue": "P"}},
                                                         'qc_script_options': {'fd': 0.2, 'noind': True}})
-    result_dict = res.json()
+    return res.json()
+
+
+@mock_s3
+@mock_batch
+def test_upload_hermes_csv(mocker, api_client: TestClient):
+    result_dict = validate_hermes_upload(mocker, api_client)
     assert "file_size" in result_dict
     assert "s3_path" in result_dict
     assert "file_id" in result_dict
@@ -310,6 +579,41 @@ def test_upload_hermes_csv(mocker, api_client: TestClient):
     assert len(file_uploads) == 1
 
 
+@mock_s3
+@mock_batch
+def test_deleted_hermes_file_is_not_downloadable(mocker, api_client: TestClient):
+    file_id = validate_hermes_upload(mocker, api_client)['file_id']
+    download_path = f'api/hermes/download/{file_id}'
+    response = api_client.get(download_path, headers={AUTHORIZATION: auth_token}, follow_redirects=False)
+    assert response.status_code == 307
+    response = api_client.delete(f'api/hermes-delete-dataset/{file_id}', headers={AUTHORIZATION: auth_token})
+    assert response.status_code == 204
+    # the path cached by the first download went with the file
+    response = api_client.get(download_path, headers={AUTHORIZATION: auth_token}, follow_redirects=False)
+    assert response.status_code == HTTP_404_NOT_FOUND
+
+
+def test_page_hermes_uploads(api_client: TestClient):
+    file_ids = [query.save_file_upload_info(api.engine, f'page-{i}', {'phenotype': 'T2D'}, f'hermes/page-{i}/foo.csv',
+                                            'foo.csv', 10, 'test', {}).replace('-', '') for i in range(3)]
+    # uploads that share their uploaded_at are ordered by id
+    with api.engine.connect() as conn:
+        conn.execute(text("UPDATE file_uploads SET uploaded_at = '2026-01-01 00:00:00'"))
+        conn.commit()
+    headers = {AUTHORIZATION: auth_token, 'Origin': 'https://kpndataregistry.org'}
+    first_page = api_client.get('api/upload-hermes?limit=2', headers=headers)
+    assert first_page.status_code == HTTP_200_OK
+    assert 'X-Next-Cursor' in first_page.headers['Access-Control-Expose-Headers']
+    cursor = first_page.headers['X-Next-Cursor']
+    second_page = api_client.get('api/upload-hermes', params={'limit': 2, 'cursor': cursor}, headers=headers)
+    assert 'X-Next-Cursor' not in second_page.headers
+    ids = [upload['id'].replace('-', '') for upload in first_page.json() + second_page.json()]
+    assert ids == sorted(file_ids, reverse=True)
+
+    response = api_client.get('api/upload-hermes?limit=2&cursor=not-a-cursor', headers=headers)
+    assert response.status_code == HTTP_400_BAD_REQUEST
+
+
 @mock_s3
 def test_upload_csv(api_client: TestClient):
     set_up_moto_bucket()
@@ -0,0 +1,25 @@
+from dataregistry.api import batch
+
+
+class StubLogsClient:
+    """
+    Serves a log stream in pages of two events the way CloudWatch does, handing back the same token at the end
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.calls = []
+
+    def get_log_events(self, logGroupName, logStreamName, startFromHead, nextToken=None):
+        self.calls.append(nextToken)
+        start = int(nextToken) if nextToken else 0
+        end = min(start + 2, len(self.messages))
+        return {'events': [{'message': message} for message in self.messages[start:end]],
+                'nextForwardToken': str(end) if end > start else nextToken or '0'}
+
+
+def test_iter_log_pages_follows_every_page():
+    logs_client = StubLogsClient([f"event {i}" for i in range(5)])
+    pages = list(batch.iter_log_pages(logs_client, 'stream'))
+    assert pages == [(['event 0', 'event 1'], '2'), (['event 2', 'event 3'], '4'), (['event 4'], '5')]
+    assert list(batch.iter_log_pages(logs_client, 'stream', '5')) == []
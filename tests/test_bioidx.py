@@ -0,0 +1,74 @@
+from uuid import uuid4
+
+from dataregistry.api import bioidx, query, s3
+
+
+class StubIndex:
+    """
+    Records the builds bioidx asks bioindex for, the index already exists
+    """
+    builds = []
+
+    @classmethod
+    def lookup_all(cls, engine, name):
+        return [cls()]
+
+    @classmethod
+    def lookup(cls, engine, name, arity):
+        return cls()
+
+    def prepare(self, engine, rebuild=False):
+        StubIndex.builds.append(rebuild)
+
+    def build(self, config, engine):
+        pass
+
+
+class StubConfig:
+    s3_bucket = 'bioindex-test'
+
+
+def obj(key, etag, size=10):
+    return {'key': key, 'etag': etag, 'size': size}
+
+
+def test_find_changed_objects():
+    indexed = {'a.json': ('1', 10), 'b.json': ('2', 10), 'c.json': ('3', 10)}
+    objects = [obj('a.json', '1'), obj('b.json', '9'), obj('c.json', '3', 20), obj('d.json', '4')]
+    changed, removed = bioidx.find_changed_objects(objects, indexed)
+    assert [o['key'] for o in changed] == ['b.json', 'c.json', 'd.json']
+    assert removed == []
+    changed, removed = bioidx.find_changed_objects([obj('a.json', '1')], indexed)
+    assert changed == [] and removed == ['b.json', 'c.json']
+
+
+def build_index(monkeypatch, objects, indexed, **kwargs):
+    StubIndex.builds = []
+    saved = []
+    monkeypatch.setattr(bioidx, 'Index', StubIndex)
+    monkeypatch.setattr(bioidx.config, 'Config', StubConfig, raising=False)
+    monkeypatch.setattr(s3, 'list_objects_with_etags', lambda prefix, bucket: objects)
+    monkeypatch.setattr(query, 'get_indexed_objects', lambda engine, name: indexed)
+    monkeypatch.setattr(query, 'save_indexed_objects', lambda engine, name, current: saved.append(current))
+    bioidx.create_new_bioindex(None, uuid4(), 'dataset/', 'varId', **kwargs)
+    return StubIndex.builds, saved
+
+
+def test_unchanged_index_is_skipped(monkeypatch):
+    objects = [obj('a.json', '1')]
+    builds, saved = build_index(monkeypatch, objects, {'a.json': ('1', 10)}, skip_unchanged=True)
+    assert builds == [] and saved == []
+
+
+def test_changed_index_is_updated(monkeypatch):
+    objects = [obj('a.json', '2')]
+    builds, saved = build_index(monkeypatch, objects, {'a.json': ('1', 10), 'b.json': ('1', 10)},
+                                skip_unchanged=True)
+    # kept rather than rebuilt, so only the changed object is indexed and the removed one's records are deleted
+    assert builds == [False] and saved == [objects]
+
+
+def test_index_is_rebuilt_by_default(monkeypatch):
+    objects = [obj('a.json', '1')]
+    builds, saved = build_index(monkeypatch, objects, {'a.json': ('1', 10)})
+    assert builds == [True] and saved == [objects]
@@ -0,0 +1,81 @@
+import uuid
+
+from dataregistry.api import ecs, query
+from dataregistry.api.model import BioIndexCreationStatus, SavedCsvBioIndexRequest
+
+
+class StubEcsClient:
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.calls = []
+
+    def describe_tasks(self, cluster, tasks):
+        self.calls.append(tasks)
+        return {'tasks': [self.tasks[arn] for arn in tasks if arn in self.tasks], 'failures': []}
+
+
+def tracked(status, task_arn):
+    return SavedCsvBioIndexRequest(name=uuid.uuid4(), status=status, column='chromosome,position', already_sorted=False,
+                                   s3_path='bioindex/upload.tsv', task_arn=task_arn)
+
+
+def track(monkeypatch, requests):
+    """
+    Stands in for bidx_tracking: a conversion only moves on from the status it is in, and one left indexing is
+    claimed by the first poller to ask for it.
+    """
+    statuses, leases, indexed = {request.name: request.status for request in requests}, {}, []
+
+    def move_bioindex_tracking(engine, name, from_statuses, status, owner=None, lease_seconds=0):
+        if statuses[name] not in from_statuses:
+            return False
+        statuses[name] = status
+        leases[name] = owner
+        return True
+
+    def claim_bioindex_indexing(engine, owner, lease_seconds):
+        return [request for request in requests if statuses[request.name] == BioIndexCreationStatus.INDEXING
+                and leases.setdefault(request.name, owner) == owner]
+
+    monkeypatch.setattr(query, 'get_unfinished_bioindex_tracking',
+                        lambda engine, from_statuses: [request for request in requests
+                                                       if statuses[request.name] in from_statuses])
+    monkeypatch.setattr(query, 'move_bioindex_tracking', move_bioindex_tracking)
+    monkeypatch.setattr(query, 'claim_bioindex_indexing', claim_bioindex_indexing)
+    monkeypatch.setattr(ecs, 'start_indexing', lambda name, columns: indexed.append(name))
+    return statuses, indexed
+
+
+def test_poll_conversions_moves_each_conversion_on(monkeypatch):
+    requests = [tracked(BioIndexCreationStatus.SORTING, f"task-{i}") for i in range(150)]
+    requests.append(tracked(BioIndexCreationStatus.INDEXING, 'task-indexing'))
+    statuses, indexed = track(monkeypatch, requests)
+    tasks = {f"task-{i}": {'taskArn': f"task-{i}", 'lastStatus': 'RUNNING', 'containers': [{}]} for i in range(140)}
+    tasks['task-0'].update(lastStatus='STOPPED', containers=[{'exitCode': 0}])
+    tasks['task-1'].update(lastStatus='STOPPED', containers=[{'exitCode': 1}])
+    ecs_client = StubEcsClient(tasks)
+
+    ecs.poll_conversions(ecs_client)
+    assert [len(call) for call in ecs_client.calls] == [100, 50]
+    assert statuses[requests[0].name] == BioIndexCreationStatus.INDEXING
+    assert statuses[requests[1].name] == BioIndexCreationStatus.FAILED
+    # tasks ECS no longer knows about have failed
+    assert all(statuses[request.name] == BioIndexCreationStatus.FAILED for request in requests[140:150])
+    assert all(statuses[request.name] == BioIndexCreationStatus.SORTING for request in requests[2:140])
+    # the conversion left indexing is picked up again along with the one that just finished converting
+    assert indexed == [requests[150].name, requests[0].name]
+
+
+def test_each_conversion_is_indexed_by_one_poller(monkeypatch):
+    requests = [tracked(BioIndexCreationStatus.CONVERTING_TO_JSON, 'task'),
+                tracked(BioIndexCreationStatus.INDEXING, 'task-indexing')]
+    statuses, indexed = track(monkeypatch, requests)
+    tasks = {'task': {'taskArn': 'task', 'lastStatus': 'STOPPED', 'containers': [{'exitCode': 0}]}}
+
+    # both pollers see the task stop before either has moved the conversion on
+    stale = list(requests)
+    monkeypatch.setattr(query, 'get_unfinished_bioindex_tracking', lambda engine, from_statuses: stale[:1])
+    for poller in ['server-a', 'server-b']:
+        monkeypatch.setattr(ecs, 'POLLER_ID', poller)
+        ecs.poll_conversions(StubEcsClient(tasks))
+    assert indexed == [requests[1].name, requests[0].name]
@@ -0,0 +1,52 @@
+import gzip
+import io
+
+import boto3
+import pandas as pd
+from moto import mock_s3
+
+from dataregistry.api import s3
+from dataregistry.api.hermes_file_validation import VALIDATORS, VECTOR_VALIDATORS, validate_columns, validate_file
+
+SCHEMA = {"chromosome": "CHR", "position": "BP", "pValue": "P", "maf": "MAF", "reference": "REF"}
+
+VALUES = ['', '0', '1', '26', '27', ' 5 ', '+3', '-1', '5.0', '1e-8', '0.5', 'nan', 'inf', 'x', 'ACT', 'D', 'acg']
+
+
+def test_vector_validators_match_row_validators():
+    values = pd.Series(VALUES)
+    for validator, vector_validator in VECTOR_VALIDATORS.items():
+        assert list(vector_validator(values)) == [validator(value) for value in VALUES], validator.__name__
+
+
+def test_validate_columns_reports_first_row_and_count():
+    contents = 'CHR,BP,P,MAF,REF\n1,100,0.5,0.1,A\n27,200,0.1,0.2,C\n2,-5,0.3,0.3,G\n30,400,0.2,0.4,T\n'
+    errors = validate_columns(io.StringIO(contents), SCHEMA, ',', chunk_size=2)
+    assert len(errors) == 2
+    assert errors[0].startswith(VALIDATORS[0]['error'])
+    assert errors[0].endswith('First invalid CHR value at row 2, 2 rows failed.')
+    assert errors[1].endswith('First invalid BP value at row 3, 1 rows failed.')
+
+
+def test_validate_columns_gzip_and_missing_column():
+    contents = 'CHR\tBP\tP\n1\t100\t0.5\n2\t200\n'
+    stream = io.BytesIO(gzip.compress(contents.encode('utf-8')))
+    errors = validate_columns(stream, SCHEMA, '\t', compression='gzip')
+    assert [error.split('. ')[-1] for error in errors] == [
+        'First invalid P value at row 2, 1 rows failed.',
+        'First invalid MAF value at row 1, 2 rows failed.',
+        'First invalid REF value at row 1, 2 rows failed.'
+    ]
+
+
+@mock_s3
+def test_validate_file():
+    s3.reset_s3_client()
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='validation-test')
+    contents = b'CHR,BP,P,MAF,REF\n1,100,0.5,0.1,A\n27,200,0.1,0.2,C\n'
+    s3_client.put_object(Bucket='validation-test', Key='hermes/ds/foo.csv', Body=contents)
+    assert validate_file('s3://validation-test/hermes/ds/foo.csv', SCHEMA) == ([], len(contents))
+    errors, file_size = validate_file('s3://validation-test/hermes/ds/foo.csv', SCHEMA, validate=True)
+    assert file_size == len(contents)
+    assert [error.split('. ')[-1] for error in errors] == ['First invalid CHR value at row 2, 1 rows failed.']
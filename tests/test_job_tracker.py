@@ -0,0 +1,111 @@
+from dataregistry.api import job_tracker, query
+from dataregistry.api.model import HermesFileStatus, TrackedJob
+
+
+class StubLogsClient:
+    def __init__(self, messages):
+        self.messages = messages
+
+    def get_log_events(self, logGroupName, logStreamName, startFromHead, nextToken=None):
+        start = int(nextToken) if nextToken else 0
+        return {'events': [{'message': message} for message in self.messages[start:]],
+                'nextForwardToken': str(len(self.messages))}
+
+
+class StubBatchClient:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = []
+
+    def describe_jobs(self, jobs):
+        self.calls.append(jobs)
+        return {'jobs': [{'jobId': job_id, 'status': self.statuses[job_id], 'container': {'logStreamName': job_id}}
+                         for job_id in jobs if job_id in self.statuses]}
+
+
+def track(monkeypatch, jobs):
+    """
+    Stands in for the jobs table: each job is leased to the first poller that claims it, and a log page is only
+    written while the poller holds the job and the job's saved token is the one the page follows.
+    """
+    logs, statuses, finished, leases, tokens = {}, {}, [], {}, {job.job_id: job.log_token for job in jobs}
+
+    def claim_jobs(engine, owner, lease_seconds):
+        claimed = [job for job in jobs if job not in finished and leases.setdefault(job.job_id, owner) == owner]
+        return [job.copy(update={'log_token': tokens[job.job_id]}) for job in claimed]
+
+    def append_job_log(engine, job, owner, append_log, log_chunk, log_token):
+        if leases.get(job.job_id) != owner or tokens[job.job_id] != job.log_token:
+            return False
+        if log_chunk:
+            append_log(None, log_chunk, job.identifier)
+        tokens[job.job_id] = log_token
+        return True
+
+    def update_job(engine, job, owner, done):
+        if done:
+            finished.append(next(tracked for tracked in jobs if tracked.job_id == job.job_id))
+        return True
+
+    monkeypatch.setattr(query, 'claim_jobs', claim_jobs)
+    monkeypatch.setattr(query, 'append_job_log', append_job_log)
+    monkeypatch.setattr(query, 'update_job', update_job)
+    monkeypatch.setattr(job_tracker, 'JOB_CALLBACKS', {
+        job_tracker.QC_JOB: (lambda conn, chunk, identifier: logs.setdefault(identifier, []).append(chunk),
+                             lambda engine, log, identifier, status: statuses.update({identifier: status}),
+                             job_tracker.qc_status)})
+    return logs, statuses, finished, tokens
+
+
+def test_poll_jobs_resumes_logs_and_finishes_jobs(monkeypatch):
+    jobs = [TrackedJob(job_id='running', kind='qc', identifier='a', status='RUNNING', log_stream_name='running',
+                       log_token='1'),
+            TrackedJob(job_id='failed', kind='qc', identifier='b', status='SUBMITTED')]
+    logs, statuses, finished, tokens = track(monkeypatch, jobs)
+    logs_client = StubLogsClient(['seen before', 'new'])
+    batch_client = StubBatchClient({'running': 'RUNNING', 'failed': 'FAILED'})
+
+    job_tracker.poll_jobs('engine', batch_client, logs_client)
+    assert logs == {'a': ['new\n'], 'b': ['seen before\nnew\n']}
+    assert statuses == {'b': HermesFileStatus.FAILED_QC}
+    assert [job.job_id for job in finished] == ['failed']
+    assert tokens['running'] == '2'
+
+    batch_client.statuses['running'] = 'SUCCEEDED'
+    logs_client.messages.append('done')
+    job_tracker.poll_jobs('engine', batch_client, logs_client)
+    assert logs['a'] == ['new\n', 'done\n']
+    assert statuses['a'] == HermesFileStatus.READY_FOR_REVIEW
+    assert batch_client.calls == [['running', 'failed'], ['running']]
+
+
+def test_poll_jobs_describes_in_batches_and_fails_forgotten_jobs(monkeypatch):
+    jobs = [TrackedJob(job_id=f"job-{i}", kind='qc', identifier=str(i), status='SUBMITTED') for i in range(150)]
+    logs, statuses, finished, _ = track(monkeypatch, jobs)
+    batch_client = StubBatchClient({job.job_id: 'RUNNABLE' for job in jobs[:140]})
+
+    job_tracker.poll_jobs('engine', batch_client, StubLogsClient([]))
+    assert [len(call) for call in batch_client.calls] == [100, 50]
+    assert statuses == {str(i): HermesFileStatus.FAILED_QC for i in range(140, 150)}
+    assert len(finished) == 10
+
+
+def test_each_job_is_followed_by_one_poller(monkeypatch):
+    jobs = [TrackedJob(job_id='running', kind='qc', identifier='a', status='RUNNING')]
+    logs, statuses, finished, tokens = track(monkeypatch, jobs)
+    logs_client = StubLogsClient(['first'])
+    batch_client = StubBatchClient({'running': 'RUNNING'})
+
+    job_tracker.poll_jobs('engine', batch_client, logs_client, owner='worker-1')
+    job_tracker.poll_jobs('engine', batch_client, logs_client, owner='worker-2')
+    assert logs == {'a': ['first\n']}
+    assert batch_client.calls == [['running']]
+
+    # a page is written once even when a poller's view of the job is out of date
+    logs_client.messages.append('second')
+    stale = jobs[0].copy(update={'log_token': None})
+    job_tracker.update_job('engine', stale, {'status': 'RUNNING'}, logs_client, 'worker-1')
+    assert logs == {'a': ['first\n']}
+    job_tracker.poll_jobs('engine', batch_client, logs_client, owner='worker-1')
+    assert logs == {'a': ['first\n', 'second\n']}
+    assert tokens['running'] == '2'
@@ -0,0 +1,33 @@
+import pytest
+
+from dataregistry.api import logs
+
+LOG_TEXT = ''.join(f'line {i}\n' for i in range(20000))
+
+
+def appended_log():
+    return logs.compress_log(LOG_TEXT[:50000]) + logs.compress_log(LOG_TEXT[50000:])
+
+
+def test_appended_members_read_as_one_log():
+    compressed = appended_log()
+    assert logs.read_log(compressed) == LOG_TEXT
+    assert b''.join(logs.iter_log(compressed, chunk_size=100)) == LOG_TEXT.encode('utf-8')
+    assert logs.log_size(compressed) == len(LOG_TEXT)
+
+
+def test_range_and_tail():
+    compressed = appended_log()
+    assert b''.join(logs.iter_log_range(compressed, 49990, 50010)) == LOG_TEXT.encode('utf-8')[49990:50011]
+    assert logs.tail_log(compressed, 2) == b'line 19998\nline 19999\n'
+    assert logs.tail_log(logs.compress_log('a\nb\nc'), 2) == b'b\nc'
+
+
+def test_parse_range():
+    assert logs.parse_range(None, 100) is None
+    assert logs.parse_range('bytes=-10', 100) == (90, 99)
+    assert logs.parse_range('bytes=5-', 100) == (5, 99)
+    assert logs.parse_range('bytes=5-500', 100) == (5, 99)
+    for invalid in ['bytes=200-', 'bytes=-', 'lines=1-2', 'bytes=5-1']:
+        with pytest.raises(ValueError):
+            logs.parse_range(invalid, 100)
@@ -0,0 +1,123 @@
+from dataregistry.api import meta_analysis_staging, job_tracker, query, s3, s3_copy
+from dataregistry.api.model import HermesMetaAnalysisStatus, MetaAnalysisStaging
+
+
+class DeferredExecutor:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append((fn, args))
+
+    def run_all(self):
+        calls, self.calls = self.calls, []
+        for fn, args in calls:
+            fn(*args)
+
+
+def stage(monkeypatch, ma_ids):
+    """
+    Stands in for the meta_analysis_stagings, leases and jobs tables: leases only run out when a test expires them,
+    and a staging can only be taken while no meta-analysis job is unfinished.
+    """
+    stagings = {ma_id: MetaAnalysisStaging(meta_analysis_id=ma_id, stage='QUEUED', prefixes=[['from/', 'to/']],
+                                           job_config={'jobName': ma_id}) for ma_id in ma_ids}
+    tables = {'stagings': stagings, 'leases': {}, 'prefixes_lease': None, 'jobs': [], 'statuses': {}}
+
+    def claim_lease(engine, name, owner, lease_seconds):
+        if tables['prefixes_lease'] in (None, owner):
+            tables['prefixes_lease'] = owner
+            return True
+        return False
+
+    def release_lease(engine, name, owner):
+        if tables['prefixes_lease'] == owner:
+            tables['prefixes_lease'] = None
+
+    def claim_meta_analysis_staging(engine, owner, lease_seconds, job_kind):
+        queued = [staging for staging in stagings.values() if staging.stage == 'QUEUED']
+        if tables['jobs'] or not queued:
+            return None
+        stagings[queued[0].meta_analysis_id] = queued[0].copy(update={'stage': 'CLEARING'})
+        tables['leases'][queued[0].meta_analysis_id] = owner
+        return stagings[queued[0].meta_analysis_id]
+
+    def update_meta_analysis_staging(engine, staging, owner, lease_seconds=0, finished=False):
+        if tables['leases'].get(staging.meta_analysis_id) != owner:
+            return False
+        stagings[staging.meta_analysis_id] = staging
+        if finished:
+            tables['leases'].pop(staging.meta_analysis_id)
+        return True
+
+    def fail_abandoned_meta_analysis_stagings(engine):
+        abandoned = [ma_id for ma_id, owner in tables['leases'].items() if owner == 'gone']
+        for ma_id in abandoned:
+            stagings[ma_id] = stagings[ma_id].copy(update={'stage': 'FAILED'})
+            tables['leases'].pop(ma_id)
+        return abandoned
+
+    monkeypatch.setattr(query, 'claim_lease', claim_lease)
+    monkeypatch.setattr(query, 'release_lease', release_lease)
+    monkeypatch.setattr(query, 'claim_meta_analysis_staging', claim_meta_analysis_staging)
+    monkeypatch.setattr(query, 'update_meta_analysis_staging', update_meta_analysis_staging)
+    monkeypatch.setattr(query, 'fail_abandoned_meta_analysis_stagings', fail_abandoned_meta_analysis_stagings)
+    monkeypatch.setattr(query, 'update_meta_analysis_log',
+                        lambda engine, log, ma_id, status: tables['statuses'].update({ma_id: status}))
+    monkeypatch.setattr(job_tracker, 'submit_job',
+                        lambda engine, job_config, kind, identifier: tables['jobs'].append(identifier))
+    monkeypatch.setattr(s3, 'clear_meta_analysis_dirs', lambda progress: progress.add(3))
+    monkeypatch.setattr(s3_copy, 'copy_prefixes', lambda prefixes, progress: progress.add(10))
+    monkeypatch.setattr(meta_analysis_staging, 'running', {})
+    executor = DeferredExecutor()
+    monkeypatch.setattr(meta_analysis_staging, 'executor', executor)
+    return tables, executor
+
+
+def test_stagings_wait_for_the_prefixes(monkeypatch):
+    tables, executor = stage(monkeypatch, ['first', 'second'])
+    stagings = tables['stagings']
+
+    meta_analysis_staging.poll_stagings(None, 'server-a')
+    meta_analysis_staging.poll_stagings(None, 'server-b')
+    assert [stagings['first'].stage, stagings['second'].stage] == ['CLEARING', 'QUEUED']
+    assert tables['prefixes_lease'] == 'server-a'
+
+    executor.run_all()
+    assert stagings['first'].stage == 'SUBMITTED'
+    assert (stagings['first'].deleted_objects, stagings['first'].copied_objects) == (3, 1)
+    assert tables['jobs'] == ['first'] and tables['prefixes_lease'] is None
+
+    # the first job still reads the prefixes
+    meta_analysis_staging.poll_stagings(None, 'server-b')
+    assert stagings['second'].stage == 'QUEUED'
+    tables['jobs'].clear()
+    meta_analysis_staging.poll_stagings(None, 'server-b')
+    executor.run_all()
+    assert stagings['second'].stage == 'SUBMITTED'
+    assert tables['jobs'] == ['second']
+
+
+def test_failed_staging_frees_the_prefixes(monkeypatch):
+    tables, executor = stage(monkeypatch, ['broken'])
+
+    def copy_prefixes(prefixes, progress):
+        raise RuntimeError("copy failed")
+    monkeypatch.setattr(s3_copy, 'copy_prefixes', copy_prefixes)
+    meta_analysis_staging.poll_stagings(None, 'server-a')
+    executor.run_all()
+    assert tables['stagings']['broken'].stage == 'FAILED'
+    assert tables['statuses'] == {'broken': HermesMetaAnalysisStatus.FAILED}
+    assert tables['jobs'] == [] and tables['prefixes_lease'] is None
+
+
+def test_abandoned_staging_is_failed(monkeypatch):
+    tables, executor = stage(monkeypatch, ['abandoned'])
+    meta_analysis_staging.poll_stagings(None, 'gone')
+    # its server stopped before running it
+    meta_analysis_staging.running.clear()
+    tables['prefixes_lease'] = None
+
+    meta_analysis_staging.poll_stagings(None, 'server-a')
+    assert tables['stagings']['abandoned'].stage == 'FAILED'
+    assert tables['statuses'] == {'abandoned': HermesMetaAnalysisStatus.FAILED}
@@ -0,0 +1,54 @@
+import os
+
+import boto3
+from moto import mock_s3
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+from dataregistry.api import s3, s3_copy
+
+
+@mock_s3
+def test_copy_prefixes_copies_small_and_large_objects(monkeypatch):
+    s3.reset_s3_client()
+    monkeypatch.setattr(s3_copy, 'MULTIPART_COPY_THRESHOLD', 8 * 1024 * 1024)
+    monkeypatch.setattr(s3_copy, 'PART_SIZE', 5 * 1024 * 1024)
+    s3_client = boto3.client('s3', region_name=s3.S3_REGION)
+    s3_client.create_bucket(Bucket=s3.BASE_BUCKET)
+    large = os.urandom(12 * 1024 * 1024)
+    s3_client.put_object(Bucket=s3.BASE_BUCKET, Key='hermes/a/large.tsv.gz', Body=large)
+    s3_client.put_object(Bucket=s3.BASE_BUCKET, Key='hermes/a/metadata', Body=b'{}')
+    s3_client.put_object(Bucket=s3.BASE_BUCKET, Key='hermes/b/small.tsv.gz', Body=b'small')
+
+    progress = s3_copy.copy_prefixes([('hermes/a/', 'hermes/variants_raw/GWAS/a/T2D'),
+                                      ('hermes/b/', 'hermes/variants_raw/GWAS/b/T2D')])
+    assert (progress.copied_objects, progress.copied_bytes) == (3, len(large) + 7)
+    copied = s3_client.list_objects_v2(Bucket=s3.BASE_BUCKET, Prefix='hermes/variants_raw/')['Contents']
+    assert sorted(obj['Key'] for obj in copied) == ['hermes/variants_raw/GWAS/a/T2D/large.tsv.gz',
+                                                    'hermes/variants_raw/GWAS/a/T2D/metadata',
+                                                    'hermes/variants_raw/GWAS/b/T2D/small.tsv.gz']
+    body = s3_client.get_object(Bucket=s3.BASE_BUCKET, Key='hermes/variants_raw/GWAS/a/T2D/large.tsv.gz')['Body']
+    assert body.read() == large
+    # the large object was copied in three parts
+    head = s3_client.head_object(Bucket=s3.BASE_BUCKET, Key='hermes/variants_raw/GWAS/a/T2D/large.tsv.gz')
+    assert head['ETag'].strip('"').endswith('-3')
+    s3.reset_s3_client()
+
+
+@mock_s3
+def test_clear_dirs_deletes_every_page(monkeypatch):
+    s3.reset_s3_client()
+    s3_client = boto3.client('s3', region_name=s3.S3_REGION)
+    s3_client.create_bucket(Bucket=s3.BASE_BUCKET)
+    for i in range(1100):
+        s3_client.put_object(Bucket=s3.BASE_BUCKET, Key=f"hermes/variants_raw/GWAS/a/{i}", Body=b'')
+    for i in range(5):
+        s3_client.put_object(Bucket=s3.BASE_BUCKET, Key=f"hermes/out/metaanalysis/{i}", Body=b'')
+    s3_client.put_object(Bucket=s3.BASE_BUCKET, Key='hermes/a/kept', Body=b'')
+
+    progress = s3.clear_meta_analysis_dirs()
+    assert progress.deleted_objects == 1105
+    remaining = s3_client.list_objects_v2(Bucket=s3.BASE_BUCKET)['Contents']
+    assert [obj['Key'] for obj in remaining] == ['hermes/a/kept']
+    s3.reset_s3_client()
@@ -0,0 +1,107 @@
+import json
+import os
+import sys
+
+import boto3
+from moto import mock_s3
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'batch'))
+
+import sort_file
+
+SCHEMA = {"CHR": "TEXT", "BP": "INTEGER", "ID": "TEXT", "P": "DECIMAL"}
+
+
+def write_tsv(path, rows):
+    with open(path, 'w') as f:
+        f.write('CHR\tBP\tID\tP\n')
+        for row in rows:
+            f.write('\t'.join(row) + '\n')
+
+
+def unsorted_rows():
+    return [['2', '15', 'rs1', '0.5'], ['10', '3', 'rs2', '0.01'], ['2', '', 'rs3', '0.2'],
+            ['1', '20', 'rs4', '1e-08'], ['2', '4', 'rs5', ''], ['1', '100', 'rs6', '0.9'],
+            ['10', '3', 'rs7', '0.3']]
+
+
+def test_sort_and_convert_is_typed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_tsv('data.tsv', unsorted_rows())
+    with sort_file.ShardedWriter(sort_file.local_shards('.'), 'data') as writer:
+        sort_file.sort_and_convert('data.tsv', writer, ['BP'], SCHEMA, run_size=3, workers=1)
+    with open('data-00000.json') as f:
+        positions = [json.loads(line)['BP'] for line in f.read().splitlines()]
+    assert positions == [None, 3, 3, 4, 15, 20, 100]
+
+
+def test_sort_and_convert_matches_two_pass_conversion(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_tsv('data.tsv', unsorted_rows())
+    sqlite_sorted = sort_file.sort_file('data.tsv', ['CHR', 'BP'], SCHEMA)
+    sort_file.csv_to_jsonl(sqlite_sorted, 'expected.json', SCHEMA)
+    with sort_file.ShardedWriter(sort_file.local_shards('.'), 'actual') as writer:
+        sort_file.sort_and_convert('data.tsv', writer, ['CHR', 'BP'], SCHEMA, run_size=2, workers=2, block_size=40)
+    with open('expected.json') as expected, open('actual-00000.json') as actual:
+        assert [json.loads(line) for line in actual] == [json.loads(line) for line in expected]
+
+
+def test_convert_sorted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_tsv('data.tsv', unsorted_rows())
+    with sort_file.ShardedWriter(sort_file.local_shards('.'), 'data') as writer:
+        sort_file.convert_sorted('data.tsv', writer, ['CHR'], SCHEMA, chunk_size=3, workers=2, block_size=30)
+    with open('data-00000.json') as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 7
+    assert records[2] == {"CHR": "2", "BP": None, "ID": "rs3", "P": 0.2}
+    assert records[4] == {"CHR": "2", "BP": 4, "ID": "rs5", "P": None}
+
+
+def test_block_ranges_end_on_newlines(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_tsv('data.tsv', unsorted_rows())
+    ranges = sort_file.block_ranges('data.tsv', block_size=20)
+    with open('data.tsv', 'rb') as f:
+        contents = f.read()
+    assert ranges[0][0] == contents.index(b'\n') + 1
+    assert ranges[-1][1] == len(contents)
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert end == next_start
+        assert contents[end - 1:end] == b'\n'
+
+
+@mock_s3
+def test_convert_streaming(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_tsv('data.tsv', unsorted_rows())
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='converter-test')
+    s3_client.upload_file('data.tsv', 'converter-test', 'bioindex/uploads/data.tsv')
+    sort_file.convert_streaming('s3://converter-test/bioindex/uploads/data.tsv', ['CHR', 'BP'], SCHEMA, False,
+                                'abc123', run_size=2, workers=1, block_size=40)
+    body = s3_client.get_object(Bucket='converter-test', Key='bioindex/abc123/data-00000.json')['Body'].read()
+    records = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+    assert [(record['CHR'], record['BP']) for record in records] == \
+           [('1', 20), ('1', 100), ('10', 3), ('10', 3), ('2', None), ('2', 4), ('2', 15)]
+    assert os.listdir(tmp_path) == ['data.tsv']
+    # the runs were spilled to s3 and removed once merged
+    assert 'Contents' not in s3_client.list_objects_v2(Bucket='converter-test', Prefix='bioindex/runs/')
+
+
+@mock_s3
+def test_sharded_output_keeps_keys_together(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_tsv('data.tsv', unsorted_rows())
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='converter-test')
+    s3_client.upload_file('data.tsv', 'converter-test', 'bioindex/uploads/data.tsv')
+    sort_file.convert_streaming('s3://converter-test/bioindex/uploads/data.tsv', ['CHR'], SCHEMA, False, 'abc123',
+                                run_size=2, workers=1, block_size=40, shard_size=1)
+    manifest = json.loads(s3_client.get_object(Bucket='converter-test',
+                                               Key='bioindex/manifests/abc123.json')['Body'].read())
+    assert [(shard['first_key'], shard['last_key'], shard['records']) for shard in manifest['shards']] == \
+           [(['1'], ['1'], 2), (['10'], ['10'], 2), (['2'], ['2'], 3)]
+    for shard in manifest['shards']:
+        body = s3_client.get_object(Bucket='converter-test', Key=f"bioindex/abc123/{shard['file']}")['Body'].read()
+        assert {json.loads(line)['CHR'] for line in body.decode('utf-8').splitlines()} == set(shard['first_key'])
@@ -0,0 +1,24 @@
+from dataregistry.api import ttl_cache
+from dataregistry.api.ttl_cache import TTLCache
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ttl_cache.time, 'monotonic', lambda: now[0])
+    cache = TTLCache(ttl=60)
+    cache.set(('bucket', 'key'), 'https://signed')
+    now[0] += 59
+    assert cache.get(('bucket', 'key')) == 'https://signed'
+    now[0] += 1
+    assert cache.get(('bucket', 'key')) is None
+
+
+def test_oldest_entry_is_dropped_when_full():
+    cache = TTLCache(ttl=60, max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (None, 2, 3)
+    cache.pop('b')
+    cache.clear()
+    assert cache.get('c') is None
@@ -0,0 +1,77 @@
+import asyncio
+import gzip
+import hashlib
+import os
+
+import boto3
+from moto import mock_s3
+from streaming_form_data import StreamingFormDataParser
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+from dataregistry.api import s3, upload_target
+
+BOUNDARY = 'upload-boundary'
+
+
+def form_body(contents: bytes) -> bytes:
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="data.tsv"\r\n'
+            f'Content-Type: text/plain\r\n\r\n').encode() + contents + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+async def stream(target, body: bytes, chunk_size: int):
+    parser = StreamingFormDataParser({'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'})
+    parser.register('file', target)
+    await target.open()
+    for start in range(0, len(body), chunk_size):
+        parser.data_received(body[start:start + chunk_size])
+        await target.drain()
+    return await target.complete()
+
+
+def upload(contents: bytes, part_size: int):
+    target = upload_target.MultipartS3Target('uploads', 'data.tsv')
+    target.part_size = part_size
+    return target, asyncio.run(stream(target, form_body(contents), 1024 * 1024))
+
+
+@mock_s3
+def test_multipart_target_uploads_parts():
+    s3.reset_s3_client()
+    s3_client = boto3.client('s3', region_name=s3.S3_REGION)
+    s3_client.create_bucket(Bucket=s3.BASE_BUCKET)
+    contents = os.urandom(12 * 1024 * 1024)
+
+    target, stats = upload(contents, 5 * 1024 * 1024)
+    assert len(target._uploads) == 3
+    assert stats.sha256 == hashlib.sha256(contents).hexdigest()
+    assert s3_client.get_object(Bucket=s3.BASE_BUCKET, Key='uploads/data.tsv')['Body'].read() == contents
+
+    upload(b'', 5 * 1024 * 1024)
+    assert s3_client.get_object(Bucket=s3.BASE_BUCKET, Key='uploads/data.tsv')['Body'].read() == b''
+    assert s3_client.list_multipart_uploads(Bucket=s3.BASE_BUCKET).get('Uploads', []) == []
+    s3.reset_s3_client()
+
+
+def test_choose_part_size():
+    assert upload_target.choose_part_size(None) == upload_target.MIN_PART_SIZE
+    assert upload_target.choose_part_size(20 * 1024 ** 3) == 20 * 1024 ** 3 // 1000 + 1
+    assert upload_target.choose_part_size(500 * 1024 ** 3) == upload_target.MAX_PART_SIZE
+
+
+def test_upload_stats_for_plain_and_gzipped_files():
+    text = b'CHR\tBP\tP\n' + b''.join(f"{i % 22 + 1}\t{i}\t0.5\n".encode() for i in range(100000))
+    # written the way block-gzip tools do, as several gzip members
+    gzipped = b''.join(gzip.compress(text[start:start + 500000]) for start in range(0, len(text), 500000))
+    for contents, is_gzipped in [(text, False), (text.rstrip(b'\n'), False), (gzipped, True)]:
+        stats = upload_target.UploadStats()
+        for start in range(0, len(contents), 65536):
+            stats.update(contents[start:start + 65536])
+        result = stats.result()
+        assert result.sha256 == hashlib.sha256(contents).hexdigest()
+        assert result.gzipped == is_gzipped
+        assert result.row_count == 100000
+        assert result.header_sample.startswith('CHR\tBP\tP\n1\t0\t0.5\n')
+        assert result.header_sample.endswith('\n')
+        assert len(result.header_sample) <= upload_target.HEADER_SAMPLE_BYTES
@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+import threading
+
+from dataregistry.api import query, validation_pool
+
+
+def track(monkeypatch):
+    """
+    Stands in for validation_jobs, which every server reads a job's status from
+    """
+    table = {}
+
+    def insert_validation_job(engine, job_id, user_name):
+        table[job_id] = {'job_id': job_id, 'user_name': user_name, 'status': 'RUNNING', 'result': None,
+                         'submitted_at': datetime.datetime.now()}
+
+    def finish_validation_job(engine, job_id, status, result):
+        table[job_id].update(status=status, result=result)
+
+    monkeypatch.setattr(query, 'delete_expired_validation_jobs', lambda engine, retention_seconds: None)
+    monkeypatch.setattr(query, 'insert_validation_job', insert_validation_job)
+    monkeypatch.setattr(query, 'finish_validation_job', finish_validation_job)
+    monkeypatch.setattr(query, 'get_validation_job', lambda engine, job_id: table.get(job_id))
+    return table
+
+
+def test_wait_returns_finished_result(monkeypatch):
+    track(monkeypatch)
+    job_id = validation_pool.submit(None, 'test', lambda x: x * 2, 21)
+    assert asyncio.run(validation_pool.wait(None, job_id)) == 42
+    job = validation_pool.get_job(None, job_id)
+    assert validation_pool.job_status(job) == {'job_id': job_id, 'status': 'COMPLETE', 'result': 42}
+
+
+def test_slow_job_keeps_running_after_wait(monkeypatch):
+    track(monkeypatch)
+    release = threading.Event()
+    job_id = validation_pool.submit(None, 'test', release.wait)
+    future = validation_pool.running[job_id]
+    assert asyncio.run(validation_pool.wait(None, job_id, timeout=0.1)) is None
+    assert validation_pool.job_status(validation_pool.get_job(None, job_id))['status'] == 'RUNNING'
+    release.set()
+    future.result(timeout=5)
+    assert validation_pool.job_status(validation_pool.get_job(None, job_id))['status'] == 'COMPLETE'
+    assert job_id not in validation_pool.running
+
+
+def test_failed_and_lost_jobs(monkeypatch):
+    table = track(monkeypatch)
+
+    def fail():
+        raise ValueError('bad file')
+
+    job_id = validation_pool.submit(None, 'test', fail)
+    asyncio.run(validation_pool.wait(None, job_id))
+    assert validation_pool.job_status(table[job_id]) == {'job_id': job_id, 'status': 'FAILED', 'detail': 'bad file'}
+
+    # a job still running long after it was submitted went away with the server running it
+    table['lost'] = {'job_id': 'lost', 'user_name': 'test', 'status': 'RUNNING', 'result': None,
+                     'submitted_at': datetime.datetime.now() - datetime.timedelta(days=1)}
+    assert validation_pool.job_status(table['lost'])['status'] == 'FAILED'